@@ -0,0 +1,92 @@
+"""封面处理基准测试：对比旧的逐行粘贴实现与 CoverProcessor
+
+用法：python benchmarks/bench_cover.py [--runs 20]
+"""
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+from PIL import Image, ImageChops, ImageFilter, ImageOps, ImageStat
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from utils.cover_processor import CoverProcessor  # noqa: E402
+
+
+def legacy_render(data: bytes) -> bytes:
+    """旧实现：原始分辨率上逐行粘贴边缘、整图模糊后再缩放"""
+    img = Image.open(BytesIO(data))
+    max_side = max(img.width, img.height)
+    square_img = Image.new('RGB', (max_side, max_side), (255, 255, 255))
+    x_offset = (max_side - img.width) // 2
+    y_offset = (max_side - img.height) // 2
+    square_img.paste(img, (x_offset, y_offset))
+
+    if img.width < max_side:
+        left_edge = img.crop((0, 0, 1, img.height))
+        right_edge = img.crop((img.width - 1, 0, img.width, img.height))
+        for x in range(0, x_offset):
+            square_img.paste(left_edge, (x, y_offset))
+        for x in range(x_offset + img.width, max_side):
+            square_img.paste(right_edge, (x, y_offset))
+
+    if img.height < max_side:
+        top_edge = img.crop((0, 0, img.width, 1))
+        bottom_edge = img.crop((0, img.height - 1, img.width, img.height))
+        for y in range(0, y_offset):
+            square_img.paste(top_edge, (x_offset, y))
+        for y in range(y_offset + img.height, max_side):
+            square_img.paste(bottom_edge, (x_offset, y))
+
+    mask = Image.new('L', square_img.size, 0)
+    mask.paste(255, (x_offset, y_offset, x_offset + img.width, y_offset + img.height))
+    mask = ImageOps.invert(mask)
+    blurred = square_img.filter(ImageFilter.GaussianBlur(radius=10))
+    square_img.paste(blurred, mask=mask)
+
+    img = square_img.resize((400, 400), Image.Resampling.LANCZOS)
+    output = BytesIO()
+    img.save(output, format='JPEG', quality=95)
+    return output.getvalue()
+
+
+def make_thumbnail(width: int, height: int) -> bytes:
+    """生成带渐变和噪点的测试封面"""
+    gradient = Image.linear_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 40)
+    img = Image.merge('RGB', (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    output = BytesIO()
+    img.save(output, format='JPEG', quality=90)
+    return output.getvalue()
+
+
+def bench(func, data: bytes, runs: int) -> float:
+    """返回平均每张封面的耗时（毫秒）"""
+    func(data)
+    start = time.perf_counter()
+    for _ in range(runs):
+        func(data)
+    return (time.perf_counter() - start) * 1000 / runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='封面处理基准测试')
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    processor = CoverProcessor()
+    print(f"{'尺寸':>12} {'旧实现 ms':>10} {'新实现 ms':>10} {'加速':>7} {'平均像素差':>10}")
+    for width, height in [(1920, 1080), (1280, 720), (1080, 1920), (640, 360), (320, 180)]:
+        data = make_thumbnail(width, height)
+        legacy_ms = bench(legacy_render, data, args.runs)
+        new_ms = bench(processor.render, data, args.runs)
+        diff = ImageChops.difference(Image.open(BytesIO(legacy_render(data))),
+                                     Image.open(BytesIO(processor.render(data))))
+        mean_diff = sum(ImageStat.Stat(diff).mean) / 3
+        print(f"{width:>5}x{height:<6} {legacy_ms:>10.1f} {new_ms:>10.1f} {legacy_ms / new_ms:>6.1f}x {mean_diff:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
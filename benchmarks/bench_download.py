@@ -0,0 +1,161 @@
+"""下载流程端到端基准测试：在本地替身服务器上运行完整的下载流程
+
+每个场景在独立的子进程中运行（CPU 时间和峰值内存只统计下载端），分别测量：
+direct 直接调用 BiliDownloader.download；flask 通过 /check_playlist、/download 和
+/task_events 接口提交并跟踪任务。
+
+用法：python benchmarks/bench_download.py [--sizes 1,5,20] [--modes direct,flask]
+      [--audio-size 2M] [--latency 0.02] [--bandwidth 0] [--audio-format original]
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, '..', 'src')
+sys.path.insert(0, BENCH_DIR)
+
+from bili_server import StandInServer, attach, parse_size  # noqa: E402
+
+
+def _download_direct(base_url: str, bvid: str, on_parts):
+    from utils.downloader import BiliDownloader
+    downloader = attach(BiliDownloader(), base_url)
+    done = 0
+    for event in downloader.download(bvid, 'bench'):
+        if event['status'] == 'success':
+            done += 1
+            on_parts(done)
+        elif event['status'] == 'failed':
+            return 1
+    return 0
+
+
+def _download_flask(base_url: str, bvid: str, on_parts):
+    import app as web
+    attach(web.task_manager.downloader, base_url)
+    client = web.app.test_client()
+
+    client.post('/check_playlist', json={'bvid': bvid})
+    result = client.post('/download', json={'bvid': bvid, 'output_dir': 'bench'}).get_json()
+    if not result.get('success'):
+        raise RuntimeError(result.get('error'))
+
+    # 与页面一样通过 SSE 跟踪任务进度（推送会合并，按 parts_done 计数）
+    response = client.get(f"/task_events?task_id={result['task_id']}", buffered=False)
+    try:
+        for chunk in response.response:
+            for line in chunk.decode().splitlines():
+                if not line.startswith('data: '):
+                    continue
+                delta = json.loads(line[6:])
+                if 'parts_done' in delta:
+                    on_parts(delta['parts_done'])
+                if delta.get('status') in ('completed', 'failed'):
+                    return int(delta['status'] == 'failed')
+    finally:
+        response.close()
+    return 1
+
+
+def run_scenario(mode: str, base_url: str, bvid: str, workdir: str, options: dict, results):
+    """在子进程中运行一个场景，结果放入 results 队列"""
+    os.chdir(workdir)
+    os.environ.update({
+        'DB_PATH': os.path.join(workdir, 'bench.db'),
+        'DOWNLOAD_DIR': os.path.join(workdir, 'audiobooks'),
+        'COVER_CACHE_DIR': os.path.join(workdir, 'cover_cache'),
+        'AUDIO_FORMAT': options['audio_format'],
+        **({'PART_WORKERS': str(options['part_workers'])} if options.get('part_workers') else {})
+    })
+    logging.disable(logging.WARNING)
+    sys.path.insert(0, SRC_DIR)
+
+    progress = {'parts': 0, 'first': None}
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+
+    def on_parts(done: int):
+        progress['parts'] = done
+        if progress['first'] is None:
+            progress['first'] = time.perf_counter() - start
+
+    try:
+        runner = _download_direct if mode == 'direct' else _download_flask
+        failed = runner(base_url, bvid, on_parts)
+        error = None
+    except Exception as e:
+        failed, error = 1, str(e)
+
+    results.put({
+        'parts': progress['parts'],
+        'failed': failed,
+        'error': error,
+        'wall': time.perf_counter() - start,
+        'first': progress['first'],
+        'cpu': time.process_time() - cpu_start,
+        # Linux 上 ru_maxrss 的单位为 KiB
+        'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description='下载流程端到端基准测试')
+    parser.add_argument('--sizes', default='1,5,20', help='播放列表分 P 数，逗号分隔')
+    parser.add_argument('--modes', default='direct,flask', help='direct、flask，逗号分隔')
+    parser.add_argument('--audio-size', type=parse_size, default='2M', help='每个分 P 的音频大小')
+    parser.add_argument('--latency', type=float, default=0.02, help='每个请求的延迟（秒）')
+    parser.add_argument('--bandwidth', type=parse_size, default='0', help='每个连接的带宽（字节/秒，0 不限速）')
+    parser.add_argument('--audio-format', default='original', help='输出格式（m4a/mp3 需要 FFmpeg）')
+    parser.add_argument('--part-workers', type=int, default=0, help='单任务并发分 P 数（默认使用 PART_WORKERS）')
+    parser.add_argument('--timeout', type=float, default=600, help='单个场景的超时时间（秒）')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    modes = [mode for mode in args.modes.split(',') if mode]
+    videos = {f'BV1bench{size:04d}': size for size in sizes}
+    server = StandInServer(videos, audio_size=args.audio_size, latency=args.latency,
+                           bandwidth=args.bandwidth).start()
+    options = {'audio_format': args.audio_format, 'part_workers': args.part_workers}
+    context = multiprocessing.get_context('spawn')
+
+    print(f"替身服务器：{server.url}，音频 {args.audio_size / 1024 / 1024:.1f} MiB，"
+          f"延迟 {args.latency * 1000:.0f} ms，带宽 {args.bandwidth / 1024 / 1024:.1f} MiB/s（0 为不限速）")
+    print(f"{'模式':>6} {'分P':>4} {'耗时 s':>8} {'分P/分钟':>9} {'首个分P s':>10} "
+          f"{'CPU s/分P':>10} {'峰值内存 MiB':>12} {'请求/分P':>9}")
+    try:
+        for mode in modes:
+            for size in sizes:
+                with tempfile.TemporaryDirectory(prefix='bilipala-bench-') as workdir:
+                    before = sum(server.snapshot().values())
+                    results = context.Queue()
+                    process = context.Process(target=run_scenario, args=(
+                        mode, server.url, f'BV1bench{size:04d}', workdir, options, results))
+                    process.start()
+                    try:
+                        result = results.get(timeout=args.timeout)
+                    finally:
+                        process.join(5)
+                        if process.is_alive():
+                            process.terminate()
+                    requests = sum(server.snapshot().values()) - before
+
+                parts = max(result['parts'], 1)
+                first = f"{result['first']:.2f}" if result['first'] is not None else '-'
+                print(f"{mode:>6} {size:>4} {result['wall']:>8.2f} {result['parts'] / result['wall'] * 60:>9.1f} "
+                      f"{first:>10} {result['cpu'] / parts:>10.3f} {result['rss']:>12.1f} {requests / parts:>9.1f}")
+                if result['failed'] or result['parts'] < size:
+                    print(f"       完成 {result['parts']}/{size} 个分 P"
+                          f"{'：' + result['error'] if result['error'] else ''}")
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,352 @@
+"""本地 B 站替身服务器：模拟视频页、view/pagelist/playurl/合集接口、封面和音频流
+
+音频流支持 Range 请求，可设置每个请求的延迟和每个连接的带宽，用于在没有网络的环境下
+测量下载流程的性能。attach() 把 BiliDownloader 指向替身服务器。
+
+用法：python benchmarks/bili_server.py [--port 8000] [--parts 10] [--latency 0.05] [--bandwidth 4M]
+"""
+import argparse
+import json
+import re
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from typing import Dict, Optional
+
+from yt_dlp.extractor.common import InfoExtractor
+from yt_dlp.utils import parse_qs
+
+
+def _atom(kind: bytes, payload: bytes, full: bool = False) -> bytes:
+    if full:
+        payload = b'\x00\x00\x00\x00' + payload
+    return struct.pack('>I', len(payload) + 8) + kind + payload
+
+
+def make_m4a(size: int) -> bytes:
+    """生成约 size 字节的 m4a 文件（一条空音轨，其余为 mdat 填充），可以写入 MP4 标签"""
+    header = _atom(b'ftyp', b'M4A \x00\x00\x00\x00M4A mp42isom') + _atom(b'moov', (
+        _atom(b'mvhd', struct.pack('>IIII', 0, 0, 1000, 0) + b'\x00' * 80, full=True)
+        + _atom(b'trak', _atom(b'mdia', (
+            _atom(b'mdhd', struct.pack('>IIIIHH', 0, 0, 44100, 44100, 0, 0), full=True)
+            + _atom(b'hdlr', b'\x00' * 4 + b'soun' + b'\x00' * 13, full=True)
+            + _atom(b'minf', _atom(b'stbl', _atom(b'stsd', b'\x00' * 4, full=True)))
+        )))
+    ))
+    padding = max(size - len(header) - 8, 0)
+    # 填充内容不全为零，避免传输层压缩影响带宽测量
+    pattern = bytes(range(256))
+    return header + _atom(b'mdat', (pattern * (padding // 256 + 1))[:padding])
+
+
+def make_thumbnail(width: int = 640, height: int = 360) -> bytes:
+    """生成测试封面"""
+    from PIL import Image
+    gradient = Image.linear_gradient('L').resize((width, height))
+    img = Image.merge('RGB', (gradient, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT), gradient))
+    output = BytesIO()
+    img.save(output, format='JPEG', quality=85)
+    return output.getvalue()
+
+
+def parse_size(value: str) -> int:
+    """解析 4M、512K 这样的大小"""
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([KMG]?)i?B?', value.strip(), re.IGNORECASE)
+    if not match:
+        raise argparse.ArgumentTypeError(f"无效的大小：{value}")
+    scale = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}[match.group(2).upper()]
+    return int(float(match.group(1)) * scale)
+
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 客户端中途断开（取消下载、进程退出）属于正常情况
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StandInServer:
+    """替身服务器
+
+    videos 为 BV 号 -> 分 P 数，seasons 为合集ID -> BV 号列表；请求数按接口分类统计。
+    """
+
+    def __init__(self, videos: Dict[str, int], seasons: Optional[Dict[int, list]] = None,
+                 audio_size: int = 2 * 1024 * 1024, latency: float = 0.0, bandwidth: int = 0,
+                 host: str = '127.0.0.1', port: int = 0):
+        self.videos = dict(videos)
+        self.seasons = dict(seasons or {})
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.audio = make_m4a(audio_size)
+        self.thumbnail = make_thumbnail()
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+        self._server = _QuietHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count(self, kind: str):
+        with self._stats_lock:
+            self.stats[kind] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def start(self) -> 'StandInServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='bili-stand-in', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    # 数据
+
+    def cid(self, bvid: str, p: int) -> int:
+        return (sum(bvid.encode()) * 1000 + p) % 2 ** 31
+
+    def pages(self, bvid: str):
+        return [{'page': p, 'cid': self.cid(bvid, p), 'part': f'第{p}集', 'duration': 600,
+                 'first_frame': f'{self.url}/thumb/{bvid}.jpg'}
+                for p in range(1, self.videos[bvid] + 1)]
+
+    def view(self, bvid: str) -> dict:
+        pages = self.pages(bvid)
+        return {
+            'bvid': bvid,
+            'title': f'有声书{bvid[-4:]}',
+            'pic': f'{self.url}/thumb/{bvid}.jpg',
+            'owner': {'mid': 10086, 'name': '测试UP主'},
+            'cid': pages[0]['cid'],
+            'duration': sum(page['duration'] for page in pages),
+            'pages': pages
+        }
+
+    def playurl(self, bvid: str, cid: int) -> dict:
+        return {
+            'timelength': 600000,
+            'dash': {'audio': [{
+                'id': 30280,
+                'baseUrl': f'{self.url}/audio/{bvid}/{cid}.m4a',
+                'bandwidth': 192000,
+                'mimeType': 'audio/mp4',
+                'codecs': 'mp4a.40.2',
+                'size': len(self.audio)
+            }]}
+        }
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _json(self, data, status=200):
+                self._send(json.dumps(data, ensure_ascii=False).encode(), 'application/json; charset=utf-8', status)
+
+            def _send(self, body: bytes, content_type: str, status: int = 200):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            def _api(self, data):
+                self._json({'code': 0, 'message': '0', 'data': data})
+
+            def _not_found(self):
+                self._json({'code': -404, 'message': '啥都木有'}, 404)
+
+            def _audio(self):
+                content = server.audio
+                start, end = 0, len(content)
+                match = re.match(r'bytes=(\d*)-(\d*)', self.headers.get('Range', ''))
+                if match and match.group(1):
+                    start = int(match.group(1))
+                    end = min(int(match.group(2)) + 1, end) if match.group(2) else end
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{end - 1}/{len(content)}')
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Type', 'audio/mp4')
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('Content-Length', str(end - start))
+                self.end_headers()
+                if self.command == 'HEAD':
+                    return
+                # 按每个连接的带宽限速发送
+                chunk_size = 64 * 1024
+                started = time.monotonic()
+                sent = 0
+                try:
+                    for offset in range(start, end, chunk_size):
+                        chunk = content[offset:min(offset + chunk_size, end)]
+                        self.wfile.write(chunk)
+                        sent += len(chunk)
+                        if server.bandwidth:
+                            delay = sent / server.bandwidth - (time.monotonic() - started)
+                            if delay > 0:
+                                time.sleep(delay)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def do_HEAD(self):
+                self.do_GET()
+
+            def do_GET(self):
+                if server.latency:
+                    time.sleep(server.latency)
+                parsed = urllib.parse.urlsplit(self.path)
+                query = {key: values[0] for key, values in urllib.parse.parse_qs(parsed.query).items()}
+                path = parsed.path
+
+                if match := re.fullmatch(r'/video/(BV\w+)/?', path):
+                    server.count('page')
+                    bvid = match.group(1)
+                    if bvid not in server.videos:
+                        return self._not_found()
+                    state = {'bvid': bvid, 'p': int(query.get('p', 1)), 'videoData': server.view(bvid)}
+                    html = (f'<html><head><title>{state["videoData"]["title"]}</title></head><body>'
+                            f'<script>window.__INITIAL_STATE__={json.dumps(state, ensure_ascii=False)};'
+                            f'(function(){{}}());</script></body></html>')
+                    return self._send(html.encode(), 'text/html; charset=utf-8')
+
+                if path == '/x/web-interface/view':
+                    server.count('view')
+                    bvid = query.get('bvid')
+                    return self._api(server.view(bvid)) if bvid in server.videos else self._not_found()
+
+                if path == '/x/player/pagelist':
+                    server.count('pagelist')
+                    bvid = query.get('bvid')
+                    return self._api(server.pages(bvid)) if bvid in server.videos else self._not_found()
+
+                if path in ('/x/player/playurl', '/x/player/wbi/playurl'):
+                    server.count('playurl')
+                    bvid = query.get('bvid')
+                    if bvid not in server.videos:
+                        return self._not_found()
+                    return self._api(server.playurl(bvid, int(query.get('cid', 0))))
+
+                if path == '/x/polymer/web-space/seasons_archives_list':
+                    server.count('season')
+                    bvids = server.seasons.get(int(query.get('season_id', 0)))
+                    if bvids is None:
+                        return self._not_found()
+                    page_num, page_size = int(query.get('page_num', 1)), int(query.get('page_size', 30))
+                    archives = [{'bvid': bvid, 'title': server.view(bvid)['title'], 'pic': server.view(bvid)['pic']}
+                                for bvid in bvids[(page_num - 1) * page_size:page_num * page_size]]
+                    return self._api({'archives': archives, 'meta': {'season_id': int(query['season_id']),
+                                                                     'name': '测试合集', 'total': len(bvids)},
+                                      'page': {'page_num': page_num, 'page_size': page_size, 'total': len(bvids)}})
+
+                if re.fullmatch(r'/thumb/BV\w+\.jpg', path):
+                    server.count('thumbnail')
+                    return self._send(server.thumbnail, 'image/jpeg')
+
+                if re.fullmatch(r'/audio/BV\w+/\d+\.m4a', path):
+                    server.count('audio')
+                    return self._audio()
+
+                if path == '/__stats':
+                    return self._json(server.snapshot())
+
+                self._not_found()
+
+        return Handler
+
+
+class LocalBiliIE(InfoExtractor):
+    """替身服务器的视频页解析：读取页面中的 __INITIAL_STATE__，再请求 playurl 接口获取音频流"""
+    IE_NAME = 'localbili'
+    _VALID_URL = r'https?://(?:127\.0\.0\.1|localhost):\d+/video/(?P<id>BV\w+)'
+
+    def _real_extract(self, url):
+        bvid = self._match_id(url)
+        p = int(parse_qs(url).get('p', ['1'])[0])
+        base = re.match(r'https?://[^/]+', url).group()
+        webpage = self._download_webpage(url, bvid)
+        video = self._search_json(r'window\.__INITIAL_STATE__\s*=', webpage, 'initial state', bvid)['videoData']
+        page = video['pages'][p - 1]
+        playinfo = self._download_json(f'{base}/x/player/wbi/playurl', bvid, 'Downloading playurl',
+                                       query={'bvid': bvid, 'cid': page['cid']})['data']
+        formats = [{
+            'url': audio['baseUrl'],
+            'format_id': str(audio['id']),
+            'ext': 'm4a',
+            'acodec': audio['codecs'],
+            'vcodec': 'none',
+            'tbr': audio['bandwidth'] / 1000,
+            'filesize': audio.get('size'),
+            'http_headers': {'Referer': url}
+        } for audio in playinfo['dash']['audio']]
+        multi = len(video['pages']) > 1
+        return {
+            'id': f'{bvid}_p{p}' if multi else bvid,
+            # 与 B 站分 P 标题格式一致
+            'title': f"{video['title']} p{p:02d} {page['part']}" if multi else video['title'],
+            'formats': formats,
+            'thumbnail': video['pic'],
+            'uploader': video['owner']['name'],
+            'duration': page['duration'],
+            'cid': page['cid']
+        }
+
+
+def attach(downloader, base_url: str):
+    """把 BiliDownloader 的页面、接口和 yt-dlp 解析指向替身服务器"""
+    downloader.base_url = f'{base_url}/video/'
+    downloader.view_api_url = f'{base_url}/x/web-interface/view'
+    downloader.series_api_url = f'{base_url}/x/polymer/web-space/seasons_archives_list'
+    new_ydl = downloader._new_ydl
+
+    def local_ydl(opts, resume_id, p):
+        ydl = new_ydl({**opts, 'allowed_extractors': [], 'quiet': True, 'noprogress': True}, resume_id, p)
+        ydl.add_info_extractor(LocalBiliIE())
+        return ydl
+
+    downloader._new_ydl = local_ydl
+    return downloader
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地 B 站替身服务器')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--parts', type=int, default=10, help='BV1bench 的分 P 数')
+    parser.add_argument('--audio-size', type=parse_size, default='2M')
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求的延迟（秒）')
+    parser.add_argument('--bandwidth', type=parse_size, default='0', help='每个连接的带宽（字节/秒，0 不限速）')
+    args = parser.parse_args()
+
+    server = StandInServer({'BV1bench': args.parts}, audio_size=args.audio_size, latency=args.latency,
+                           bandwidth=args.bandwidth, port=args.port)
+    print(f"替身服务器已启动：{server.url}/video/BV1bench（{args.parts} 个分 P）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
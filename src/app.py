@@ -5,8 +5,8 @@ import os
 import json
 import logging
 from datetime import datetime
-import threading
-from utils.downloader import BiliDownloader
+from utils.job_queue import JobQueueFull
+from utils.metrics import get_metrics
 
 # 配置日志
 logging.basicConfig(
@@ -18,7 +18,37 @@ logger = logging.getLogger('BiliDownloader-Web')
 
 app = Flask(__name__)
 task_manager = TaskManager()
-downloader = BiliDownloader()
+# 与下载任务共用一个实例，/check_playlist 缓存的播放列表信息可直接用于下载
+downloader = task_manager.downloader
+title_filter = task_manager.title_filter
+TASK_PAGE_SIZE = int(os.getenv('TASK_PAGE_SIZE', '50'))
+# 任务优先级范围为 -JOB_MAX_PRIORITY 到 JOB_MAX_PRIORITY
+JOB_MAX_PRIORITY = int(os.getenv('JOB_MAX_PRIORITY', '10'))
+# 只有部署在可信的代理之后、由代理设置 X-Client-Id 时才开启，否则按来源地址区分客户端
+TRUST_CLIENT_ID = bool(int(os.getenv('TRUST_CLIENT_ID', '0')))
+
+def queued_response(task_id, message):
+    """任务入队后立即返回，附带排队位置"""
+    task = task_manager.get_task(task_id) or {}
+    return jsonify({
+        'success': True,
+        'task_id': task_id,
+        'status': task.get('status', 'queued'),
+        'queue_position': task.get('queue_position'),
+        'message': message
+    })
+
+def job_options(data):
+    """任务优先级和客户端标识（用于队列内的公平调度）；优先级无效时抛出 ValueError"""
+    try:
+        priority = int(data.get('priority', 0))
+    except (TypeError, ValueError):
+        raise ValueError('priority 必须是整数')
+    client = request.headers.get('X-Client-Id') if TRUST_CLIENT_ID else None
+    return {
+        'priority': max(-JOB_MAX_PRIORITY, min(priority, JOB_MAX_PRIORITY)),
+        'client': client or request.remote_addr or ''
+    }
 
 @app.route('/')
 def index():
@@ -34,7 +64,14 @@ def check_playlist():
             return jsonify({'success': False, 'error': '缺少BV号'})
         
         count = downloader.check_playlist(bvid)
-        return jsonify({'success': True, 'count': count})
+        # 播放列表信息已被缓存，随后的下载任务不会重复请求
+        playlist = downloader.get_cached_playlist(bvid) or {}
+        return jsonify({
+            'success': True,
+            'count': count,
+            'title': playlist.get('title', ''),
+            'parts': playlist.get('parts', [])
+        })
     except Exception as e:
         logger.error(f"检查播放列表失败：{str(e)}")
         return jsonify({'success': False, 'error': str(e)})
@@ -50,30 +87,18 @@ def start_download():
         if not bvid or not output_dir:
             return jsonify({'success': False, 'error': '缺少必要参数'})
         
-        # 创建任务
-        task_id = task_manager.create_task(bvid=bvid, output_dir=output_dir, rename=rename)
-        
-        # 启动下载线程
-        def download_thread():
-            try:
-                for progress in downloader.download(bvid, output_dir, rename):
-                    task_manager.update_task(task_id, progress)
-            except Exception as e:
-                logger.error(f"下载失败：{str(e)}")
-                task_manager.update_task(task_id, {
-                    'status': 'failed',
-                    'error': str(e)
-                })
-        
-        thread = threading.Thread(target=download_thread)
-        thread.start()
+        try:
+            options = job_options(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
-        return jsonify({
-            'success': True,
-            'task_id': task_id,
-            'message': '下载任务已创建'
-        })
+        # 创建任务并加入下载队列
+        task_id = task_manager.submit_download(bvid, output_dir, rename, **options)
+        return queued_response(task_id, '下载任务已加入队列')
         
+    except JobQueueFull as e:
+        logger.warning(f"创建下载任务失败：{str(e)}")
+        return jsonify({'success': False, 'error': '下载队列已满，请稍后再试'}), 503
     except Exception as e:
         logger.error(f"创建下载任务失败：{str(e)}")
         return jsonify({'success': False, 'error': str(e)})
@@ -89,6 +114,11 @@ def start_series_download():
         if not url or not output_dir:
             return jsonify({'success': False, 'error': '缺少必要参数'})
         
+        try:
+            options = job_options(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
         # 验证是否为合集链接
         if not downloader.is_series_url(url):
             return jsonify({'success': False, 'error': '无效的合集链接'})
@@ -96,42 +126,13 @@ def start_series_download():
         # 解析合集信息
         uid, sid = downloader.extract_series_info(url)
         
-        # 创建合集任务
-        task_id = task_manager.create_task(
-            series_id=sid,
-            output_dir=output_dir,
-            rename=rename,
-            is_series=True
-        )
-        
-        # 启动下载线程
-        def download_series_thread():
-            try:
-                for progress in downloader.download_series(url, output_dir, rename):
-                    # 更新任务状态，添加合集相关信息
-                    progress.update({
-                        'series_id': sid,
-                        'is_series': True
-                    })
-                    task_manager.update_task(task_id, progress)
-            except Exception as e:
-                logger.error(f"合集下载失败：{str(e)}")
-                task_manager.update_task(task_id, {
-                    'status': 'failed',
-                    'error': str(e),
-                    'series_id': sid,
-                    'is_series': True
-                })
-        
-        thread = threading.Thread(target=download_series_thread)
-        thread.start()
-        
-        return jsonify({
-            'success': True,
-            'task_id': task_id,
-            'message': '合集下载任务已创建'
-        })
+        # 创建合集任务并加入下载队列
+        task_id = task_manager.submit_series(url, sid, output_dir, rename, **options)
+        return queued_response(task_id, '合集下载任务已加入队列')
         
+    except JobQueueFull as e:
+        logger.warning(f"创建合集下载任务失败：{str(e)}")
+        return jsonify({'success': False, 'error': '下载队列已满，请稍后再试'}), 503
     except Exception as e:
         logger.error(f"创建合集下载任务失败：{str(e)}")
         return jsonify({'success': False, 'error': str(e)})
@@ -148,11 +149,52 @@ def task_status():
     
     return jsonify(status)
 
+@app.route('/task_events', methods=['GET'])
+def task_events():
+    """以 Server-Sent Events 推送任务进度增量"""
+    task_id = request.args.get('task_id')
+    if task_id and not task_manager.get_task(task_id):
+        return jsonify({'error': '任务不存在'}), 404
+    
+    stream = task_manager.subscribe(task_id)
+    
+    def generate():
+        try:
+            # 连接建立后先推送一次完整状态
+            if task_id:
+                yield f"data: {json.dumps(task_manager.get_task(task_id), ensure_ascii=False)}\n\n"
+            while True:
+                batch = stream.next_batch(timeout=15)
+                if not batch:
+                    yield ": keepalive\n\n"
+                    continue
+                for tid, delta in batch.items():
+                    yield f"data: {json.dumps({**delta, 'task_id': tid}, ensure_ascii=False)}\n\n"
+        finally:
+            task_manager.unsubscribe(stream)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/active_tasks', methods=['GET'])
 def get_active_tasks():
-    """获取所有活动任务"""
-    tasks = task_manager.get_active_tasks()
-    return jsonify({'tasks': tasks})
+    """从新到旧分页获取任务
+
+    参数：status 按状态筛选（可重复或逗号分隔）；limit 每页数量；cursor 上一页返回的 next_cursor
+    """
+    statuses = [status for value in request.args.getlist('status') for status in value.split(',') if status] or None
+    try:
+        limit = min(max(int(request.args.get('limit', TASK_PAGE_SIZE)), 1), 500)
+        tasks, next_cursor = task_manager.get_active_tasks(statuses, request.args.get('cursor'), limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'tasks': tasks,
+        'next_cursor': next_cursor,
+        'total': task_manager.count_tasks(statuses)
+    })
 
 @app.route('/latest_task', methods=['GET'])
 def latest_task():
@@ -162,6 +204,26 @@ def latest_task():
         return jsonify({'error': '没有找到任务'}), 404
     return jsonify(task)
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 格式的运行指标"""
+    return Response(get_metrics().render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/task_trace', methods=['GET'])
+def task_trace():
+    """导出任务的时间线（Chrome trace 格式，可在 chrome://tracing 或 Perfetto 中打开）"""
+    task_id = request.args.get('task_id')
+    if not task_id:
+        return jsonify({'error': '缺少task_id参数'}), 400
+    
+    trace = task_manager.get_task_trace(task_id)
+    if trace is None:
+        return jsonify({'error': '没有该任务的追踪记录（需设置 TRACE_TASKS 开启）'}), 404
+    
+    response = jsonify(trace)
+    response.headers['Content-Disposition'] = f'inline; filename="trace-{task_id}.json"'
+    return response
+
 @app.route('/cleanup_tasks', methods=['POST'])
 def cleanup_tasks():
     """清理已完成的任务"""
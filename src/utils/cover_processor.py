@@ -0,0 +1,93 @@
+import logging
+from io import BytesIO
+from typing import Optional, Tuple
+
+from PIL import Image, ImageFilter
+
+logger = logging.getLogger('CoverProcessor')
+
+
+class CoverProcessor:
+    """封面处理：把任意比例的封面扩展为正方形
+
+    先缩放到目标尺寸，再用一次拉伸生成边缘填充，最后只对填充区域做模糊，
+    避免在原始分辨率上逐行粘贴和整图模糊。
+    """
+
+    def __init__(self, size: int = 400, blur_radius: float = 10, quality: int = 95):
+        self.size = size
+        self.blur_radius = blur_radius  # 相对于原图长边的模糊半径
+        self.quality = quality
+
+    def square(self, img: Image.Image, source_side: Optional[int] = None) -> Image.Image:
+        """生成边缘模糊填充的正方形封面
+
+        source_side 为原图长边（图片以缩小比例解码时用于换算模糊半径）
+        """
+        img = img.convert('RGB')
+        size = self.size
+        max_side = max(img.width, img.height)
+        scale = size / max_side
+
+        # 先缩放到目标分辨率，长边正好等于 size
+        width = max(1, min(size, round(img.width * scale)))
+        height = max(1, min(size, round(img.height * scale)))
+        img = img.resize((width, height), Image.Resampling.LANCZOS)
+        if width == size and height == size:
+            return img
+
+        x_offset = (size - width) // 2
+        y_offset = (size - height) // 2
+        square_img = Image.new('RGB', (size, size), (255, 255, 255))
+        square_img.paste(img, (x_offset, y_offset))
+
+        # 边缘像素一次拉伸到整个填充区域
+        pads = []
+        if width < size:
+            right_width = size - x_offset - width
+            pads.append(((0, y_offset, x_offset, y_offset + height), (0, 0, 1, height)))
+            pads.append(((x_offset + width, y_offset, size, y_offset + height), (width - 1, 0, width, height)))
+            blur_boxes = [(0, 0, x_offset, size), (size - right_width, 0, size, size)]
+        else:
+            bottom_height = size - y_offset - height
+            pads.append(((x_offset, 0, x_offset + width, y_offset), (0, 0, width, 1)))
+            pads.append(((x_offset, y_offset + height, x_offset + width, size), (0, height - 1, width, height)))
+            blur_boxes = [(0, 0, size, y_offset), (0, size - bottom_height, size, size)]
+
+        for (left, top, right, bottom), edge_box in pads:
+            if right > left and bottom > top:
+                edge = img.crop(edge_box).resize((right - left, bottom - top), Image.Resampling.NEAREST)
+                square_img.paste(edge, (left, top))
+
+        # 模糊半径按缩放比例换算，只模糊填充区域（带少量外扩以获得与原图衔接处的过渡）
+        radius = self.blur_radius * size / (source_side or max_side)
+        margin = int(radius * 3) + 1
+        for box in blur_boxes:
+            self._blur_region(square_img, box, radius, margin)
+
+        return square_img
+
+    @staticmethod
+    def _blur_region(img: Image.Image, box: Tuple[int, int, int, int], radius: float, margin: int):
+        """对指定区域做高斯模糊，区域外扩 margin 像素参与计算但不写回"""
+        left, top, right, bottom = box
+        if right <= left or bottom <= top:
+            return
+        outer = (max(0, left - margin), max(0, top - margin),
+                 min(img.width, right + margin), min(img.height, bottom + margin))
+        blurred = img.crop(outer).filter(ImageFilter.GaussianBlur(radius=radius))
+        inner = (left - outer[0], top - outer[1], right - outer[0], bottom - outer[1])
+        img.paste(blurred.crop(inner), (left, top))
+
+    def render(self, data: bytes) -> bytes:
+        """处理封面图片数据，返回正方形 JPEG"""
+        img = Image.open(BytesIO(data))
+        original_size = img.size
+        # JPEG 可以直接以缩小的比例解码，省去大部分解码和缩放开销
+        img.draft('RGB', (self.size, self.size))
+        square_img = self.square(img, max(original_size))
+
+        output = BytesIO()
+        square_img.save(output, format='JPEG', quality=self.quality)
+        logger.info(f"封面处理完成：{original_size} -> ({self.size}x{self.size})")
+        return output.getvalue()
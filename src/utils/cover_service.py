@@ -0,0 +1,163 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional
+
+from .cover_processor import CoverProcessor
+from .http_client import HttpClient
+from .metrics import get_metrics
+
+logger = logging.getLogger('CoverService')
+
+
+class CoverService:
+    """封面服务：获取并处理封面，按封面 URL 和内容哈希缓存结果
+
+    同一播放列表的各分 P 通常共用一张封面，缓存后只需下载和处理一次：
+    - 内存 LRU：封面 URL -> 处理后的 JPEG
+    - 磁盘缓存：{内容哈希}.jpg 保存处理结果，{URL 哈希}.ref 记录 URL 对应的内容哈希；
+      两类文件各自最多保留 max_disk_items 个，超出时按最近使用时间删除
+    """
+
+    def __init__(self, http: HttpClient, processor: Optional[CoverProcessor] = None,
+                 cache_dir: Optional[str] = None, max_items: Optional[int] = None,
+                 max_disk_items: Optional[int] = None):
+        self.http = http
+        self.processor = processor or CoverProcessor()
+        self.cache_dir = cache_dir or os.getenv('COVER_CACHE_DIR', 'cover_cache')
+        self.max_items = max_items or int(os.getenv('COVER_CACHE_SIZE', '64'))
+        self.max_disk_items = max_disk_items or int(os.getenv('COVER_DISK_CACHE_SIZE', '1000'))
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._url_locks = {}  # URL -> [锁, 使用数]，同一 URL 的并发请求只下载一次，用完即删除
+
+    def _remember(self, key: str, data: bytes):
+        """写入内存 LRU"""
+        with self._lock:
+            self._memory[key] = data
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_items:
+                self._memory.popitem(last=False)
+
+    def _recall(self, key: str) -> Optional[bytes]:
+        """读取内存 LRU"""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+            return data
+
+    @contextmanager
+    def _url_lock(self, url: str):
+        """串行处理同一 URL 的请求；没有请求使用时删除该 URL 的锁"""
+        with self._lock:
+            entry = self._url_locks.setdefault(url, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._url_locks[url]
+
+    def _cover_path(self, content_hash: str) -> str:
+        return os.path.join(self.cache_dir, f"{content_hash}.jpg")
+
+    def _ref_path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, f"{hashlib.md5(url.encode('utf-8')).hexdigest()}.ref")
+
+    def _read_disk(self, content_hash: str) -> Optional[bytes]:
+        path = self._cover_path(content_hash)
+        try:
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    data = f.read()
+                # 更新修改时间，清理时按最近使用排序
+                os.utime(path)
+                return data
+        except Exception as e:
+            logger.warning(f"读取封面缓存失败：{str(e)}")
+        return None
+
+    def _write_disk(self, path: str, data: bytes):
+        """原子写入缓存文件"""
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            # 首次写入时才创建缓存目录
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except Exception as e:
+            logger.warning(f"写入封面缓存失败：{str(e)}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        self._sweep_disk(os.path.splitext(path)[1])
+
+    def _sweep_disk(self, suffix: str):
+        """某类缓存文件超过 max_disk_items 个时，删除最久未使用的文件"""
+        try:
+            entries = [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith(suffix)]
+            if len(entries) <= self.max_disk_items:
+                return
+            entries.sort(key=lambda entry: entry.stat().st_mtime_ns)
+            for entry in entries[:len(entries) - self.max_disk_items]:
+                os.remove(entry.path)
+            logger.info(f"清理封面缓存：删除 {len(entries) - self.max_disk_items} 个{suffix}文件")
+        except OSError as e:
+            logger.warning(f"清理封面缓存失败：{str(e)}")
+
+    def render(self, data: bytes, content_hash: Optional[str] = None) -> bytes:
+        """处理封面图片数据，相同内容只处理一次"""
+        content_hash = content_hash or hashlib.sha1(data).hexdigest()
+        if cover := self._recall(content_hash) or self._read_disk(content_hash):
+            self._remember(content_hash, cover)
+            return cover
+
+        with get_metrics().stage('cover_render'):
+            cover = self.processor.render(data)
+        self._write_disk(self._cover_path(content_hash), cover)
+        self._remember(content_hash, cover)
+        return cover
+
+    def get(self, url: str) -> Optional[bytes]:
+        """获取封面 URL 对应的正方形封面"""
+        if not url:
+            return None
+        if cover := self._recall(url):
+            logger.info("封面命中内存缓存")
+            return cover
+
+        with self._url_lock(url):
+            # 等待锁期间其他线程可能已经处理完成
+            if cover := self._recall(url):
+                return cover
+
+            ref_path = self._ref_path(url)
+            if os.path.exists(ref_path):
+                with open(ref_path, 'r', encoding='utf-8') as f:
+                    content_hash = f.read().strip()
+                if cover := self._read_disk(content_hash):
+                    logger.info("封面命中磁盘缓存")
+                    self._remember(url, cover)
+                    return cover
+
+            logger.info(f"找到封面 URL: {url}")
+            with get_metrics().stage('cover_fetch'):
+                response = self.http.get(url)
+            if response.status_code != 200:
+                logger.error(f"封面下载失败：HTTP {response.status_code}")
+                return None
+
+            logger.info("封面下载成功，开始处理图片")
+            content_hash = hashlib.sha1(response.content).hexdigest()
+            cover = self.render(response.content, content_hash)
+            self._write_disk(ref_path, content_hash.encode('utf-8'))
+            self._remember(url, cover)
+            return cover
@@ -0,0 +1,391 @@
+import os
+import json
+import atexit
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Any, Optional, Iterable, Tuple, List
+
+logger = logging.getLogger('Database')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id TEXT PRIMARY KEY,
+    status TEXT,
+    created_at TEXT,
+    title TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_created_at ON tasks (created_at);
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, created_at);
+
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    bvid TEXT,
+    status TEXT,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS parts (
+    run_id TEXT NOT NULL,
+    p INTEGER NOT NULL,
+    status TEXT,
+    updated_at TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (run_id, p)
+);
+
+CREATE TABLE IF NOT EXISTS history (
+    video_key TEXT PRIMARY KEY,
+    bvid TEXT NOT NULL,
+    p INTEGER NOT NULL,
+    cid INTEGER,
+    title TEXT,
+    file_path TEXT,
+    file_size INTEGER,
+    download_time TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_history_bvid_p ON history (bvid, p);
+
+CREATE TABLE IF NOT EXISTS skip_index (
+    bvid TEXT NOT NULL,
+    p INTEGER NOT NULL,
+    cid INTEGER,
+    file_path TEXT NOT NULL,
+    file_size INTEGER NOT NULL,
+    file_mtime INTEGER NOT NULL,
+    PRIMARY KEY (bvid, p)
+);
+
+CREATE TABLE IF NOT EXISTS files (
+    bvid TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def _dumps(data: Dict[str, Any]) -> str:
+    return json.dumps(data, ensure_ascii=False)
+
+
+class Database:
+    """嵌入式 SQLite 存储（WAL 模式），保存任务、分 P 状态、下载历史和文件元数据
+
+    每个线程使用独立连接；WAL 模式下读写互不阻塞。每次修改只追加写入 WAL 日志，
+    打开数据库时自动重放；日志由后台线程定期合并回数据库文件（checkpoint），
+    写入方不再承担合并的开销。
+    """
+
+    def __init__(self, path: Optional[str] = None, checkpoint_interval: Optional[float] = None):
+        self.path = path or os.getenv('DB_PATH', os.path.join('download_history', 'bilipala.db'))
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.checkpoint_interval = checkpoint_interval if checkpoint_interval is not None \
+            else float(os.getenv('DB_CHECKPOINT_INTERVAL', '30'))
+        self._local = threading.local()
+        with self.connection as conn:
+            conn.executescript(SCHEMA)
+        self._stop = threading.Event()
+        if self.checkpoint_interval > 0:
+            self._checkpointer = threading.Thread(target=self._checkpoint_loop, name='db-checkpoint', daemon=True)
+            self._checkpointer.start()
+        logger.info(f"数据库初始化完成：{self.path}")
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """获取当前线程的数据库连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            if self.checkpoint_interval > 0:
+                # 由后台线程合并 WAL，提交时不再自动 checkpoint
+                conn.execute('PRAGMA wal_autocheckpoint=0')
+            self._local.conn = conn
+        return conn
+
+    def checkpoint(self, mode: str = 'PASSIVE') -> Tuple[int, int]:
+        """将 WAL 日志合并回数据库文件，返回 (日志页数, 已合并页数)"""
+        busy, log_pages, checkpointed = self.connection.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+        return log_pages, checkpointed
+
+    def _checkpoint_loop(self):
+        while not self._stop.wait(self.checkpoint_interval):
+            try:
+                log_pages, checkpointed = self.checkpoint()
+                # 所有页都已合并时截断日志文件，避免 WAL 持续增长
+                if log_pages > 0 and log_pages == checkpointed:
+                    self.checkpoint('TRUNCATE')
+            except Exception as e:
+                logger.warning(f"合并数据库日志失败：{str(e)}")
+
+    def close(self):
+        """停止后台合并并合并剩余日志"""
+        self._stop.set()
+        try:
+            self.checkpoint('TRUNCATE')
+        except Exception as e:
+            logger.warning(f"合并数据库日志失败：{str(e)}")
+
+    # 元数据
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self.connection as conn:
+            conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    # 任务
+
+    def save_tasks(self, tasks: Iterable[Tuple[str, Dict[str, Any]]]):
+        """在一个事务中批量写入任务"""
+        rows = [(task_id, task.get('status'), task.get('created_at'), task.get('title'), _dumps(task))
+                for task_id, task in tasks]
+        if not rows:
+            return
+        with self.connection as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO tasks (task_id, status, created_at, title, data) VALUES (?, ?, ?, ?, ?)',
+                rows
+            )
+
+    def load_tasks(self) -> Dict[str, Dict[str, Any]]:
+        rows = self.connection.execute('SELECT task_id, data FROM tasks ORDER BY created_at').fetchall()
+        return {row['task_id']: json.loads(row['data']) for row in rows}
+
+    def load_task(self, task_id: str) -> Optional[Dict[str, Any]]:
+        row = self.connection.execute('SELECT data FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def load_task_index(self) -> Dict[str, Dict[str, Any]]:
+        """任务摘要（ID、状态、创建时间、标题），不解析任务内容"""
+        rows = self.connection.execute(
+            'SELECT task_id, status, created_at, title FROM tasks ORDER BY created_at'
+        ).fetchall()
+        return {row['task_id']: dict(row) for row in rows}
+
+    def load_tasks_by_status(self, status: str) -> Dict[str, Dict[str, Any]]:
+        rows = self.connection.execute(
+            'SELECT task_id, data FROM tasks WHERE status = ? ORDER BY created_at', (status,)
+        ).fetchall()
+        return {row['task_id']: json.loads(row['data']) for row in rows}
+
+    def find_finished_tasks(self, completed_before: str) -> List[str]:
+        """完成时间早于 completed_before 的已完成/失败任务"""
+        rows = self.connection.execute(
+            "SELECT task_id FROM tasks WHERE status IN ('completed', 'failed') "
+            "AND json_extract(data, '$.completed_at') < ?", (completed_before,)
+        ).fetchall()
+        return [row['task_id'] for row in rows]
+
+    def delete_task(self, task_id: str):
+        with self.connection as conn:
+            conn.execute('DELETE FROM tasks WHERE task_id = ?', (task_id,))
+
+    # 下载器运行状态和分 P 状态
+
+    def save_run(self, run_id: str, state: Dict[str, Any]):
+        with self.connection as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO runs (run_id, bvid, status, data) VALUES (?, ?, ?, ?)',
+                (run_id, state.get('bvid'), state.get('status'), _dumps(state))
+            )
+
+    def load_run(self, run_id: str) -> Dict[str, Any]:
+        row = self.connection.execute('SELECT data FROM runs WHERE run_id = ?', (run_id,)).fetchone()
+        return json.loads(row['data']) if row else {}
+
+    def delete_run(self, run_id: str):
+        with self.connection as conn:
+            conn.execute('DELETE FROM runs WHERE run_id = ?', (run_id,))
+            conn.execute('DELETE FROM parts WHERE run_id = ?', (run_id,))
+
+    def save_part(self, run_id: str, p: int, state: Dict[str, Any]):
+        with self.connection as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO parts (run_id, p, status, updated_at, data) VALUES (?, ?, ?, ?, ?)',
+                (run_id, p, state.get('status'), datetime.now().isoformat(), _dumps(state))
+            )
+
+    def delete_part(self, run_id: str, p: int):
+        with self.connection as conn:
+            conn.execute('DELETE FROM parts WHERE run_id = ? AND p = ?', (run_id, p))
+
+    def load_parts(self, run_id: str) -> Dict[int, Dict[str, Any]]:
+        rows = self.connection.execute('SELECT p, data FROM parts WHERE run_id = ? ORDER BY p', (run_id,)).fetchall()
+        return {row['p']: json.loads(row['data']) for row in rows}
+
+    # 下载历史
+
+    def get_history(self, video_key: str) -> Optional[Dict[str, Any]]:
+        row = self.connection.execute('SELECT data FROM history WHERE video_key = ?', (video_key,)).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def save_history(self, video_key: str, record: Dict[str, Any]):
+        self.save_history_many([(video_key, record)])
+
+    def save_history_many(self, records: Iterable[Tuple[str, Dict[str, Any]]]):
+        rows = [(key, record.get('bvid', ''), record.get('p', 0), record.get('cid'), record.get('title'),
+                 record.get('file_path'), record.get('file_size'), record.get('download_time'), _dumps(record))
+                for key, record in records]
+        with self.connection as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO history '
+                '(video_key, bvid, p, cid, title, file_path, file_size, download_time, data) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+
+    def delete_history(self, video_key: str):
+        with self.connection as conn:
+            conn.execute('DELETE FROM history WHERE video_key = ?', (video_key,))
+
+    def count_history(self) -> int:
+        return self.connection.execute('SELECT COUNT(*) FROM history').fetchone()[0]
+
+    # 离线跳过索引：(BV 号, 分 P) -> 已下载文件及其大小和修改时间
+
+    def load_skip_entries(self, bvid: str) -> Dict[int, Dict[str, Any]]:
+        """一次查询读取某个 BV 号所有分 P 的索引"""
+        rows = self.connection.execute(
+            'SELECT p, cid, file_path, file_size, file_mtime FROM skip_index WHERE bvid = ?', (bvid,)
+        ).fetchall()
+        return {row['p']: dict(row) for row in rows}
+
+    def save_skip_entry(self, bvid: str, p: int, cid: Optional[int], file_path: str, file_size: int, file_mtime: int):
+        with self.connection as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO skip_index (bvid, p, cid, file_path, file_size, file_mtime) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (bvid, p, cid, file_path, file_size, file_mtime)
+            )
+
+    def delete_skip_entry(self, bvid: str, p: int):
+        with self.connection as conn:
+            conn.execute('DELETE FROM skip_index WHERE bvid = ? AND p = ?', (bvid, p))
+
+    # 文件元数据
+
+    def load_files(self) -> Dict[str, Dict[str, Any]]:
+        rows = self.connection.execute('SELECT bvid, data FROM files').fetchall()
+        return {row['bvid']: json.loads(row['data']) for row in rows}
+
+    def save_file_entry(self, bvid: str, entry: Dict[str, Any]):
+        with self.connection as conn:
+            conn.execute('INSERT OR REPLACE INTO files (bvid, data) VALUES (?, ?)', (bvid, _dumps(entry)))
+
+    def delete_file_entry(self, bvid: str):
+        with self.connection as conn:
+            conn.execute('DELETE FROM files WHERE bvid = ?', (bvid,))
+
+    # 从旧版 JSON 文件迁移（每个来源只执行一次）
+
+    def _migrate_once(self, key: str) -> bool:
+        """返回是否需要执行迁移"""
+        return self.get_meta(f'migrated:{key}') is None
+
+    def _finish_migration(self, key: str, paths: List[str]):
+        """记录迁移完成，并将旧文件重命名为 .migrated 以免重复加载"""
+        self.set_meta(f'migrated:{key}', datetime.now().isoformat())
+        for path in paths:
+            try:
+                os.replace(path, f"{path}.migrated")
+            except OSError as e:
+                logger.warning(f"重命名已迁移文件失败：{path} - {str(e)}")
+
+    def migrate_tasks_dir(self, tasks_dir: str):
+        """迁移 download_tasks 目录下的任务文件和 active_tasks.json"""
+        key = f'tasks:{os.path.abspath(tasks_dir)}'
+        if not self._migrate_once(key) or not os.path.isdir(tasks_dir):
+            return
+
+        tasks, runs, migrated = {}, {}, []
+        active_tasks = {}
+        for filename in sorted(os.listdir(tasks_dir)):
+            if not filename.endswith('.json'):
+                continue
+            path = os.path.join(tasks_dir, filename)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except Exception as e:
+                logger.error(f"读取旧任务文件失败：{filename} - {str(e)}")
+                continue
+            if filename == 'active_tasks.json':
+                active_tasks = data
+            elif 'created_at' in data:
+                tasks[filename[:-5]] = data
+            else:
+                # 下载器自身写入的运行状态文件
+                runs[filename[:-5]] = data
+            migrated.append(path)
+
+        tasks.update(active_tasks)
+        for task_id, task in tasks.items():
+            task.setdefault('task_id', task_id)
+        self.save_tasks(tasks.items())
+        for run_id, state in runs.items():
+            self.save_run(run_id, state)
+        self._finish_migration(key, migrated)
+        logger.info(f"已迁移 {len(tasks)} 个任务、{len(runs)} 个下载状态")
+
+    def migrate_history(self, history_file: str):
+        """迁移 history.json"""
+        key = f'history:{os.path.abspath(history_file)}'
+        if not self._migrate_once(key) or not os.path.exists(history_file):
+            return
+        try:
+            with open(history_file, 'r', encoding='utf-8') as f:
+                history = json.load(f)
+        except Exception as e:
+            logger.error(f"读取旧下载历史失败：{str(e)}")
+            return
+        self.save_history_many(history.items())
+        self._finish_migration(key, [history_file])
+        logger.info(f"已迁移 {len(history)} 条下载历史")
+
+    def migrate_file_metadata(self, metadata_file: str):
+        """迁移 file_metadata.json"""
+        key = f'files:{os.path.abspath(metadata_file)}'
+        if not self._migrate_once(key) or not os.path.exists(metadata_file):
+            return
+        data = None
+        for path in [metadata_file, f"{metadata_file}.bak"]:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                break
+            except Exception as e:
+                logger.error(f"读取旧文件元数据失败：{path} - {str(e)}")
+        if data is None:
+            return
+        with self.connection as conn:
+            conn.executemany('INSERT OR REPLACE INTO files (bvid, data) VALUES (?, ?)',
+                             [(bvid, _dumps(entry)) for bvid, entry in data.items()])
+        self._finish_migration(key, [metadata_file])
+        logger.info(f"已迁移 {len(data)} 条文件元数据")
+
+
+_shared_db = None
+_shared_db_lock = threading.Lock()
+
+
+def get_database() -> Database:
+    """获取进程内共享的数据库"""
+    global _shared_db
+    with _shared_db_lock:
+        if _shared_db is None:
+            _shared_db = Database()
+            atexit.register(_shared_db.close)
+        return _shared_db
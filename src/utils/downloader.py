@@ -2,7 +2,7 @@ import yt_dlp
 import os
 import re
 import requests
-from typing import Generator, Dict, Any, List, Tuple
+from typing import Generator, Dict, Any, List, Tuple, Optional
 from PIL import Image, ImageFilter, ImageOps, ImageDraw
 from io import BytesIO
 import mutagen
@@ -14,9 +14,22 @@ import time
 import json
 import hashlib
 import threading
+import queue
+import shutil
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import random
 import math
 import urllib.parse
+from .http_client import HttpClient
+from .cover_service import CoverService
+from .tag_worker import get_tag_pool, write_tags
+from .database import Database, get_database
+from .media_processor import get_audio_format
+from .transcode_worker import TranscodePool, get_transcode_pool
+from .range_downloader import RangeDownloader
+from .inflight import InflightFetch, get_inflight_registry
+from .metrics import get_metrics
+from .tracing import get_tracer
 
 # 配置日志
 logging.basicConfig(
@@ -26,8 +39,85 @@ logging.basicConfig(
 )
 logger = logging.getLogger('BiliDownloader')
 
+# 全局分 P 并发槽位，所有下载任务共享，避免多个任务同时发起过多 yt-dlp 下载
+_part_slots = None
+_part_slots_lock = threading.Lock()
+
+
+def get_part_slots() -> threading.BoundedSemaphore:
+    """获取全局分 P 并发槽位"""
+    global _part_slots
+    with _part_slots_lock:
+        if _part_slots is None:
+            limit = max(1, int(os.getenv('MAX_PARALLEL_PARTS', '6')))
+            _part_slots = threading.BoundedSemaphore(limit)
+            logger.info(f"全局分 P 并发上限：{limit}")
+        return _part_slots
+
+
+class SegmentedYoutubeDL(yt_dlp.YoutubeDL):
+    """HTTP 音频流使用分段多连接下载的 YoutubeDL
+
+    其余协议、字幕和不支持 Range 的服务器仍交给 yt-dlp 自带的下载器；
+    分段进度通过 on_state 回调保存，resume_state 为上次保存的状态。
+    """
+
+    def __init__(self, params: dict, range_downloader: Optional[RangeDownloader] = None,
+                 resume_state: Optional[dict] = None, on_state=None):
+        # 父类初始化时通过 add_progress_hook 注册 params 中的进度回调
+        self._segment_hooks = []
+        super().__init__(params)
+        self.range_downloader = range_downloader
+        self.resume_state = resume_state
+        self.on_state = on_state
+
+    def add_progress_hook(self, ph):
+        """记录进度回调，分段下载时直接调用"""
+        super().add_progress_hook(ph)
+        self._segment_hooks.append(ph)
+
+    def _report(self, status: dict):
+        for hook in self._segment_hooks:
+            hook(status)
+
+    def dl(self, name, info, subtitle=False, test=False):
+        downloader = self.range_downloader
+        if (downloader is None or test or subtitle or name == '-' or info.get('requested_formats')
+                or info.get('protocol', 'https') not in ('http', 'https') or not info.get('url')):
+            return super().dl(name, info, subtitle, test)
+
+        headers = info.get('http_headers') or self._calc_headers(info)
+        size = downloader.probe(info['url'], headers)
+        # 小文件或不支持 Range 时使用 yt-dlp 默认下载
+        if not size or size < 2 * downloader.min_segment:
+            return super().dl(name, info, subtitle, test)
+
+        if os.path.exists(name) and os.path.getsize(name) == size:
+            self._report({'status': 'finished', 'filename': name, 'total_bytes': size, 'info_dict': info})
+            return True, False
+
+        format_id = info.get('format_id')
+        resume_state = self.resume_state if (self.resume_state or {}).get('format_id') == format_id else None
+
+        def on_state(state):
+            if self.on_state:
+                self.on_state({**state, 'format_id': format_id})
+
+        def on_progress(downloaded, total):
+            self._report({'status': 'downloading', 'filename': name, 'downloaded_bytes': downloaded,
+                          'total_bytes': total, 'info_dict': info})
+
+        self.write_debug(f'分段下载：{downloader.connections} 个连接')
+        start = time.time()
+        downloader.download(info['url'], name, headers=headers, size=size, state=resume_state,
+                            on_state=on_state, progress=on_progress)
+        self._report({'status': 'finished', 'filename': name, 'total_bytes': size, 'downloaded_bytes': size,
+                      'elapsed': time.time() - start, 'info_dict': info})
+        return True, True
+
+
 class BiliDownloader:
-    def __init__(self):
+    def __init__(self, db: Optional[Database] = None):
         # 检查yt-dlp版本
         try:
             import yt_dlp.version
@@ -47,39 +137,30 @@ class BiliDownloader:
             'Cache-Control': 'no-cache',
             'Pragma': 'no-cache'
         }
+        # 所有 B 站接口和 CDN 请求共用的连接池
+        self.http = HttpClient(self.headers)
+        self.cover_service = CoverService(self.http)
         self.base_url = "https://www.bilibili.com/video/"
         self.series_api_url = "https://api.bilibili.com/x/polymer/web-space/seasons_archives_list"
+        self.view_api_url = "https://api.bilibili.com/x/web-interface/view"
         self.history_dir = "download_history"
-        self.task_dir = "download_tasks"
-        os.makedirs(self.history_dir, exist_ok=True)
-        os.makedirs(self.task_dir, exist_ok=True)
         self.history_file = os.path.join(self.history_dir, "history.json")
-        self.download_history = self.load_download_history()
-        self.cover_queue = []  # 封面处理队列
+        # 下载历史和任务状态保存在共享的 SQLite 数据库中
+        self.db = db or get_database()
+        self.db.migrate_history(self.history_file)
+        self.tag_pool = get_tag_pool()  # 封面和标签写入线程池
+        self.audio_format = get_audio_format()  # 输出音频格式
+        # 大文件分段多连接下载（RANGE_CONNECTIONS 小于 2 时使用 yt-dlp 默认下载）
+        connections = int(os.getenv('RANGE_CONNECTIONS', '4'))
+        self.range_downloader = RangeDownloader(self.http, connections) if connections > 1 else None
+        self.inflight = get_inflight_registry()  # 所有下载器共享，相同分 P 的并发请求只下载一次
+        self.metrics = get_metrics()  # 各阶段耗时、下载量和重试次数
+        self.tracer = get_tracer()  # 按任务记录各阶段的时间线（默认关闭）
         self.active_tasks = {}  # 当前活动任务
+        self._playlist_cache = {}  # BV 号 -> (获取时间, 播放列表信息)
+        self._playlist_lock = threading.Lock()
         logger.info("BiliDownloader 初始化完成")
     
-    def load_download_history(self) -> dict:
-        """加载下载历史记录"""
-        try:
-            if os.path.exists(self.history_file):
-                with open(self.history_file, 'r', encoding='utf-8') as f:
-                    history = json.load(f)
-                logger.info(f"加载下载历史记录：{len(history)} 条记录")
-                return history
-        except Exception as e:
-            logger.error(f"加载下载历史记录失败：{str(e)}")
-        return {}
-    
-    def save_download_history(self):
-        """保存下载历史记录"""
-        try:
-            with open(self.history_file, 'w', encoding='utf-8') as f:
-                json.dump(self.download_history, f, ensure_ascii=False, indent=2)
-            logger.info("下载历史记录已保存")
-        except Exception as e:
-            logger.error(f"保存下载历史记录失败：{str(e)}")
-    
     def get_video_key(self, bvid: str, p: int, title: str) -> str:
         """生成视频唯一标识"""
         # 使用 BV 号、分 P 号和标题生成唯一标识
@@ -93,8 +174,8 @@ class BiliDownloader:
         title = info.get('title', '')
         video_key = self.get_video_key(bvid, p, title)
         
-        if video_key in self.download_history:
-            history_info = self.download_history[video_key]
+        history_info = self.db.get_history(video_key)
+        if history_info:
             mp3_path = history_info.get('file_path')
             
             # 检查文件是否存在
@@ -112,8 +193,7 @@ class BiliDownloader:
             else:
                 # 如果文件不存在，删除历史记录
                 logger.info(f"历史文件不存在，清除记录：{mp3_path}")
-                del self.download_history[video_key]
-                self.save_download_history()
+                self.db.delete_history(video_key)
         
         return False, "", False
     
@@ -122,20 +202,66 @@ class BiliDownloader:
         title = info.get('title', '')
         video_key = self.get_video_key(bvid, p, title)
         
-        self.download_history[video_key] = {
-            'bvid': bvid,
-            'p': p,
-            'title': title,
-            'file_path': file_path,
-            'download_time': datetime.now().isoformat(),
-            'file_size': os.path.getsize(file_path) if os.path.exists(file_path) else 0,
-            'duration': info.get('duration', 0),
-            'uploader': info.get('uploader', ''),
-            'upload_date': info.get('upload_date', '')
-        }
-        self.save_download_history()
+        with self.metrics.stage('history_save'):
+            self.db.save_history(video_key, {
+                'bvid': bvid,
+                'p': p,
+                'title': title,
+                'file_path': file_path,
+                'download_time': datetime.now().isoformat(),
+                'file_size': os.path.getsize(file_path) if os.path.exists(file_path) else 0,
+                'cid': info.get('cid'),
+                'duration': info.get('duration', 0),
+                'uploader': info.get('uploader', ''),
+                'upload_date': info.get('upload_date', '')
+            })
         logger.info(f"添加下载记录：{title}")
+
+    def index_download(self, bvid: str, p: int, file_path: str, cid: Optional[int] = None):
+        """将已下载文件的大小和修改时间写入跳过索引，重复下载时无需联网即可跳过"""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return
+        self.db.save_skip_entry(bvid, p, cid, file_path, stat.st_size, stat.st_mtime_ns)
+
+    def check_skip_index(self, bvid: str, p: int, entry: Optional[dict], cid: Optional[int] = None) -> bool:
+        """离线检查分 P 是否已下载：cid 未变化，且文件大小和修改时间与索引一致"""
+        if not entry:
+            return False
+        if cid and entry.get('cid') and cid != entry['cid']:
+            logger.info(f"分 P {p} 的 cid 已变化，重新检查：{entry['file_path']}")
+            self.db.delete_skip_entry(bvid, p)
+            return False
+        try:
+            stat = os.stat(entry['file_path'])
+        except OSError:
+            logger.info(f"索引中的文件不存在，清除记录：{entry['file_path']}")
+            self.db.delete_skip_entry(bvid, p)
+            return False
+        # 大小或修改时间不一致时交给基于标题的下载历史检查
+        return stat.st_size == entry['file_size'] and stat.st_mtime_ns == entry['file_mtime']
     
+    @property
+    def transcode_pool(self) -> TranscodePool:
+        """转码线程池（仅 mp3 格式需要，首次使用时创建）"""
+        return get_transcode_pool()
+
+    def audio_postprocessors(self) -> List[Dict[str, Any]]:
+        """根据输出格式生成 yt-dlp 后处理配置"""
+        if self.audio_format in ('m4a', 'm4b'):
+            # B 站音频流为 AAC，只复制音轨到 m4a 容器，不重新编码
+            return [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'm4a'}]
+        # original：保留下载的原始文件；mp3：下载原始文件后交给转码线程池
+        return []
+
+    def audio_extensions(self, info: dict) -> Tuple[str, str]:
+        """返回 (yt-dlp 生成的音频扩展名, 最终文件扩展名)"""
+        if self.audio_format in ('m4a', 'm4b'):
+            return 'm4a', self.audio_format
+        ext = info.get('ext') or 'm4a'
+        return ext, 'mp3' if self.audio_format == 'mp3' else ext
+
     def extract_bvid(self, url: str) -> str:
         """从 URL 中提取 BV 号"""
         pattern = r"BV[a-zA-Z0-9]+"
@@ -149,70 +275,10 @@ class BiliDownloader:
     
     def get_cover_image(self, info):
         try:
-            # 尝试获取封面URL
+            # 尝试获取封面URL（同一封面只下载和处理一次）
             cover_url = info.get('thumbnail')
             if cover_url:
-                logger.info(f"找到封面 URL: {cover_url}")
-                response = requests.get(cover_url, headers=self.headers)
-                if response.status_code == 200:
-                    logger.info("封面下载成功，开始处理图片")
-                    # 打开图片
-                    img = Image.open(BytesIO(response.content))
-                    original_size = img.size
-                    logger.info(f"原始图片尺寸：{original_size}")
-
-                    # 以长边为基准创建正方形画布
-                    max_side = max(img.width, img.height)
-                    # 创建新的正方形画布
-                    square_img = Image.new('RGB', (max_side, max_side), (255, 255, 255))
-                    
-                    # 计算粘贴位置
-                    x_offset = (max_side - img.width) // 2
-                    y_offset = (max_side - img.height) // 2
-                    
-                    # 将原图粘贴到正方形画布中心
-                    square_img.paste(img, (x_offset, y_offset))
-                    
-                    # 使用智能填充处理边缘
-                    if img.width < max_side:
-                        # 左右边缘需要填充
-                        left_edge = img.crop((0, 0, 1, img.height))
-                        right_edge = img.crop((img.width-1, 0, img.width, img.height))
-                        for x in range(0, x_offset):
-                            square_img.paste(left_edge, (x, y_offset))
-                        for x in range(x_offset + img.width, max_side):
-                            square_img.paste(right_edge, (x, y_offset))
-                    
-                    if img.height < max_side:
-                        # 上下边缘需要填充
-                        top_edge = img.crop((0, 0, img.width, 1))
-                        bottom_edge = img.crop((0, img.height-1, img.width, img.height))
-                        for y in range(0, y_offset):
-                            square_img.paste(top_edge, (x_offset, y))
-                        for y in range(y_offset + img.height, max_side):
-                            square_img.paste(bottom_edge, (x_offset, y))
-                    
-                    # 创建仅包含填充区域的蒙版
-                    mask = Image.new('L', square_img.size, 0)
-                    # 绘制原始图片区域（不模糊）
-                    mask.paste(255, (x_offset, y_offset, x_offset + img.width, y_offset + img.height))
-                    # 反转蒙版以获取填充区域
-                    mask = ImageOps.invert(mask)
-                    
-                    # 仅对填充区域应用模糊
-                    blurred = square_img.filter(ImageFilter.GaussianBlur(radius=10))
-                    # 将模糊后的填充区域与原始图片合并
-                    square_img.paste(blurred, mask=mask)
-                    logger.info(f"正方形画布尺寸：{square_img.size} (已应用边缘模糊)")
-                    
-                    # 调整大小为 400x400
-                    img = square_img.resize((400, 400), Image.Resampling.LANCZOS)
-                    
-                    # 转换为字节
-                    output = BytesIO()
-                    img.save(output, format='JPEG', quality=95)
-                    logger.info(f"封面处理完成：{original_size} -> (400x400)")
-                    return output.getvalue()
+                return self.cover_service.get(cover_url)
             else:
                 logger.warning("未找到封面URL")
                 return None
@@ -221,116 +287,115 @@ class BiliDownloader:
             return None
 
     def embed_cover(self, mp3_path: str, cover_data: bytes):
-        """将封面嵌入到 MP3 文件中"""
+        """将封面嵌入到音频文件中"""
         if not cover_data:
             logger.warning(f"没有封面数据，跳过封面嵌入：{os.path.basename(mp3_path)}")
             return
 
         try:
             logger.info(f"开始为音频文件添加封面：{os.path.basename(mp3_path)}")
-            
-            # 等待文件可用，最多等待10秒
-            for _ in range(10):
-                if os.path.exists(mp3_path):
-                    # 检查文件是否完整（不是正在写入状态）
-                    try:
-                        with open(mp3_path, 'rb') as f:
-                            f.seek(-128, 2)  # 尝试读取文件末尾
-                        break
-                    except:
-                        pass
-                time.sleep(1)
-            else:
-                raise FileNotFoundError(f"等待MP3文件超时：{mp3_path}")
-
-            audio = MP3(mp3_path, ID3=ID3)
-            
-            # 如果没有 ID3 标签，创建一个
-            if audio.tags is None:
-                audio.add_tags()
-                logger.info("创建新的 ID3 标签")
-            
-            # 添加封面
-            audio.tags.add(
-                APIC(
-                    encoding=3,
-                    mime='image/jpeg',
-                    type=3,  # 封面图片
-                    desc='Cover',
-                    data=cover_data
-                )
-            )
-            
-            # 保存更改
-            audio.save(v2_version=3)
+            write_tags(mp3_path, cover_data=cover_data)
             logger.info("封面添加成功")
-            
         except Exception as e:
             logger.error(f"添加封面失败：{str(e)}")
-    
+
+    def get_cached_playlist(self, bvid: str) -> Optional[Dict[str, Any]]:
+        """获取未过期的播放列表缓存"""
+        ttl = int(os.getenv('PLAYLIST_CACHE_TTL', '600'))
+        with self._playlist_lock:
+            cached = self._playlist_cache.get(bvid)
+        if cached and time.time() - cached[0] < ttl:
+            return cached[1]
+        return None
+
+    def get_playlist_info(self, bvid: str) -> Dict[str, Any]:
+        """一次请求获取播放列表中所有分 P 的信息（cid、标题、时长、封面），结果会被缓存"""
+        if playlist := self.get_cached_playlist(bvid):
+            return playlist
+
+        logger.info(f"开始获取播放列表信息：{bvid}")
+        response = self.http.get(self.view_api_url, params={'bvid': bvid})
+        if response.status_code != 200:
+            raise ValueError(f"请求失败：HTTP {response.status_code}")
+
+        result = response.json()
+        if result.get('code') != 0:
+            raise ValueError(f"获取播放列表失败：{result.get('message', '未知错误')}")
+
+        data = result['data']
+        title = data.get('title', '')
+        thumbnail = data.get('pic')
+        pages = data.get('pages') or [{'page': 1, 'cid': data.get('cid'), 'duration': data.get('duration', 0)}]
+        is_anthology = len(pages) > 1
+
+        parts = []
+        for index, page in enumerate(pages, start=1):
+            p = page.get('page') or index
+            part_title = page.get('part', '')
+            parts.append({
+                'p': p,
+                'cid': page.get('cid'),
+                # 与 yt-dlp 生成的分 P 标题保持一致
+                'title': f"{title} p{p:02d} {part_title}" if is_anthology else title,
+                'part_title': part_title,
+                'duration': page.get('duration', 0),
+                'thumbnail': thumbnail,
+                'first_frame': page.get('first_frame')
+            })
+
+        playlist = {
+            'bvid': data.get('bvid', bvid),
+            'title': title,
+            'thumbnail': thumbnail,
+            'uploader': data.get('owner', {}).get('name', ''),
+            'count': len(parts),
+            'parts': parts
+        }
+        with self._playlist_lock:
+            self._playlist_cache[bvid] = (time.time(), playlist)
+        return playlist
+
     def check_playlist(self, bvid: str) -> int:
         """检查播放列表中的视频数量"""
-        url = f"{self.base_url}{bvid}"
-        logger.info(f"开始检查播放列表：{url}")
-        
+        logger.info(f"开始检查播放列表：{bvid}")
+
         try:
-            # 使用 requests 获取页面内容
-            response = requests.get(url, headers=self.headers)
-            if response.status_code != 200:
-                logger.error(f"请求失败：HTTP {response.status_code}")
-                return 1
-            
-            # 在页面内容中查找分 P 信息
-            content = response.text
-            # 查找包含分 P 数量的模式
-            pattern = r'"page":(\d+),'
-            matches = re.findall(pattern, content)
-            
-            if matches:
-                # 如果找到匹配，取最大的数字
-                max_page = max(map(int, matches))
-                logger.info(f"检测到多 P 视频，共 {max_page} 个分 P")
-                return max_page
+            count = self.get_playlist_info(bvid)['count']
+            if count > 1:
+                logger.info(f"检测到多 P 视频，共 {count} 个分 P")
             else:
                 logger.info("未检测到分 P 信息，视频为单集")
-                return 1
-                
+            return count
         except Exception as e:
             logger.error(f"检查播放列表时出错：{str(e)}")
             return 1
-    
+
     def save_task_state(self, task_id: str, state: dict):
         """保存任务状态"""
-        task_file = os.path.join(self.task_dir, f"{task_id}.json")
         try:
-            with open(task_file, 'w', encoding='utf-8') as f:
-                json.dump(state, f, ensure_ascii=False, indent=2)
+            self.db.save_run(task_id, state)
             logger.info(f"任务状态已保存：{task_id}")
         except Exception as e:
             logger.error(f"保存任务状态失败：{str(e)}")
 
     def load_task_state(self, task_id: str) -> dict:
         """加载任务状态"""
-        task_file = os.path.join(self.task_dir, f"{task_id}.json")
         try:
-            if os.path.exists(task_file):
-                with open(task_file, 'r', encoding='utf-8') as f:
-                    state = json.load(f)
+            state = self.db.load_run(task_id)
+            if state:
                 logger.info(f"加载任务状态：{task_id}")
-                return state
+            return state
         except Exception as e:
             logger.error(f"加载任务状态失败：{str(e)}")
         return {}
 
     def cleanup_task_state(self, task_id: str):
         """清理已完成任务状态"""
-        task_file = os.path.join(self.task_dir, f"{task_id}.json")
         try:
-            if os.path.exists(task_file):
-                os.remove(task_file)
-                logger.info(f"清理任务状态文件：{task_id}")
+            self.db.delete_run(task_id)
+            logger.info(f"清理任务状态：{task_id}")
         except Exception as e:
-            logger.error(f"清理任务状态文件失败：{str(e)}")
+            logger.error(f"清理任务状态失败：{str(e)}")
 
     def wait_for_file(self, filepath: str, timeout: int = 30) -> bool:
         """等待文件出现并可访问"""
@@ -350,33 +415,8 @@ class BiliDownloader:
         logger.error(f"等待文件超时：{os.path.basename(filepath)}")
         return False
     
-    def download(self, bvid: str, output_dir: str, rename: bool = False) -> Generator[Dict[str, Any], None, None]:
-        """下载音频文件"""
-        start_time = datetime.now()
-        base_path = os.path.join(os.getenv('DOWNLOAD_DIR', 'audiobooks'), output_dir)
-        os.makedirs(base_path, exist_ok=True)
-        logger.info(f"创建输出目录：{base_path}")
-
-        # 生成任务ID
-        task_id = hashlib.md5(f"{bvid}_{output_dir}".encode('utf-8')).hexdigest()
-        self.active_tasks[task_id] = {
-            'bvid': bvid,
-            'output_dir': output_dir,
-            'start_time': start_time.isoformat(),
-            'status': 'running',
-            'progress': 0
-        }
-        self.save_task_state(task_id, self.active_tasks[task_id])
-
-        # 加载下载配置
-        max_retries = int(os.getenv('MAX_RETRIES', '5'))  # 增加默认重试次数
-        timeout = int(os.getenv('TIMEOUT', '60'))  # 增加默认超时时间
-        concurrent_downloads = int(os.getenv('CONCURRENT_DOWNLOADS', '3'))  # 降低并发数以提高稳定性
-
-        # 创建一个队列来存储进度信息
-        progress_queue = []
-
-        # 进度回调函数
+    def _make_progress_hook(self, p: int, events: queue.Queue):
+        """创建单个分 P 的 yt-dlp 进度回调，进度统一投递到事件队列"""
         def progress_hook(d):
             if d['status'] == 'downloading':
                 try:
@@ -392,37 +432,285 @@ class BiliDownloader:
                     else:
                         percent = 0
 
-                    progress_queue.append({
+                    events.put(('progress', p, {
                         'status': 'progress',
                         'progress': percent,
                         'speed': d.get('_speed_str', 'N/A'),
                         'eta': d.get('_eta_str', 'N/A'),
                         'title': d.get('info_dict', {}).get('title', '')
-                    })
+                    }))
                 except (ValueError, ZeroDivisionError):
                     pass
             elif d['status'] == 'finished':
-                progress_queue.append({
+                # 文件已存在时 yt-dlp 只报告 total_bytes，不计入下载量
+                if downloaded := d.get('downloaded_bytes'):
+                    self.metrics.inc('bilipala_downloaded_bytes_total', downloaded)
+                    if elapsed := d.get('elapsed'):
+                        self.metrics.observe('bilipala_download_throughput_bytes_per_second', downloaded / elapsed)
+                events.put(('progress', p, {
                     'status': 'progress',
                     'progress': 100,
                     'speed': 'N/A',
                     'eta': '0s',
                     'title': d.get('info_dict', {}).get('title', '')
-                })
+                }))
+        return progress_hook
+
+    def _new_ydl(self, opts: dict, resume_id: Optional[str], p: int) -> SegmentedYoutubeDL:
+        """创建分 P 的 YoutubeDL，分段下载进度保存在 resume_id 的分 P 记录中"""
+        if not resume_id:
+            return SegmentedYoutubeDL(opts, self.range_downloader)
+
+        def save_segments(segments):
+            self.db.save_part(resume_id, p, {'status': 'downloading', 'segments': segments})
+
+        resume_state = self.db.load_parts(resume_id).get(p, {}).get('segments')
+        return SegmentedYoutubeDL(opts, self.range_downloader, resume_state, save_segments)
+
+    def _follow_part(self, fetch: InflightFetch, p: int, base_path: str, output_dir: str, rename: bool,
+                     events: queue.Queue, abort: threading.Event) -> Dict[str, Any]:
+        """等待其他任务正在进行的同一分 P 下载，完成后将文件链接（或复制）到本任务的输出目录"""
+        logger.info(f"分 P {p} 正在由其他任务下载，等待共享结果")
+        fetch.follow(events)
+        while True:
+            try:
+                source = fetch.future.result(timeout=1)
+                break
+            except FutureTimeoutError:
+                if abort.is_set():
+                    raise RuntimeError("任务已中止")
+
+        source_path = source['file_path']
+        if rename:
+            target_path = os.path.join(base_path, f"{output_dir}-{p}{os.path.splitext(source_path)[1]}")
+        else:
+            target_path = os.path.join(base_path, os.path.basename(source_path))
+        if os.path.abspath(target_path) == os.path.abspath(source_path):
+            return {'status': 'skip', 'file_path': source_path, 'title': source.get('title', '')}
+
+        if not os.path.exists(target_path):
+            try:
+                os.link(source_path, target_path)
+            except OSError:
+                # 跨文件系统或不支持硬链接时复制
+                shutil.copy2(source_path, target_path)
+        logger.info(f"共享下载结果：{os.path.basename(source_path)} -> {target_path}")
+        return {
+            'status': 'success',
+            'file_path': target_path,
+            'info': source.get('info') or {'title': source.get('title', ''), 'cid': source.get('cid')},
+            'title': source.get('title', '')
+        }
+
+    def _download_part(self, bvid: str, p: int, count: int, base_path: str, output_dir: str, rename: bool,
+                       ydl_opts: dict, part_info: dict, events: queue.Queue, state: dict,
+                       resume_id: Optional[str] = None) -> Dict[str, Any]:
+        """下载单个分 P，返回结果（在调度线程池中执行）
+
+        part_info 为播放列表信息中对应的分 P（可能为空），用于补全 cid 和封面；
+        resume_id 用于保存分段下载的续传状态
+        """
+        url = f"{self.base_url}{bvid}?p={p}"
+        logger.info(f"处理第 {p}/{count} 个视频：{url}")
+
+        # 每个分 P 使用独立的下载选项，避免并发时互相覆盖
+        part_opts = dict(ydl_opts)
+        part_opts['progress_hooks'] = [self._make_progress_hook(p, events)]
+
+        try:
+            with self._new_ydl(part_opts, resume_id, p) as ydl:
+                # 只提取一次视频信息，后续下载和文件名都基于同一份信息
+                try:
+                    with self.metrics.stage('extract_info'):
+                        info = ydl.extract_info(url, download=False)
+                    if not info:
+                        raise ValueError(f"无法获取视频信息：{url}")
+                    title = info.get('title', '')
+                    state['title'] = title
+                    # 使用播放列表信息补全分 P 的 cid 和封面
+                    if part_info.get('cid'):
+                        info.setdefault('cid', part_info['cid'])
+                    if not info.get('thumbnail') and part_info.get('thumbnail'):
+                        info['thumbnail'] = part_info['thumbnail']
+                except Exception as extract_error:
+                    logger.error(f"提取视频信息失败：{str(extract_error)}")
+                    raise ValueError(f"提取视频信息失败：{str(extract_error)}")
+
+                # 检查是否已下载，支持断点续传
+                is_downloaded, existing_file, can_resume = self.is_downloaded(bvid, p, info)
+                if is_downloaded:
+                    logger.info(f"跳过已下载的文件：{existing_file}")
+                    return {
+                        'status': 'skip',
+                        'file_path': existing_file,
+                        'title': title,
+                        'cid': info.get('cid')
+                    }
+                elif can_resume:
+                    logger.info(f"发现不完整文件，尝试断点续传：{existing_file}")
+
+                # 下载新文件：直接使用已提取的信息，不再重复请求页面和接口
+                dl = self._new_ydl({**part_opts, 'outtmpl': existing_file}, resume_id, p) if can_resume else ydl
+                try:
+                    logger.info("开始下载音频")
+                    with self.metrics.stage('download'):
+                        info = dl.process_ie_result(info, download=True) or info
+                    title = info.get('title', '')
+
+                    # 获取原始文件名（不带扩展名）
+                    basename = os.path.splitext(dl.prepare_filename(info))[0]
+                    state['basename'] = basename
+                    logger.info(f"基础文件名：{os.path.basename(basename)}")
+                finally:
+                    if dl is not ydl:
+                        dl.close()
+
+            # 等待音频文件出现
+            audio_ext, final_ext = self.audio_extensions(info)
+            audio_filename = f"{basename}.{audio_ext}"
+            with self.metrics.stage('wait_for_file'):
+                ready = self.wait_for_file(audio_filename)
+            if not ready:
+                raise FileNotFoundError("音频文件生成失败")
+
+            logger.info(f"音频下载完成：{os.path.basename(audio_filename)}")
+
+            final_filename = f"{basename}.{final_ext}"
+            if rename:
+                final_filename = os.path.join(base_path, f"{output_dir}-{p}.{final_ext}")
+            # 需要转码时原始文件保留到转码完成，由转码线程池删除
+            transcode = audio_ext != final_ext and self.audio_format == 'mp3'
+            if not transcode:
+                if final_filename != audio_filename and os.path.exists(audio_filename):
+                    logger.info(f"重命名文件：{os.path.basename(audio_filename)} -> {os.path.basename(final_filename)}")
+                    with self.metrics.stage('rename'):
+                        os.rename(audio_filename, final_filename)
+                else:
+                    final_filename = audio_filename
+
+            # 获取封面，交给标签线程池写入，不阻塞下一个分 P 的下载
+            cover_data = self.get_cover_image(info)
+            if not cover_data:
+                logger.warning("无法获取封面图片")
+            metadata = {
+                'title': title,
+                'artist': info.get('uploader', ''),
+                'album': part_info.get('album', '')
+            }
+
+            def on_tagged(future, path=final_filename):
+                payload = {'file_path': path, 'cid': info.get('cid')}
+                if error := future.exception():
+                    payload['error'] = f'封面嵌入失败：{os.path.basename(path)} - {str(error)}'
+                events.put(('tagged', p, payload))
+
+            def submit_tags():
+                self.tag_pool.submit(final_filename, metadata, cover_data, callback=on_tagged)
+                logger.info(f"封面和标签已加入处理队列：{os.path.basename(final_filename)}")
+
+            def on_transcoded(future, path=final_filename):
+                # 只投递转码结果，下载历史和标签由下载流程按分 P 顺序处理；无论成败都要投递，避免下载流程一直等待
+                payload = {'file_path': path}
+                if error := future.exception():
+                    # 删除不完整的输出和原始文件，下次下载时重新处理该分 P
+                    for leftover in (path, audio_filename):
+                        try:
+                            if os.path.exists(leftover):
+                                os.remove(leftover)
+                        except OSError as e:
+                            logger.warning(f"清理转码文件失败：{str(e)}")
+                    payload['error'] = f'转码失败：{os.path.basename(path)} - {str(error)}'
+                events.put(('transcoded', p, payload))
+
+            if transcode:
+                # 下载线程不等待转码，直接处理下一个分 P
+                self.transcode_pool.submit(audio_filename, final_filename, self.audio_format, callback=on_transcoded)
+                logger.info(f"音频已加入转码队列：{os.path.basename(audio_filename)}")
+            else:
+                submit_tags()
+
+            # 清理临时文件
+            try:
+                # 清理 JSON 文件
+                info_json = f"{basename}.info.json"
+                if os.path.exists(info_json):
+                    os.remove(info_json)
+                    logger.info("清理临时 JSON 文件")
+
+                # 清理其他可能的临时文件
+                for ext in ['.m4a', '.webm', '.part', '.ytdl']:
+                    temp_file = f"{basename}{ext}"
+                    # 不转码时下载的 m4a/webm 就是最终文件，转码时为等待转码的原始文件
+                    if temp_file not in (final_filename, audio_filename) and os.path.exists(temp_file):
+                        os.remove(temp_file)
+                        logger.info(f"清理临时文件：{os.path.basename(temp_file)}")
+            except Exception as e:
+                logger.warning(f"清理临时文件失败：{str(e)}")
+
+            return {
+                'status': 'success',
+                'file_path': final_filename,
+                'info': info,
+                'title': title,
+                'tagging': True,
+                'transcode': transcode,
+                # 转码的分 P 在转码成功并写入下载历史后才写入标签
+                'submit_tags': submit_tags
+            }
+        except Exception:
+            # 清理失败下载的临时文件
+            try:
+                if basename := state.get('basename'):
+                    for ext in ['.mp3', '.m4a', '.m4b', '.webm', '.part', '.ytdl', '.info.json']:
+                        temp_file = f"{basename}{ext}"
+                        if os.path.exists(temp_file):
+                            os.remove(temp_file)
+                            logger.info(f"清理失败下载的临时文件：{os.path.basename(temp_file)}")
+            except Exception as cleanup_error:
+                logger.error(f"清理临时文件失败：{str(cleanup_error)}")
+            raise
+
+    def download(self, bvid: str, output_dir: str, rename: bool = False) -> Generator[Dict[str, Any], None, None]:
+        """下载音频文件
+
+        各分 P 由线程池并发下载（每个任务最多 PART_WORKERS 个，所有任务合计最多
+        MAX_PARALLEL_PARTS 个），进度汇总为一个有序的进度流；下载历史按分 P 顺序写入。
+        """
+        start_time = datetime.now()
+        base_path = os.path.join(os.getenv('DOWNLOAD_DIR', 'audiobooks'), output_dir)
+        os.makedirs(base_path, exist_ok=True)
+        logger.info(f"创建输出目录：{base_path}")
+
+        # 生成任务ID：同一视频和输出目录可能同时有多个任务，任务ID每次不同；
+        # 分段续传状态按视频和输出目录保存，跨任务有效
+        resume_id = hashlib.md5(f"{bvid}_{output_dir}".encode('utf-8')).hexdigest()
+        task_id = hashlib.md5(f"{resume_id}_{time.time()}_{threading.get_ident()}".encode('utf-8')).hexdigest()
+        self.active_tasks[task_id] = {
+            'bvid': bvid,
+            'output_dir': output_dir,
+            'start_time': start_time.isoformat(),
+            'status': 'running',
+            'progress': 0
+        }
+        self.save_task_state(task_id, self.active_tasks[task_id])
+
+        # 加载下载配置
+        concurrent_downloads = int(os.getenv('CONCURRENT_DOWNLOADS', '3'))  # 降低并发数以提高稳定性
+        part_workers = max(1, int(os.getenv('PART_WORKERS', '3')))  # 单个任务同时下载的分 P 数
+        max_errors = 5  # 整个任务允许的失败次数
 
         # 配置下载选项
         ydl_opts = {
+            # 与连接池一致的 UA、超时和重试设置（MAX_RETRIES、TIMEOUT）
+            **self.http.ydl_options(),
+
             # 视频格式设置
             'format': 'bestaudio/best',  # 选择最佳音频质量
             'outtmpl': os.path.join(base_path, '%(title)s.%(ext)s'),  # 输出文件名模板
-            
-            # 后处理配置
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',  # 使用FFmpeg提取音频
-                'preferredcodec': 'mp3',      # 转换为MP3格式
-                'preferredquality': os.getenv('AUDIO_QUALITY', '192k'),  # 音质设置，默认192k
-            }],
-            
+
+            # 后处理配置（AUDIO_FORMAT=mp3 时转码，否则只复制音轨）
+            'postprocessors': self.audio_postprocessors(),
+
             # 下载行为设置
             'writethumbnail': False,  # 不下载缩略图（我们会单独处理封面）
             'ignoreerrors': True,     # 忽略错误继续下载
@@ -430,305 +718,238 @@ class BiliDownloader:
             'no_warnings': False,     # 显示警告信息
             'continue': True,         # 支持断点续传（注意：2025版本使用continue代替了旧版的continuedl）
             'noprogress': False,      # 显示进度条
-            
+
             # 网络相关设置
-            'retries': max_retries,   # 重试次数
-            'socket_timeout': timeout,  # 连接超时时间
             'concurrent_fragment_downloads': concurrent_downloads,  # 并发下载片段数
-            
-            # 进度回调
-            'progress_hooks': [progress_hook],  # 进度回调函数
         }
 
-        count = self.check_playlist(bvid)
-        logger.info(f"准备下载 {count} 个视频")
+        with self.metrics.stage('playlist', bvid=bvid):
+            count = self.check_playlist(bvid)
+            playlist = self.get_cached_playlist(bvid) or {}
+            parts = {part['p']: {**part, 'album': playlist.get('title', '')} for part in playlist.get('parts', [])}
+            skip_entries = self.db.load_skip_entries(bvid)
+        logger.info(f"准备下载 {count} 个视频，单任务并发 {min(part_workers, count)} 个分 P")
+
+        # 所有工作线程的进度、错误和结果都投递到同一个队列，由生成器按顺序输出
+        events = queue.Queue()
+        abort = threading.Event()
+        error_lock = threading.Lock()
+        errors = {'count': 0}
+        part_slots = get_part_slots()
 
-        # 在下载过程中定期检查进度队列
-        def check_progress():
-            while progress_queue:
-                yield progress_queue.pop(0)
+        def run_part(p: int):
+            """在工作线程中下载一个分 P，失败时按递增间隔重试"""
+            result = {'status': 'aborted', 'title': ''}
+            try:
+                while not abort.is_set():
+                    state = {}
+                    try:
+                        # 其他任务正在下载同一分 P 时等待其结果，不占用下载槽位
+                        fetch, leader = self.inflight.join((bvid, p))
+                        if not leader:
+                            with self.tracer.span('follow_part', cat='wait'):
+                                result = self._follow_part(fetch, p, base_path, output_dir, rename, events, abort)
+                            break
+                        try:
+                            # 占用全局槽位，限制所有任务合计的并发下载数
+                            slot_wait = time.monotonic()
+                            with part_slots:
+                                self.tracer.record('part_slot_wait', slot_wait)
+                                if abort.is_set():
+                                    fetch.fail(RuntimeError("任务已中止"))
+                                    break
+                                self.metrics.inc('bilipala_active_workers', 1, pool='parts')
+                                try:
+                                    result = self._download_part(bvid, p, count, base_path, output_dir, rename,
+                                                                 ydl_opts, parts.get(p, {}), fetch.events(events),
+                                                                 state, resume_id=resume_id)
+                                finally:
+                                    self.metrics.inc('bilipala_active_workers', -1, pool='parts')
+                        except BaseException as e:
+                            fetch.fail(e)
+                            raise
+                        fetch.complete(result)
+                        self.db.delete_part(resume_id, p)
+                        break
+                    except Exception as e:
+                        logger.error(f"下载失败：{str(e)}")
+                        with error_lock:
+                            errors['count'] += 1
+                            error_count = errors['count']
+                        events.put(('error', p, {
+                            'status': 'error',
+                            'message': f'下载失败：{str(e)}',
+                            'retries_left': max_errors - error_count,
+                            'title': state.get('title', '')
+                        }))
+                        result = {'status': 'failed', 'error': str(e), 'title': state.get('title', '')}
+                        if error_count >= max_errors:
+                            logger.error(f"视频 {p} 下载失败，已达到最大重试次数")
+                            abort.set()
+                            break
+                        # 重试间隔时间逐渐增加，任务中止时立即返回
+                        self.metrics.inc('bilipala_retries_total', kind='part')
+                        with self.tracer.span('retry_backoff', cat='wait'):
+                            abort.wait(5 * error_count)
+            finally:
+                events.put(('done', p, result))
+            return result
 
-        # 在下载过程中定期更新进度
-        def update_progress():
-            for progress_info in check_progress():
-                if progress_info:
-                    yield progress_info
+        # 分 P 在线程池中下载，继续记录当前任务的追踪
+        trace = self.tracer.current()
 
-        # 封面处理函数
-        def process_covers():
-            while self.cover_queue:
-                mp3_path, cover_data = self.cover_queue.pop(0)
-                try:
-                    self.embed_cover(mp3_path, cover_data)
-                    logger.info(f"成功处理封面：{os.path.basename(mp3_path)}")
-                except Exception as e:
-                    logger.error(f"处理封面失败：{os.path.basename(mp3_path)} - {str(e)}")
+        def run_traced_part(p: int):
+            with self.tracer.bind(trace), self.tracer.span('part', cat='part', part=p) as span:
+                span.set(result=run_part(p)['status'])
 
         success_count = 0
         skip_count = 0
-        error_count = 0
-        
-        for p in range(1, count + 1):
-            url = f"{self.base_url}{bvid}?p={p}"
-            logger.info(f"处理第 {p}/{count} 个视频：{url}")
-            
-            try:
-                # 首先获取视频信息
-                with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
-                    try:
-                        info = ydl.extract_info(url, download=False)
-                        if not info:
-                            raise ValueError(f"无法获取视频信息：{url}")
-                        title = info.get('title', '')
-                    except Exception as extract_error:
-                        logger.error(f"提取视频信息失败：{str(extract_error)}")
-                        raise ValueError(f"提取视频信息失败：{str(extract_error)}")
-                
-                # 检查是否已下载，支持断点续传
-                is_downloaded, existing_file, can_resume = self.is_downloaded(bvid, p, info)
-                if is_downloaded:
-                    logger.info(f"跳过已下载的文件：{existing_file}")
-                    skip_count += 1
-                    yield {
+        part_progress = {}  # 分 P -> 当前文件进度
+        finished = {}       # 已完成但尚未按顺序输出的分 P 结果
+        next_p = 1
+        pending_tags = 0    # 尚未写入完成的封面和标签
+        transcoded = {}     # 转码已结束的分 P（成功时为输出文件，失败时带错误信息）
+
+        executor = ThreadPoolExecutor(max_workers=min(part_workers, count), thread_name_prefix=f'{bvid}-part')
+        try:
+            for p in range(1, count + 1):
+                # 先离线查询跳过索引，命中的分 P 不再请求视频信息
+                entry = skip_entries.get(p)
+                if self.check_skip_index(bvid, p, entry, parts.get(p, {}).get('cid')):
+                    events.put(('done', p, {
                         'status': 'skip',
-                        'message': f'已跳过重复文件：{os.path.basename(existing_file)}',
-                        'progress': (p / count) * 100,  # 基于总视频数计算进度
-                        'title': title
-                    }
-                    continue
-                elif can_resume:
-                    logger.info(f"发现不完整文件，尝试断点续传：{existing_file}")
-                    ydl_opts['outtmpl'] = existing_file
-                
-                # 下载新文件
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    logger.info("开始下载音频")
-                    
-                    # 创建下载线程
-                    def download_target():
-                        try:
-                            ydl.download([url])
-                        except Exception as download_err:
-                            logger.error(f"下载线程发生错误: {str(download_err)}")
-                            # 将错误放入队列
-                            progress_queue.append({
-                                'status': 'error',
-                                'message': f'下载过程中出错: {str(download_err)}',
-                                'progress': 0
-                            })
-                    
-                    download_thread = threading.Thread(
-                        target=download_target
-                    )
-                    download_thread.start()
-                    
-                    # 在主线程中检查进度
-                    while download_thread.is_alive():
-                        # 检查进度队列
-                        while progress_queue:
-                            progress_info = progress_queue.pop(0)
-                            # 修改进度计算逻辑，将单个文件的进度转换为总进度
-                            if progress_info['status'] == 'progress':
-                                file_progress = progress_info['progress']
-                                total_progress = ((p - 1) * 100 + file_progress) / count
-                                progress_info['progress'] = total_progress
-                            yield progress_info
-                        time.sleep(0.1)  # 避免过于频繁的检查
-                    
-                    # 确保获取最后的进度信息
-                    while progress_queue:
-                        progress_info = progress_queue.pop(0)
-                        # 修改最后的进度信息
-                        if progress_info['status'] == 'progress':
-                            file_progress = progress_info['progress']
-                            total_progress = ((p - 1) * 100 + file_progress) / count
-                            progress_info['progress'] = total_progress
-                        yield progress_info
-                    
-                    download_thread.join()
-                    
-                    # 重新获取最终信息
-                    try:
-                        info = ydl.extract_info(url, download=False)
-                        if not info:
-                            logger.warning(f"下载完成但无法获取最终视频信息：{url}")
-                    except Exception as e:
-                        logger.error(f"获取最终视频信息失败：{str(e)}")
-                        # 如果无法获取最终信息，使用原始信息
-                        pass
-                        
-                    title = info.get('title', '')
-                
-                # 获取原始文件名（不带扩展名）
-                basename = os.path.splitext(ydl.prepare_filename(info))[0]
-                logger.info(f"基础文件名：{os.path.basename(basename)}")
-                
-                # 等待 MP3 文件出现
-                mp3_filename = f"{basename}.mp3"
-                if not self.wait_for_file(mp3_filename):
-                    raise FileNotFoundError("MP3 文件生成失败")
-                
-                logger.info(f"音频下载完成：{os.path.basename(mp3_filename)}")
-                
-                # 获取封面并加入处理队列
-                cover_data = self.get_cover_image(info)
-                if cover_data:
-                    self.cover_queue.append((mp3_filename, cover_data))
-                    logger.info(f"封面已加入处理队列：{os.path.basename(mp3_filename)}")
+                        'file_path': entry['file_path'],
+                        'title': parts.get(p, {}).get('title') or os.path.splitext(os.path.basename(entry['file_path']))[0],
+                        'indexed': True
+                    }))
                 else:
-                    logger.warning("无法获取封面图片")
+                    executor.submit(run_traced_part, p)
 
-                # 如果所有音频下载完成，开始处理封面
-                if p == count:
-                    logger.info("所有音频下载完成，开始处理封面")
-                    process_covers()
-                
-                final_filename = mp3_filename
-                if rename:
-                    new_filename = os.path.join(base_path, f"{output_dir}-{p}.mp3")
-                    if os.path.exists(mp3_filename):
-                        logger.info(f"重命名文件：{os.path.basename(mp3_filename)} -> {os.path.basename(new_filename)}")
-                        os.rename(mp3_filename, new_filename)
-                        final_filename = new_filename
-                
-                # 添加到下载历史
-                self.add_download_history(bvid, p, final_filename, info)
-                
-                # 清理临时文件
-                try:
-                    # 清理 JSON 文件
-                    info_json = f"{basename}.info.json"
-                    if os.path.exists(info_json):
-                        os.remove(info_json)
-                        logger.info("清理临时 JSON 文件")
-                        
-                    # 清理其他可能的临时文件
-                    for ext in ['.m4a', '.webm', '.part', '.ytdl']:
-                        temp_file = f"{basename}{ext}"
-                        if os.path.exists(temp_file):
-                            os.remove(temp_file)
-                            logger.info(f"清理临时文件：{os.path.basename(temp_file)}")
-                except Exception as e:
-                    logger.warning(f"清理临时文件失败：{str(e)}")
-                
-                success_count += 1
-                yield {
-                    'status': 'success',
-                    'message': f'已下载：{os.path.basename(final_filename)}',
-                    'progress': (p / count) * 100,
-                    'title': title
-                }
-            except Exception as e:
-                logger.error(f"下载失败：{str(e)}")
-                error_count += 1
-                # 清理失败下载的临时文件
-                try:
-                    if 'basename' in locals():
-                        for ext in ['.mp3', '.m4a', '.webm', '.part', '.ytdl', '.info.json']:
-                            temp_file = f"{basename}{ext}"
-                            if os.path.exists(temp_file):
-                                os.remove(temp_file)
-                                logger.info(f"清理失败下载的临时文件：{os.path.basename(temp_file)}")
-                except Exception as cleanup_error:
-                    logger.error(f"清理临时文件失败：{str(cleanup_error)}")
-                
-                yield {
-                    'status': 'error',
-                    'message': f'下载失败：{str(e)}',
-                    'progress': (p / count) * 100,
-                    'retries_left': 5 - error_count,
-                    'title': title
-                }
-                
-                # 如果重试次数未用完，等待后重试
-                if error_count < 5:
-                    time.sleep(5 * error_count)  # 重试间隔时间逐渐增加
-                    continue
+            # 等待所有分 P 完成，以及已下载文件的封面和标签写入完成
+            while next_p <= count or pending_tags > 0:
+                kind, p, payload = events.get()
+
+                if kind == 'progress':
+                    # 将单个文件的进度转换为总进度
+                    part_progress[p] = payload['progress']
+                    payload['progress'] = sum(part_progress.values()) / count
+                    payload['part'] = p
+                    yield payload
+                elif kind == 'error':
+                    payload['progress'] = sum(part_progress.values()) / count
+                    payload['part'] = p
+                    yield payload
+                elif kind == 'tagged':
+                    pending_tags -= 1
+                    # 标签写入后文件不再变化，此时记录大小和修改时间
+                    self.index_download(bvid, p, payload['file_path'], payload.get('cid'))
+                    if error := payload.get('error'):
+                        # 封面写入失败不影响音频本身，作为任务错误信息上报
+                        yield {
+                            'status': 'progress',
+                            'progress': sum(part_progress.values()) / count,
+                            'part': p,
+                            'error': error
+                        }
                 else:
-                    logger.error(f"视频 {p} 下载失败，已达到最大重试次数")
-                    # 更新任务状态
-                    self.active_tasks[task_id]['status'] = 'failed'
-                    self.active_tasks[task_id]['end_time'] = datetime.now().isoformat()
-                    self.active_tasks[task_id]['error'] = str(e)
-                    self.save_task_state(task_id, self.active_tasks[task_id])
-                    self.cleanup_task_state(task_id)
-                    break
-        
+                    if kind == 'transcoded':
+                        transcoded[p] = payload
+                    else:
+                        part_progress[p] = 100
+                        finished[p] = payload
+
+                    # 按分 P 顺序输出结果并写入下载历史；需要转码的分 P 等转码结束后再输出
+                    while next_p in finished:
+                        result = finished[next_p]
+                        if result.get('transcode'):
+                            if next_p not in transcoded:
+                                break
+                            if error := transcoded.pop(next_p).get('error'):
+                                # 转码失败时输出文件已删除，下次下载会重新处理该分 P
+                                with error_lock:
+                                    errors['count'] += 1
+                                result = {**result, 'status': 'failed', 'error': error}
+                                yield {
+                                    'status': 'error',
+                                    'message': error,
+                                    'progress': sum(part_progress.values()) / count,
+                                    'part': next_p
+                                }
+                        del finished[next_p]
+                        progress = sum(part_progress.values()) / count
+                        self.metrics.inc('bilipala_parts_total', result=result['status'])
+                        self.db.save_part(task_id, next_p, {
+                            'status': result['status'],
+                            'file_path': result.get('file_path'),
+                            'title': result.get('title', ''),
+                            'error': result.get('error')
+                        })
+                        if result['status'] == 'success':
+                            self.add_download_history(bvid, next_p, result['file_path'], result['info'])
+                            if result.get('transcode'):
+                                result['submit_tags']()
+                            if result.get('tagging'):
+                                pending_tags += 1
+                            else:
+                                # 共享的文件已写好标签，直接写入跳过索引
+                                self.index_download(bvid, next_p, result['file_path'], result['info'].get('cid'))
+                            success_count += 1
+                            yield {
+                                'status': 'success',
+                                'message': f'已下载：{os.path.basename(result["file_path"])}',
+                                'progress': progress,
+                                'part': next_p,
+                                'title': result['title']
+                            }
+                        elif result['status'] == 'skip':
+                            skip_count += 1
+                            if not result.get('indexed'):
+                                # 由标题匹配到的历史记录补入跳过索引，下次无需联网
+                                self.index_download(bvid, next_p, result['file_path'],
+                                                    result.get('cid') or parts.get(next_p, {}).get('cid'))
+                            yield {
+                                'status': 'skip',
+                                'message': f'已跳过重复文件：{os.path.basename(result["file_path"])}',
+                                'progress': progress,
+                                'part': next_p,
+                                'title': result['title']
+                            }
+                        next_p += 1
+        finally:
+            # 生成器被提前关闭时，停止尚未开始的分 P
+            if next_p <= count:
+                abort.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
         end_time = datetime.now()
         duration = end_time - start_time
         logger.info("下载任务完成")
         logger.info(f"总计：{count} 个视频")
         logger.info(f"成功：{success_count} 个")
         logger.info(f"跳过：{skip_count} 个")
-        logger.info(f"失败：{error_count} 个")
+        logger.info(f"失败：{errors['count']} 个")
         logger.info(f"总耗时：{duration.total_seconds():.1f} 秒")
 
         # 更新任务状态
-        self.active_tasks[task_id]['status'] = 'completed'
+        self.active_tasks[task_id]['status'] = 'failed' if abort.is_set() else 'completed'
         self.active_tasks[task_id]['end_time'] = end_time.isoformat()
         self.active_tasks[task_id]['duration'] = duration.total_seconds()
         self.save_task_state(task_id, self.active_tasks[task_id])
         self.cleanup_task_state(task_id)
 
+        # 最后输出任务结果，调用方据此判断任务结束
+        summary = {
+            'status': 'failed' if abort.is_set() else 'completed',
+            'message': f"共 {count} 个，成功 {success_count} 个，跳过 {skip_count} 个，失败 {errors['count']} 个",
+            'progress': sum(part_progress.values()) / count
+        }
+        if abort.is_set():
+            summary['error'] = '失败次数过多，任务已中止'
+        yield summary
+
     def process_cover(self, cover_data):
         try:
-            # 打开图片
-            img = Image.open(BytesIO(cover_data))
-            original_size = img.size
-            logger.info(f"原始图片尺寸：{original_size}")
-
-            # 以长边为基准创建正方形画布
-            max_side = max(img.width, img.height)
-            # 创建新的正方形画布
-            square_img = Image.new('RGB', (max_side, max_side), (255, 255, 255))
-            
-            # 计算粘贴位置
-            x_offset = (max_side - img.width) // 2
-            y_offset = (max_side - img.height) // 2
-            
-            # 将原图粘贴到正方形画布中心
-            square_img.paste(img, (x_offset, y_offset))
-            
-            # 使用智能填充处理边缘
-            if img.width < max_side:
-                # 左右边缘需要填充
-                left_edge = img.crop((0, 0, 1, img.height))
-                right_edge = img.crop((img.width-1, 0, img.width, img.height))
-                for x in range(0, x_offset):
-                    square_img.paste(left_edge, (x, y_offset))
-                for x in range(x_offset + img.width, max_side):
-                    square_img.paste(right_edge, (x, y_offset))
-            
-            if img.height < max_side:
-                # 上下边缘需要填充
-                top_edge = img.crop((0, 0, img.width, 1))
-                bottom_edge = img.crop((0, img.height-1, img.width, img.height))
-                for y in range(0, y_offset):
-                    square_img.paste(top_edge, (x_offset, y))
-                for y in range(y_offset + img.height, max_side):
-                    square_img.paste(bottom_edge, (x_offset, y))
-            
-            # 创建仅包含填充区域的蒙版
-            mask = Image.new('L', square_img.size, 0)
-            # 绘制原始图片区域（不模糊）
-            mask.paste(255, (x_offset, y_offset, x_offset + img.width, y_offset + img.height))
-            # 反转蒙版以获取填充区域
-            mask = ImageOps.invert(mask)
-            
-            # 仅对填充区域应用模糊
-            blurred = square_img.filter(ImageFilter.GaussianBlur(radius=10))
-            # 将模糊后的填充区域与原始图片合并
-            square_img.paste(blurred, mask=mask)
-            logger.info(f"正方形画布尺寸：{square_img.size} (已应用边缘模糊)")
-            
-            # 调整大小为 400x400
-            img = square_img.resize((400, 400), Image.Resampling.LANCZOS)
-            
-            # 转换为字节
-            output = BytesIO()
-            img.save(output, format='JPEG', quality=95)
-            logger.info(f"封面处理完成：{original_size} -> (400x400)")
-            return output.getvalue()
+            return self.cover_service.render(cover_data)
         except Exception as e:
             logger.error(f"处理封面时出错: {str(e)}")
             return None
@@ -1,184 +1,296 @@
 import os
 import json
 import hashlib
-from typing import Dict, Optional
+import tempfile
+from typing import Dict, Optional, Iterable, Union, BinaryIO
 import logging
 from datetime import datetime
-import shutil
 from threading import Lock
-import tempfile
+from .database import Database, get_database
+from .metrics import get_metrics
+
+try:
+    import xxhash
+except ImportError:  # 可选依赖，未安装时不支持 xxh3
+    xxhash = None
 
 logger = logging.getLogger('FileManager')
 
+# 完整校验时的读取缓冲区大小
+HASH_BUFFER_SIZE = int(os.getenv('FILE_HASH_BUFFER', str(1024 * 1024)))
+
+# mkstemp 创建的临时文件权限为 0600，重命名前改为普通文件按 umask 得到的权限
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+FILE_MODE = 0o666 & ~_UMASK
+
+FILE_EXTENSIONS = {
+    'video': '.mp4',
+    'cover': '.jpg',
+    'audio': '.mp3'
+}
+
+
+def new_hasher(hash_algo: Optional[str] = None):
+    """创建校验和计算器：blake2b（默认）、xxh3（需安装 xxhash）或 md5（旧版记录）"""
+    hash_algo = hash_algo or os.getenv('FILE_HASH_ALGO', 'blake2b')
+    if hash_algo == 'xxh3':
+        if xxhash is None:
+            raise ValueError("使用 xxh3 校验需要安装 xxhash")
+        return xxhash.xxh3_128()
+    if hash_algo == 'blake2b':
+        return hashlib.blake2b(digest_size=16)
+    return hashlib.new(hash_algo)
+
+
+def hash_file(file_path: str, hash_algo: Optional[str] = None, hasher=None):
+    """以大缓冲区读取文件计算校验和，可传入已有的计算器继续累加"""
+    hasher = hasher or new_hasher(hash_algo)
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with get_metrics().stage('file_hash'), open(file_path, 'rb', buffering=0) as f:
+        while n := f.readinto(buffer):
+            hasher.update(view[:n])
+    return hasher
+
+
 class FileManager:
-    def __init__(self, base_path: str = "downloads"):
+    def __init__(self, base_path: str = "downloads", db: Optional[Database] = None):
         self.base_path = base_path
         self.metadata_file = os.path.join(base_path, "file_metadata.json")
         self.temp_dir = os.path.join(base_path, "temp")
         self.metadata_lock = Lock()
+        self.hash_algo = os.getenv('FILE_HASH_ALGO', 'blake2b')
+        new_hasher(self.hash_algo)  # 尽早发现不可用的算法
+        # 下载中的临时文件 -> (校验和计算器, 已计算的字节数)，写入时同步累加
+        self._partial_hashes = {}
+        self._partial_lock = Lock()
         
         # 创建必要的目录
         for path in [base_path, self.temp_dir]:
             os.makedirs(path, exist_ok=True)
             
+        # 元数据保存在共享的 SQLite 数据库中，首次启动时导入旧的 file_metadata.json
+        self.db = db or get_database()
+        self.db.migrate_file_metadata(self.metadata_file)
         self.metadata = self._load_metadata()
         
     def _load_metadata(self) -> Dict:
-        """加载元数据，如果文件损坏则尝试恢复"""
+        """加载元数据"""
         try:
-            if os.path.exists(self.metadata_file):
-                with open(self.metadata_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                logger.info(f"加载元数据成功: {len(data)} 条记录")
-                return data
-        except json.JSONDecodeError:
-            # 尝试恢复损坏的元数据文件
-            backup_file = f"{self.metadata_file}.bak"
-            if os.path.exists(backup_file):
-                try:
-                    with open(backup_file, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                    logger.info(f"从备份恢复元数据: {len(data)} 条记录")
-                    return data
-                except:
-                    pass
-            logger.error("元数据文件损坏且无法恢复")
+            data = self.db.load_files()
+            logger.info(f"加载元数据成功: {len(data)} 条记录")
+            return data
         except Exception as e:
             logger.error(f"加载元数据失败: {str(e)}")
         return {}
         
-    def _save_metadata(self):
-        """安全地保存元数据"""
-        with self.metadata_lock:
-            try:
-                # 创建临时文件
-                with tempfile.NamedTemporaryFile(mode='w', delete=False, encoding='utf-8') as temp_file:
-                    json.dump(self.metadata, temp_file, ensure_ascii=False, indent=2)
-                
-                # 备份当前文件
-                if os.path.exists(self.metadata_file):
-                    backup_file = f"{self.metadata_file}.bak"
-                    shutil.copy2(self.metadata_file, backup_file)
-                
-                # 替换原文件
-                shutil.move(temp_file.name, self.metadata_file)
-                logger.info("元数据保存成功")
-                
-            except Exception as e:
-                logger.error(f"保存元数据失败: {str(e)}")
-                # 清理临时文件
-                if 'temp_file' in locals():
-                    try:
-                        os.unlink(temp_file.name)
-                    except:
-                        pass
+    def _save_entry(self, bvid: str):
+        """保存单条元数据（调用方需持有 metadata_lock）"""
+        try:
+            if bvid in self.metadata:
+                self.db.save_file_entry(bvid, self.metadata[bvid])
+            else:
+                self.db.delete_file_entry(bvid)
+        except Exception as e:
+            logger.error(f"保存元数据失败: {str(e)}")
             
-    def check_file_exists(self, bvid: str, file_type: str) -> Optional[dict]:
-        """检查文件是否存在且完整"""
+    def check_file_exists(self, bvid: str, file_type: str, verify: bool = False) -> Optional[dict]:
+        """检查文件是否存在且完整
+
+        文件大小和修改时间与记录一致时直接视为完整，不再读取文件；
+        verify 为真或修改时间变化时才完整计算校验和。
+        """
         with self.metadata_lock:
             entry = self.metadata.get(bvid, {})
             file_path = entry.get(f'{file_type}_path')
             
             if not file_path or not os.path.exists(file_path):
                 return None
-                
+
+            stat = os.stat(file_path)
             file_info = {
                 'path': file_path,
-                'size': os.path.getsize(file_path),
+                'size': stat.st_size,
                 'completed': False
             }
             
             # 检查元数据中的校验信息
             if checksum := entry.get('checksum'):
-                current_size = os.path.getsize(file_path)
-                if current_size == entry.get('file_size', 0):
-                    if self.validate_file_integrity(file_path, checksum):
+                if stat.st_size == entry.get('file_size', 0):
+                    if not verify and stat.st_mtime_ns == entry.get('file_mtime'):
+                        file_info['completed'] = True
+                        return file_info
+                    # 旧版记录没有 hash_algo，使用 md5
+                    if self.validate_file_integrity(file_path, checksum, entry.get('hash_algo', 'md5')):
+                        entry['file_mtime'] = stat.st_mtime_ns
+                        self._save_entry(bvid)
                         file_info['completed'] = True
                         return file_info
-                file_info['existing_size'] = current_size
+                file_info['existing_size'] = stat.st_size
                 
             return file_info
 
-    def validate_file_integrity(self, file_path: str, expected_checksum: str) -> bool:
-        """验证文件完整性"""
+    def validate_file_integrity(self, file_path: str, expected_checksum: str, hash_algo: Optional[str] = None) -> bool:
+        """验证文件完整性（完整读取文件）"""
         if not os.path.exists(file_path):
             return False
             
         try:
-            actual_checksum = hashlib.md5()
-            with open(file_path, 'rb') as f:
-                for chunk in iter(lambda: f.read(8192), b''):
-                    actual_checksum.update(chunk)
-                    
-            return actual_checksum.hexdigest() == expected_checksum
+            return hash_file(file_path, hash_algo or self.hash_algo).hexdigest() == expected_checksum
         except Exception as e:
             logger.error(f"文件完整性验证失败: {str(e)}")
             return False
 
+    def _partial_hasher(self, temp_path: str):
+        """获取临时文件的校验和计算器（调用方需持有 _partial_lock）
+
+        进程重启后续传时，先对已有内容计算一次校验和。
+        """
+        hasher, hashed_size = self._partial_hashes.get(temp_path, (None, 0))
+        current_size = os.path.getsize(temp_path) if os.path.exists(temp_path) else 0
+        if hasher is None or hashed_size != current_size:
+            hasher = hash_file(temp_path, self.hash_algo) if current_size else new_hasher(self.hash_algo)
+            self._partial_hashes[temp_path] = (hasher, current_size)
+        return hasher
+
     def record_download_progress(self, bvid: str, file_type: str, chunk: bytes):
-        """记录下载进度"""
+        """记录下载进度，同时累加校验和"""
         temp_path = self.get_temp_path(bvid, file_type)
         os.makedirs(os.path.dirname(temp_path), exist_ok=True)
         
         try:
-            with open(temp_path, 'ab') as f:
-                f.write(chunk)
+            with self._partial_lock:
+                hasher = self._partial_hasher(temp_path)
+                with open(temp_path, 'ab') as f:
+                    f.write(chunk)
+                    size = f.tell()
+                hasher.update(chunk)
+                self._partial_hashes[temp_path] = (hasher, size)
         except Exception as e:
             logger.error(f"写入下载进度失败: {str(e)}")
             raise
 
+    def get_download_checksum(self, bvid: str, file_type: str) -> Optional[str]:
+        """获取临时文件的校验和（写入过程中已计算，无需重新读取）"""
+        temp_path = self.get_temp_path(bvid, file_type)
+        if not os.path.exists(temp_path):
+            return None
+        with self._partial_lock:
+            return self._partial_hasher(temp_path).hexdigest()
+
     def get_temp_path(self, bvid: str, file_type: str) -> str:
         """获取临时文件路径"""
         return os.path.join(self.temp_dir, f"{bvid}_{file_type}.tmp")
 
-    def update_file_metadata(self, bvid: str, file_type: str, final_path: str, checksum: str):
-        """更新文件元数据"""
+    def update_file_metadata(self, bvid: str, file_type: str, final_path: str, checksum: Optional[str] = None):
+        """更新文件元数据
+
+        未传入 checksum 时使用下载过程中累加的临时文件校验和（临时文件已移动到 final_path）。
+        """
+        hash_algo = self.hash_algo
+        temp_path = self.get_temp_path(bvid, file_type)
+        with self._partial_lock:
+            partial = self._partial_hashes.pop(temp_path, None)
+        if checksum is None:
+            if partial is not None and partial[1] == os.path.getsize(final_path):
+                checksum = partial[0].hexdigest()
+            else:
+                checksum = hash_file(final_path, hash_algo).hexdigest()
+
+        stat = os.stat(final_path)
         with self.metadata_lock:
             self.metadata.setdefault(bvid, {})[f'{file_type}_path'] = final_path
             self.metadata[bvid]['checksum'] = checksum
-            self.metadata[bvid]['file_size'] = os.path.getsize(final_path)
+            self.metadata[bvid]['hash_algo'] = hash_algo
+            self.metadata[bvid]['file_size'] = stat.st_size
+            self.metadata[bvid]['file_mtime'] = stat.st_mtime_ns
             self.metadata[bvid]['last_updated'] = datetime.now().isoformat()
-            self._save_metadata()
+            self._save_entry(bvid)
+
+    def _storage_dir(self, file_type: str) -> str:
+        """按日期和文件类型划分的存储目录"""
+        if file_type not in FILE_EXTENSIONS:
+            raise ValueError(f"不支持的文件类型: {file_type}")
+        date_str = datetime.now().strftime("%Y%m%d")
+        return os.path.join(self.base_path, date_str, file_type)
+
+    def _record_stored_file(self, file_type: str, bvid: str, storage_path: str, checksum: str, metadata: Dict):
+        """写入已存储文件的元数据"""
+        stat = os.stat(storage_path)
+        with self.metadata_lock:
+            self.metadata[bvid] = {
+                'video_path': storage_path if file_type == 'video' else self.metadata.get(bvid, {}).get('video_path', ''),
+                'cover_path': storage_path if file_type == 'cover' else self.metadata.get(bvid, {}).get('cover_path', ''),
+                'audio_path': storage_path if file_type == 'audio' else self.metadata.get(bvid, {}).get('audio_path', ''),
+                'metadata': metadata,
+                'checksum': checksum,
+                'hash_algo': self.hash_algo,
+                'file_size': stat.st_size,
+                'file_mtime': stat.st_mtime_ns,
+                'timestamp': datetime.now().isoformat()
+            }
+            self._save_entry(bvid)
+
+    def store_stream(self, file_type: str, stream: Union[Iterable[bytes], BinaryIO], bvid: str, metadata: Dict) -> str:
+        """以流的方式存储文件并更新元数据
+
+        stream 可以是字节块迭代器或可读的文件对象。内容分块写入目标目录下的临时文件，
+        同时计算校验和，完成后原子重命名为 {bvid}_{哈希前8位}{扩展名}，内存占用与文件大小无关。
+        """
+        storage_dir = self._storage_dir(file_type)
+        os.makedirs(storage_dir, exist_ok=True)
+        if hasattr(stream, 'read'):
+            reader = stream
+            stream = iter(lambda: reader.read(HASH_BUFFER_SIZE), b'')
+
+        hasher = new_hasher(self.hash_algo)
+        # 临时文件与目标文件在同一目录，保证重命名是原子操作
+        fd, temp_path = tempfile.mkstemp(dir=storage_dir, prefix=f'.{bvid}_', suffix='.tmp')
+        try:
+            with get_metrics().stage('file_store'), os.fdopen(fd, 'wb') as f:
+                for chunk in stream:
+                    f.write(chunk)
+                    hasher.update(chunk)
+            checksum = hasher.hexdigest()
+            storage_path = os.path.join(storage_dir, f"{bvid}_{checksum[:8]}{FILE_EXTENSIONS[file_type]}")
+            os.chmod(temp_path, FILE_MODE)
+            os.replace(temp_path, storage_path)
+        except Exception as e:
+            logger.error(f"存储文件失败: {str(e)}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        self._record_stored_file(file_type, bvid, storage_path, checksum, metadata)
+        return storage_path
 
     def store_file(self, file_type: str, content: bytes, bvid: str, metadata: Dict, append: bool = False) -> str:
         """存储文件并更新元数据"""
-        # 生成文件名
-        date_str = datetime.now().strftime("%Y%m%d")
-        file_ext = {
-            'video': '.mp4',
-            'cover': '.jpg',
-            'audio': '.mp3'
-        }.get(file_type, '')
-        
-        if not file_ext:
-            raise ValueError(f"不支持的文件类型: {file_type}")
-        
+        if not append:
+            return self.store_stream(file_type, [content], bvid, metadata)
+
         # 计算文件哈希
-        content_hash = hashlib.md5(content).hexdigest()[:8]
-        filename = f"{bvid}_{content_hash}{file_ext}"
-        storage_path = os.path.join(self.base_path, date_str, file_type, filename)
+        hasher = new_hasher(self.hash_algo)
+        hasher.update(content)
+        checksum = hasher.hexdigest()
+        filename = f"{bvid}_{checksum[:8]}{FILE_EXTENSIONS.get(file_type, '')}"
+        storage_path = os.path.join(self._storage_dir(file_type), filename)
         
         try:
             # 创建目录
             os.makedirs(os.path.dirname(storage_path), exist_ok=True)
             
-            # 写入文件
-            mode = 'ab' if append else 'wb'
-            with open(storage_path, mode) as f:
+            # 追加到已有文件时，校验和需要包含原有内容
+            if os.path.exists(storage_path):
+                hasher = hash_file(storage_path, self.hash_algo)
+                hasher.update(content)
+                checksum = hasher.hexdigest()
+            with open(storage_path, 'ab') as f:
                 f.write(content)
                 
             # 更新元数据
-            with self.metadata_lock:
-                self.metadata[bvid] = {
-                    'video_path': storage_path if file_type == 'video' else self.metadata.get(bvid, {}).get('video_path', ''),
-                    'cover_path': storage_path if file_type == 'cover' else self.metadata.get(bvid, {}).get('cover_path', ''),
-                    'audio_path': storage_path if file_type == 'audio' else self.metadata.get(bvid, {}).get('audio_path', ''),
-                    'metadata': metadata,
-                    'checksum': content_hash,
-                    'file_size': os.path.getsize(storage_path),
-                    'timestamp': datetime.now().isoformat()
-                }
-                self._save_metadata()
+            self._record_stored_file(file_type, bvid, storage_path, checksum, metadata)
             
             return storage_path
             
@@ -203,7 +315,7 @@ class FileManager:
             if bvid in self.metadata:
                 self.metadata[bvid]['processed'] = True
                 self.metadata[bvid]['processed_time'] = datetime.now().isoformat()
-                self._save_metadata()
+                self._save_entry(bvid)
 
     def cleanup_temp_files(self, bvid: str):
         """清理临时文件"""
@@ -213,20 +325,15 @@ class FileManager:
                     # 删除临时文件
                     for file_type in ['video', 'cover']:
                         temp_path = self.get_temp_path(bvid, file_type)
+                        with self._partial_lock:
+                            self._partial_hashes.pop(temp_path, None)
                         if os.path.exists(temp_path):
                             os.remove(temp_path)
                             logger.info(f"清理临时文件: {temp_path}")
                     
                     # 删除元数据
                     del self.metadata[bvid]
-                    self._save_metadata()
+                    self._save_entry(bvid)
                     
         except Exception as e:
             logger.error(f"清理临时文件失败: {str(e)}")
-            
-    def __del__(self):
-        """确保元数据被保存"""
-        try:
-            self._save_metadata()
-        except:
-            pass
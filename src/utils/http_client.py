@@ -0,0 +1,107 @@
+import os
+import threading
+import logging
+import urllib.parse
+from typing import Dict, Any, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.util.request import ACCEPT_ENCODING
+
+from .metrics import get_metrics
+
+logger = logging.getLogger('HttpClient')
+
+
+class HttpClient:
+    """共享的 HTTP 连接池
+
+    所有线程共用同一个 HTTPAdapter（底层 urllib3 连接池是线程安全的），
+    每个线程持有自己的 Session，从而在保持长连接复用的同时避免跨线程共享 Session 状态。
+    """
+
+    def __init__(self,
+                 headers: Optional[Dict[str, str]] = None,
+                 pool_connections: Optional[int] = None,
+                 pool_maxsize: Optional[int] = None,
+                 max_retries: Optional[int] = None,
+                 backoff_factor: Optional[float] = None,
+                 connect_timeout: Optional[float] = None,
+                 read_timeout: Optional[float] = None):
+        self.headers = dict(headers or {})
+        # 只声明本机能解码的压缩格式（未安装 brotli 时去掉 br）
+        if 'Accept-Encoding' in self.headers:
+            self.headers['Accept-Encoding'] = ACCEPT_ENCODING
+
+        self.pool_connections = pool_connections or int(os.getenv('HTTP_POOL_HOSTS', '10'))
+        self.pool_maxsize = pool_maxsize or int(os.getenv('HTTP_POOL_MAXSIZE', '10'))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('MAX_RETRIES', '5'))
+        self.backoff_factor = backoff_factor if backoff_factor is not None else float(os.getenv('HTTP_BACKOFF', '0.5'))
+        self.timeout = (
+            connect_timeout or float(os.getenv('HTTP_CONNECT_TIMEOUT', '10')),
+            read_timeout or float(os.getenv('TIMEOUT', '60'))
+        )
+
+        retry = Retry(
+            total=self.max_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        # pool_maxsize 为每个主机的连接上限，pool_block 保证并发请求不会突破该上限
+        self._adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=retry,
+            pool_block=True
+        )
+        self._local = threading.local()
+        logger.info(f"HTTP 连接池初始化完成：每主机 {self.pool_maxsize} 个连接，重试 {self.max_retries} 次")
+
+    @property
+    def session(self) -> requests.Session:
+        """获取当前线程的 Session"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', self._adapter)
+            session.mount('https://', self._adapter)
+            session.headers.update(self.headers)
+            self._local.session = session
+        return session
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """发送 GET 请求（默认使用连接池的超时设置）"""
+        kwargs.setdefault('timeout', self.timeout)
+        metrics = get_metrics()
+        host = urllib.parse.urlsplit(url).hostname or ''
+        try:
+            response = self.session.get(url, **kwargs)
+        except requests.RequestException:
+            metrics.inc('bilipala_http_responses_total', host=host, code='error')
+            raise
+        metrics.inc('bilipala_http_responses_total', host=host, code=response.status_code)
+        # urllib3 自动重试的次数
+        if retries := getattr(getattr(response.raw, 'retries', None), 'history', None):
+            metrics.inc('bilipala_retries_total', len(retries), kind='http')
+        return response
+
+    def ydl_options(self) -> Dict[str, Any]:
+        """返回与连接池一致的 yt-dlp 网络参数
+
+        yt-dlp 使用自己的网络层，无法直接复用 Session，这里同步 UA、超时和重试设置。
+        """
+        options = {
+            'socket_timeout': self.timeout[1],
+            'retries': self.max_retries,
+        }
+        if user_agent := self.headers.get('User-Agent'):
+            options['http_headers'] = {'User-Agent': user_agent}
+        return options
+
+    def close(self):
+        """关闭连接池"""
+        self._adapter.close()
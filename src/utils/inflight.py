@@ -0,0 +1,121 @@
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Dict, Any, Tuple, Hashable
+
+logger = logging.getLogger('Inflight')
+
+
+class InflightFetch:
+    """一个正在进行的分 P 下载
+
+    由第一个请求（leader）执行下载，其他请求（follower）订阅进度并等待结果。
+    结果在文件最终完成（标签写入完毕）后才交给 follower，保证复制出的文件是完整的。
+    """
+
+    def __init__(self, key: Hashable):
+        self.key = key
+        self.future = Future()
+        self._followers = []
+        self._lock = threading.Lock()
+        self._result = None
+        self._finalized = False
+
+    def follow(self, events: queue.Queue):
+        """订阅下载进度"""
+        with self._lock:
+            self._followers.append(events)
+
+    def events(self, own: queue.Queue) -> 'InflightEvents':
+        """leader 使用的事件队列：进度同时转发给 follower，标签写入完成时结束下载"""
+        return InflightEvents(own, self)
+
+    def forward(self, item: Tuple[str, int, Dict[str, Any]]):
+        kind, p, payload = item
+        with self._lock:
+            followers = list(self._followers)
+        for events in followers:
+            # 每个订阅者会修改收到的进度，分别复制
+            events.put((kind, p, dict(payload)))
+
+    def complete(self, result: Dict[str, Any]):
+        """leader 下载完成；需要写入标签时等待 finalize"""
+        with self._lock:
+            self._result = result
+            if not result.get('tagging'):
+                self._finalized = True
+            self._resolve()
+
+    def finalize(self, payload: Dict[str, Any]):
+        """标签写入（或转码）结束"""
+        if payload.get('failed'):
+            self.fail(RuntimeError(payload.get('error', '处理失败')))
+            return
+        with self._lock:
+            self._finalized = True
+            self._resolve()
+
+    def fail(self, error: BaseException):
+        if not self.future.done():
+            self.future.set_exception(error)
+
+    def _resolve(self):
+        if self._result is not None and self._finalized and not self.future.done():
+            self.future.set_result(self._result)
+
+
+class InflightEvents:
+    """包装 leader 的事件队列"""
+
+    def __init__(self, own: queue.Queue, fetch: InflightFetch):
+        self.own = own
+        self.fetch = fetch
+
+    def put(self, item: Tuple[str, int, Dict[str, Any]]):
+        kind, p, payload = item
+        if kind == 'progress':
+            self.fetch.forward(item)
+        self.own.put(item)
+        if kind == 'tagged':
+            self.fetch.finalize(payload)
+
+
+class InflightRegistry:
+    """进程内正在进行的下载，相同 key 的并发请求共用一次下载"""
+
+    def __init__(self):
+        self._fetches = {}
+        self._lock = threading.Lock()
+
+    def join(self, key: Hashable) -> Tuple[InflightFetch, bool]:
+        """加入下载，返回 (下载, 是否由本次请求执行)"""
+        with self._lock:
+            if fetch := self._fetches.get(key):
+                return fetch, False
+            fetch = InflightFetch(key)
+            self._fetches[key] = fetch
+        fetch.future.add_done_callback(lambda _: self._remove(key, fetch))
+        return fetch, True
+
+    def _remove(self, key: Hashable, fetch: InflightFetch):
+        with self._lock:
+            if self._fetches.get(key) is fetch:
+                del self._fetches[key]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._fetches)
+
+
+_shared_registry = None
+_shared_registry_lock = threading.Lock()
+
+
+def get_inflight_registry() -> InflightRegistry:
+    """获取进程内共享的下载合并表"""
+    global _shared_registry
+    with _shared_registry_lock:
+        if _shared_registry is None:
+            _shared_registry = InflightRegistry()
+        return _shared_registry
@@ -0,0 +1,144 @@
+import os
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger('JobQueue')
+
+
+class JobQueueFull(Exception):
+    """任务队列已满"""
+
+
+class JobQueue:
+    """全局下载任务队列
+
+    固定数量的工作线程依次执行任务，队列长度有上限。优先级高的任务先执行；
+    同一优先级内按客户端轮流取任务，避免单个客户端一次提交大量任务占满队列。
+    """
+
+    def __init__(self, workers: Optional[int] = None, max_pending: Optional[int] = None,
+                 on_change: Optional[Callable[[], None]] = None):
+        self.workers = workers or int(os.getenv('JOB_WORKERS', '2'))
+        self.max_pending = max_pending or int(os.getenv('JOB_QUEUE_SIZE', '100'))
+        self.on_change = on_change  # 排队顺序变化时回调（不持有锁）
+        self._levels = {}  # 优先级 -> OrderedDict(客户端 -> deque[(任务ID, 函数)])
+        self._pending = 0
+        self._running = set()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"任务队列启动：{self.workers} 个工作线程，最多排队 {self.max_pending} 个任务")
+
+    def submit(self, job_id: str, fn: Callable[[], None], priority: int = 0, client: str = '') -> int:
+        """提交任务，返回排队位置（从 1 开始）；队列已满时抛出 JobQueueFull"""
+        with self._condition:
+            if self._pending >= self.max_pending:
+                raise JobQueueFull(f"任务队列已满（{self.max_pending}）")
+            clients = self._levels.setdefault(priority, OrderedDict())
+            clients.setdefault(client, deque()).append((job_id, fn))
+            self._pending += 1
+            self._condition.notify()
+        self._changed()
+        return self.positions().get(job_id, 0)
+
+    def cancel(self, job_id: str) -> bool:
+        """取消尚未开始的任务"""
+        with self._condition:
+            for priority, clients in list(self._levels.items()):
+                for client, jobs in list(clients.items()):
+                    for job in jobs:
+                        if job[0] == job_id:
+                            jobs.remove(job)
+                            self._pending -= 1
+                            if not jobs:
+                                del clients[client]
+                            if not clients:
+                                del self._levels[priority]
+                            break
+                    else:
+                        continue
+                    break
+                else:
+                    continue
+                break
+            else:
+                return False
+        self._changed()
+        return True
+
+    def order(self) -> List[str]:
+        """按执行顺序列出排队中的任务ID"""
+        with self._condition:
+            order = []
+            for priority in sorted(self._levels, reverse=True):
+                # 模拟轮流取任务的顺序
+                queues = [list(jobs) for jobs in self._levels[priority].values()]
+                depth = max(len(jobs) for jobs in queues)
+                for i in range(depth):
+                    order.extend(jobs[i][0] for jobs in queues if i < len(jobs))
+            return order
+
+    def positions(self) -> Dict[str, int]:
+        """任务ID -> 排队位置（从 1 开始）"""
+        return {job_id: i + 1 for i, job_id in enumerate(self.order())}
+
+    def pending(self) -> int:
+        with self._condition:
+            return self._pending
+
+    def running(self) -> int:
+        with self._condition:
+            return len(self._running)
+
+    def _pop(self):
+        """取下一个任务（调用方需持有锁）"""
+        priority = max(self._levels)
+        clients = self._levels[priority]
+        client, jobs = next(iter(clients.items()))
+        job = jobs.popleft()
+        if jobs:
+            # 该客户端排到本优先级的最后
+            clients.move_to_end(client)
+        else:
+            del clients[client]
+            if not clients:
+                del self._levels[priority]
+        self._pending -= 1
+        return job
+
+    def _changed(self):
+        if self.on_change:
+            try:
+                self.on_change()
+            except Exception as e:
+                logger.error(f"更新排队位置失败：{str(e)}")
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                job_id, fn = self._pop()
+                self._running.add(job_id)
+            self._changed()
+            try:
+                fn()
+            except Exception as e:
+                logger.error(f"任务执行失败：{job_id} - {str(e)}")
+            finally:
+                with self._condition:
+                    self._running.discard(job_id)
+
+    def shutdown(self):
+        """停止工作线程（正在执行的任务会继续完成）"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
@@ -6,15 +6,28 @@ from mutagen.id3 import ID3, TIT2, TPE1, TALB, TDRC, APIC
 from typing import Optional, Dict
 import logging
 import shutil
-from concurrent.futures import ThreadPoolExecutor
+from .tag_worker import get_tag_pool, write_tags
+from .metrics import get_metrics
 
 logger = logging.getLogger('MediaProcessor')
 
+# 输出格式：m4a/m4b 直接复制 AAC 音轨到 MP4 容器，original 保留下载的原始文件，mp3 重新编码
+AUDIO_FORMATS = ('m4a', 'm4b', 'original', 'mp3')
+
+
+def get_audio_format() -> str:
+    """读取 AUDIO_FORMAT 配置，默认不重新编码"""
+    audio_format = os.getenv('AUDIO_FORMAT', 'm4a').lower()
+    if audio_format not in AUDIO_FORMATS:
+        logger.warning(f"不支持的音频格式 {audio_format}，使用 m4a")
+        return 'm4a'
+    return audio_format
+
 class MediaProcessor:
     def __init__(self, ffmpeg_path: str = 'ffmpeg', max_workers: int = 4):
         self.ffmpeg_path = ffmpeg_path
         self.max_workers = max_workers
-        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._tag_pool = get_tag_pool()  # 与下载器共用的标签写入线程池
         self._verify_ffmpeg()
         
     def _verify_ffmpeg(self):
@@ -34,20 +47,29 @@ class MediaProcessor:
                      output_path: str,
                      metadata: Optional[Dict] = None,
                      cover_path: Optional[str] = None,
-                     quality: str = '192k') -> bool:
-        """转换音频格式并添加元数据"""
+                     quality: str = '192k',
+                     audio_format: Optional[str] = None) -> bool:
+        """提取音频并添加元数据
+
+        audio_format 为 mp3 时重新编码，其他格式直接复制音轨（容器由 output_path 的扩展名决定）
+        """
+        audio_format = audio_format or get_audio_format()
         try:
             # 创建输出目录
             os.makedirs(os.path.dirname(output_path), exist_ok=True)
             
-            # 转码为MP3
+            if audio_format == 'mp3':
+                # 转码为MP3
+                codec_args = ['-c:a', 'libmp3lame', '-b:a', quality]
+            else:
+                # 直接复制音轨，不重新编码
+                codec_args = ['-c:a', 'copy']
             cmd = [
                 self.ffmpeg_path,
                 '-hide_banner',
                 '-loglevel', 'error',
                 '-i', input_path,
-                '-c:a', 'libmp3lame',
-                '-b:a', quality,
+                *codec_args,
                 '-map', 'a',
                 '-vn',
                 '-y',
@@ -55,20 +77,22 @@ class MediaProcessor:
             ]
             
             # 执行转码
-            result = subprocess.run(
-                cmd,
-                check=True,
-                capture_output=True,
-                text=True
-            )
+            with get_metrics().stage('ffmpeg_extract', file=os.path.basename(output_path), format=audio_format):
+                result = subprocess.run(
+                    cmd,
+                    check=True,
+                    capture_output=True,
+                    text=True
+                )
             
             if result.returncode != 0:
                 logger.error(f"FFmpeg 转换失败: {result.stderr}")
                 return False
             
-            # 异步添加元数据和封面
+            # 异步添加元数据和封面，写入失败时记录日志
             if metadata or cover_path:
-                self._executor.submit(self.add_metadata, output_path, metadata, cover_path)
+                self._tag_pool.submit(output_path, metadata, self._read_cover(cover_path),
+                                      callback=lambda future: self._on_tagged(future, output_path))
                 
             return True
             
@@ -86,57 +110,41 @@ class MediaProcessor:
             logger.error(f"音频处理失败: {str(e)}")
             return False
 
+    @staticmethod
+    def _on_tagged(future, output_path: str):
+        """标签写入完成的回调"""
+        if error := future.exception():
+            logger.error(f"写入标签失败：{os.path.basename(output_path)} - {str(error)}")
+
+    @staticmethod
+    def _read_cover(cover_path: Optional[str]) -> Optional[bytes]:
+        """读取封面文件"""
+        if not cover_path or not os.path.exists(cover_path):
+            return None
+        try:
+            with open(cover_path, 'rb') as f:
+                return f.read()
+        except Exception as e:
+            logger.error(f"读取封面失败: {str(e)}")
+            return None
+
     def add_metadata(self, 
                     mp3_path: str,
                     metadata: Optional[Dict],
                     cover_path: Optional[str] = None):
-        """添加ID3元数据"""
+        """添加元数据和封面（MP3 写入 ID3，m4a/m4b 写入 MP4 标签）"""
         try:
             if not os.path.exists(mp3_path):
                 logger.error(f"目标文件不存在: {mp3_path}")
                 return
-                
-            audio = MP3(mp3_path, ID3=ID3)
-            
-            # 创建或更新标签
-            if audio.tags is None:
-                audio.add_tags()
-                
-            tags = audio.tags
-            
-            # 基础元数据
-            if metadata:
-                if title := metadata.get('title'):
-                    tags.add(TIT2(encoding=3, text=title))
-                if artist := metadata.get('artist'):
-                    tags.add(TPE1(encoding=3, text=artist))
-                if album := metadata.get('album'):
-                    tags.add(TALB(encoding=3, text=album))
-                if date := metadata.get('date'):
-                    tags.add(TDRC(encoding=3, text=date))
-                
-            # 添加封面
-            if cover_path and os.path.exists(cover_path):
-                mime_type = 'image/jpeg' if cover_path.lower().endswith(('.jpg', '.jpeg')) else 'image/png'
-                
-                try:
-                    with open(cover_path, 'rb') as f:
-                        cover_data = f.read()
-                        tags.add(
-                            APIC(
-                                encoding=3,
-                                mime=mime_type,
-                                type=3,
-                                desc='Cover',
-                                data=cover_data
-                            )
-                        )
-                    logger.info(f"成功添加封面: {os.path.basename(cover_path)}")
-                except Exception as e:
-                    logger.error(f"添加封面失败: {str(e)}")
-                
-            # 保存更改
-            audio.save(v2_version=3)
+
+            cover_data = self._read_cover(cover_path)
+            mime_type = 'image/jpeg'
+            if cover_path and not cover_path.lower().endswith(('.jpg', '.jpeg')):
+                mime_type = 'image/png'
+            write_tags(mp3_path, metadata, cover_data, mime_type)
+            if cover_data:
+                logger.info(f"成功添加封面: {os.path.basename(cover_path)}")
             logger.info(f"元数据添加完成: {os.path.basename(mp3_path)}")
             
         except Exception as e:
@@ -155,14 +163,9 @@ class MediaProcessor:
                 return False
                 
             # 检查音频时长
-            audio = MP3(file_path)
-            return audio.info.length > 0
+            audio = mutagen.File(file_path)
+            return audio is not None and audio.info.length > 0
             
         except Exception as e:
             logger.error(f"音频验证失败: {str(e)}")
             return False
-            
-    def __del__(self):
-        """清理资源"""
-        if hasattr(self, '_executor'):
-            self._executor.shutdown(wait=False)
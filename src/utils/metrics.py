@@ -0,0 +1,183 @@
+import math
+import time
+import bisect
+import logging
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+from .tracing import Tracer
+
+logger = logging.getLogger('Metrics')
+
+# 耗时分布（秒）
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# 下载速度分布（字节/秒）：64 KiB/s 到 64 MiB/s
+THROUGHPUT_BUCKETS = tuple(64 * 1024 * 2 ** i for i in range(11))
+
+# 名称 -> (类型, 说明, 分桶)
+METRICS = {
+    'bilipala_stage_duration_seconds': ('histogram', '各处理阶段耗时', DURATION_BUCKETS),
+    'bilipala_job_wait_seconds': ('histogram', '下载任务排队等待时间', DURATION_BUCKETS),
+    'bilipala_download_throughput_bytes_per_second': ('histogram', '单个音频流的下载速度', THROUGHPUT_BUCKETS),
+    'bilipala_downloaded_bytes_total': ('counter', '已下载的音频字节数', None),
+    'bilipala_parts_total': ('counter', '处理完成的分 P 数（按结果）', None),
+    'bilipala_tasks_submitted_total': ('counter', '提交的下载任务数', None),
+    'bilipala_retries_total': ('counter', '重试次数（分 P、分段、HTTP）', None),
+    'bilipala_http_responses_total': ('counter', '发往 B 站的 HTTP 请求（按主机和状态码）', None),
+    'bilipala_queue_depth': ('gauge', '各队列中等待的任务数', None),
+    'bilipala_active_workers': ('gauge', '正在工作的线程数', None),
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class MetricsRegistry:
+    """进程内的运行指标，按 Prometheus 文本格式输出
+
+    计数器和直方图由各模块在处理过程中记录；队列长度等瞬时值由收集函数在输出时读取。
+    """
+
+    def __init__(self):
+        self._definitions = dict(METRICS)
+        self._values = {}  # 名称 -> {标签: 值}，直方图的值为 [各桶计数, 总和, 次数]
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def define(self, name: str, kind: str, help_text: str, buckets: Optional[Tuple[float, ...]] = None):
+        with self._lock:
+            self._definitions[name] = (kind, help_text, buckets)
+
+    def _series(self, name: str, kind: str) -> Dict[LabelKey, Any]:
+        definition = self._definitions.get(name)
+        if definition is None or definition[0] != kind:
+            raise KeyError(f"未定义的{kind}指标：{name}")
+        return self._values.setdefault(name, {})
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """计数器或仪表增加 value"""
+        with self._lock:
+            definition = self._definitions.get(name)
+            series = self._series(name, 'gauge' if definition and definition[0] == 'gauge' else 'counter')
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        """设置仪表的当前值"""
+        with self._lock:
+            self._series(name, 'gauge')[_label_key(labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        """向直方图记录一次观测值"""
+        with self._lock:
+            series = self._series(name, 'histogram')
+            buckets = self._definitions[name][2]
+            key = _label_key(labels)
+            data = series.get(key)
+            if data is None:
+                data = series[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            data[0][bisect.bisect_left(buckets, value)] += 1
+            data[1] += value
+            data[2] += 1
+
+    @contextmanager
+    def timer(self, name: str = 'bilipala_stage_duration_seconds', **labels):
+        """记录代码块的耗时（出错时同样记录）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @contextmanager
+    def stage(self, stage: str, **details):
+        """记录一个处理阶段的耗时；在任务追踪中时同时记入时间线（details 只写入追踪）"""
+        with Tracer.span(stage, **details), self.timer('bilipala_stage_duration_seconds', stage=stage):
+            yield
+
+    def add_collector(self, collector: Callable[['MetricsRegistry'], None]):
+        """注册输出前调用的收集函数；绑定方法以弱引用保存，对象销毁后自动移除"""
+        ref = weakref.WeakMethod(collector) if hasattr(collector, '__self__') else (lambda: collector)
+        with self._lock:
+            self._collectors.append(ref)
+
+    def _collect(self):
+        with self._lock:
+            refs = list(self._collectors)
+        dead = []
+        for ref in refs:
+            collector = ref()
+            if collector is None:
+                dead.append(ref)
+                continue
+            try:
+                collector(self)
+            except Exception as e:
+                logger.warning(f"收集指标失败：{str(e)}")
+        if dead:
+            with self._lock:
+                self._collectors = [ref for ref in self._collectors if all(ref is not d for d in dead)]
+
+    def value(self, name: str, **labels) -> Any:
+        """读取一个指标的值（直方图返回 (次数, 总和)）"""
+        with self._lock:
+            data = self._values.get(name, {}).get(_label_key(labels))
+            if data is None:
+                return 0
+            if self._definitions[name][0] == 'histogram':
+                return data[2], data[1]
+            return data
+
+    def render(self) -> str:
+        """Prometheus 文本格式"""
+        self._collect()
+        lines: List[str] = []
+        with self._lock:
+            for name in sorted(self._definitions):
+                kind, help_text, buckets = self._definitions[name]
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for key, data in sorted(self._values.get(name, {}).items()):
+                    if kind != 'histogram':
+                        lines.append(f'{name}{_format_labels(key)} {_format_value(data)}')
+                        continue
+                    counts, total, count = data
+                    cumulative = 0
+                    for bound, bucket_count in zip(list(buckets) + [math.inf], counts):
+                        cumulative += bucket_count
+                        lines.append(f'{name}_bucket{_format_labels(key, ("le", _format_value(bound)))} {cumulative}')
+                    lines.append(f'{name}_sum{_format_labels(key)} {_format_value(total)}')
+                    lines.append(f'{name}_count{_format_labels(key)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+_shared_registry = None
+_shared_registry_lock = threading.Lock()
+
+
+def get_metrics() -> MetricsRegistry:
+    """获取进程内共享的指标"""
+    global _shared_registry
+    with _shared_registry_lock:
+        if _shared_registry is None:
+            _shared_registry = MetricsRegistry()
+        return _shared_registry
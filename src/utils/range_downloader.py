@@ -0,0 +1,205 @@
+import os
+import re
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from typing import Dict, Any, Optional, Callable, List
+
+import requests
+
+from .http_client import HttpClient
+from .metrics import get_metrics
+
+logger = logging.getLogger('RangeDownloader')
+
+
+class RangeDownloader:
+    """分段多连接下载器
+
+    B 站 CDN 对单个连接限速，大文件按 Range 拆成多个分段，由多个连接并行写入预分配的
+    .part 文件。分段大小自适应：初始按连接数切分，某个连接空闲时把剩余最多的分段对半拆分，
+    快的连接自然承担更多数据。各分段的进度通过 on_state 回调保存，中断后可以续传：
+    保存的是已刷入磁盘的位置（saved），写入缓冲区但尚未落盘的数据不会被当作已下载。
+    """
+
+    def __init__(self, http: HttpClient, connections: Optional[int] = None, min_segment: Optional[int] = None,
+                 chunk_size: int = 256 * 1024, max_retries: Optional[int] = None, sync_interval: float = 1.0):
+        self.http = http
+        self.sync_interval = sync_interval  # 刷盘并更新可续传位置的间隔（秒）
+        self.connections = connections or int(os.getenv('RANGE_CONNECTIONS', '4'))
+        # 分段不小于一个读取块，拆分时留出一个块的余量，保证正在写入的块不会越过新的分段边界
+        self.chunk_size = chunk_size
+        self.min_segment = max(min_segment or int(os.getenv('RANGE_MIN_SEGMENT', str(1024 * 1024))), chunk_size)
+        self.max_retries = max_retries if max_retries is not None else http.max_retries
+
+    def _headers(self, headers: Optional[Dict[str, str]], start: int, end: int) -> Dict[str, str]:
+        # 分段内容必须是原始字节，不能使用压缩传输
+        return {**(headers or {}), 'Range': f'bytes={start}-{end - 1}', 'Accept-Encoding': 'identity'}
+
+    def probe(self, url: str, headers: Optional[Dict[str, str]] = None) -> Optional[int]:
+        """返回文件大小；服务器不支持 Range 时返回 None"""
+        try:
+            response = self.http.get(url, headers=self._headers(headers, 0, 1), stream=True)
+        except requests.RequestException as e:
+            logger.warning(f"探测文件大小失败：{str(e)}")
+            return None
+        try:
+            match = re.match(r'bytes 0-0/(\d+)', response.headers.get('Content-Range', ''))
+            if response.status_code != 206 or not match:
+                return None
+            return int(match.group(1))
+        finally:
+            response.close()
+
+    def _initial_segments(self, size: int) -> List[Dict[str, int]]:
+        """按连接数切分，每个连接约 4 个分段，便于负载均衡"""
+        segment_size = max(self.min_segment, -(-size // (self.connections * 4)))
+        return [{'start': start, 'end': min(start + segment_size, size), 'pos': start, 'saved': start}
+                for start in range(0, size, segment_size)]
+
+    def _next_segment(self, segments: List[Dict[str, Any]], lock: threading.Lock) -> Optional[Dict[str, Any]]:
+        """取下一个未开始的分段；没有时拆分剩余最多的分段"""
+        with lock:
+            for segment in segments:
+                if not segment.get('active') and segment['pos'] < segment['end']:
+                    segment['active'] = True
+                    return segment
+
+            busiest = max((s for s in segments if s.get('active')), key=lambda s: s['end'] - s['pos'], default=None)
+            if busiest is None:
+                return None
+            remaining = busiest['end'] - busiest['pos']
+            if remaining < 2 * self.min_segment:
+                return None
+            middle = busiest['pos'] + max(remaining // 2, self.chunk_size)
+            segment = {'start': middle, 'end': busiest['end'], 'pos': middle, 'saved': middle, 'active': True}
+            busiest['end'] = middle
+            segments.append(segment)
+            return segment
+
+    @staticmethod
+    def _sync(f, segment: Dict[str, Any], lock: threading.Lock):
+        """把已写入的数据刷入磁盘，之后才把当前位置作为可续传的位置"""
+        f.flush()
+        os.fsync(f.fileno())
+        with lock:
+            segment['saved'] = segment['pos']
+
+    def _fetch(self, url: str, part_path: str, headers: Optional[Dict[str, str]], segment: Dict[str, Any],
+               lock: threading.Lock, counter: Dict[str, int], abort: threading.Event):
+        """下载一个分段，连接中断时从已写入的位置重试"""
+        attempts = 0
+        try:
+            while not abort.is_set():
+                with lock:
+                    start, end = segment['pos'], segment['end']
+                if start >= end:
+                    return
+                try:
+                    response = self.http.get(url, headers=self._headers(headers, start, end), stream=True)
+                    try:
+                        if response.status_code != 206:
+                            raise IOError(f"分段请求失败：HTTP {response.status_code}")
+                        with open(part_path, 'r+b') as f:
+                            f.seek(start)
+                            synced_at = time.monotonic()
+                            try:
+                                for chunk in response.iter_content(self.chunk_size):
+                                    if abort.is_set():
+                                        return
+                                    with lock:
+                                        # 分段可能已被拆分，只写入仍属于本分段的部分
+                                        allowed = min(len(chunk), segment['end'] - segment['pos'])
+                                    if allowed <= 0:
+                                        break
+                                    f.write(chunk[:allowed] if allowed < len(chunk) else chunk)
+                                    with lock:
+                                        segment['pos'] += allowed
+                                        counter['downloaded'] += allowed
+                                    if time.monotonic() - synced_at >= self.sync_interval:
+                                        self._sync(f, segment, lock)
+                                        synced_at = time.monotonic()
+                            finally:
+                                self._sync(f, segment, lock)
+                    finally:
+                        response.close()
+                    with lock:
+                        if segment['pos'] >= segment['end']:
+                            return
+                    raise IOError("连接提前关闭")
+                except (requests.RequestException, IOError) as e:
+                    attempts += 1
+                    if attempts > self.max_retries:
+                        raise
+                    logger.warning(f"分段 {segment['pos']}-{segment['end']} 下载中断，第 {attempts} 次重试：{str(e)}")
+                    get_metrics().inc('bilipala_retries_total', kind='range_segment')
+                    abort.wait(min(2 ** attempts, 30) * 0.5)
+        finally:
+            with lock:
+                segment['active'] = False
+
+    @staticmethod
+    def _snapshot(size: int, segments: List[Dict[str, Any]], lock: threading.Lock) -> Dict[str, Any]:
+        """可持久化的续传状态"""
+        with lock:
+            return {'size': size, 'segments': [[s['start'], s['end'], s['saved']] for s in segments]}
+
+    def download(self, url: str, path: str, headers: Optional[Dict[str, str]] = None, size: Optional[int] = None,
+                 state: Optional[Dict[str, Any]] = None,
+                 on_state: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 progress: Optional[Callable[[int, int], None]] = None,
+                 state_interval: float = 1.0) -> str:
+        """分段下载到 path，返回 path
+
+        state 为上次保存的续传状态（大小一致且 .part 文件存在时生效）；
+        on_state 和 progress 在调用线程中定期回调。
+        """
+        size = size or self.probe(url, headers)
+        if not size:
+            raise IOError("服务器不支持 Range 请求")
+
+        part_path = f"{path}.part"
+        if state and state.get('size') == size and os.path.exists(part_path) and os.path.getsize(part_path) == size:
+            segments = [{'start': start, 'end': end, 'pos': pos, 'saved': pos} for start, end, pos in state['segments']]
+            logger.info(f"续传分段下载：{os.path.basename(path)}")
+        else:
+            segments = self._initial_segments(size)
+            # 预分配文件，各连接直接写入自己的位置
+            with open(part_path, 'wb') as f:
+                f.truncate(size)
+
+        lock = threading.Lock()
+        abort = threading.Event()
+        counter = {'downloaded': sum(s['pos'] - s['start'] for s in segments)}
+
+        def worker():
+            while not abort.is_set():
+                segment = self._next_segment(segments, lock)
+                if segment is None:
+                    return
+                self._fetch(url, part_path, headers, segment, lock, counter, abort)
+
+        executor = ThreadPoolExecutor(max_workers=self.connections, thread_name_prefix='range')
+        futures = [executor.submit(worker) for _ in range(self.connections)]
+        try:
+            while True:
+                done, pending = wait(futures, timeout=state_interval, return_when=FIRST_EXCEPTION)
+                if on_state:
+                    on_state(self._snapshot(size, segments, lock))
+                if progress:
+                    progress(counter['downloaded'], size)
+                for future in done:
+                    if error := future.exception():
+                        raise error
+                if not pending:
+                    break
+        finally:
+            abort.set()
+            executor.shutdown(wait=True)
+
+        if any(s['pos'] < s['end'] for s in segments):
+            raise IOError("分段下载未完成")
+        os.replace(part_path, path)
+        logger.info(f"分段下载完成：{os.path.basename(path)}（{len(segments)} 个分段）")
+        return path
@@ -0,0 +1,180 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Optional, Dict, Callable
+
+import mutagen
+from mutagen.mp3 import MP3
+from mutagen.mp4 import MP4, MP4Cover
+from mutagen.id3 import ID3, TIT2, TPE1, TALB, TDRC, APIC
+
+from .metrics import get_metrics, MetricsRegistry
+from .tracing import get_tracer
+
+logger = logging.getLogger('TagWorker')
+
+# 使用 MP4 元数据（iTunes 风格标签）的容器
+MP4_EXTENSIONS = ('.m4a', '.m4b', '.mp4')
+
+
+def write_tags(audio_path: str, metadata: Optional[Dict] = None, cover_data: Optional[bytes] = None,
+               cover_mime: str = 'image/jpeg'):
+    """写入元数据和封面，按文件扩展名选择 ID3、MP4 或通用标签"""
+    if not os.path.exists(audio_path):
+        raise FileNotFoundError(f"目标文件不存在: {audio_path}")
+
+    ext = os.path.splitext(audio_path)[1].lower()
+    if ext in MP4_EXTENSIONS:
+        _write_mp4_tags(audio_path, metadata, cover_data, cover_mime)
+    elif ext == '.mp3':
+        _write_id3_tags(audio_path, metadata, cover_data, cover_mime)
+    else:
+        _write_generic_tags(audio_path, metadata)
+    logger.info(f"标签写入完成: {os.path.basename(audio_path)}")
+
+
+def _write_id3_tags(audio_path: str, metadata: Optional[Dict], cover_data: Optional[bytes], cover_mime: str):
+    """写入 ID3 元数据和封面"""
+    audio = MP3(audio_path, ID3=ID3)
+
+    # 如果没有 ID3 标签，创建一个
+    if audio.tags is None:
+        audio.add_tags()
+    tags = audio.tags
+
+    # 基础元数据
+    if metadata:
+        if title := metadata.get('title'):
+            tags.add(TIT2(encoding=3, text=title))
+        if artist := metadata.get('artist'):
+            tags.add(TPE1(encoding=3, text=artist))
+        if album := metadata.get('album'):
+            tags.add(TALB(encoding=3, text=album))
+        if date := metadata.get('date'):
+            tags.add(TDRC(encoding=3, text=date))
+
+    # 添加封面
+    if cover_data:
+        tags.add(APIC(encoding=3, mime=cover_mime, type=3, desc='Cover', data=cover_data))
+
+    # 保存更改
+    audio.save(v2_version=3)
+
+
+def _write_mp4_tags(audio_path: str, metadata: Optional[Dict], cover_data: Optional[bytes], cover_mime: str):
+    """写入 MP4 元数据和封面（m4a/m4b）"""
+    audio = MP4(audio_path)
+    if audio.tags is None:
+        audio.add_tags()
+    tags = audio.tags
+
+    if metadata:
+        for key, atom in (('title', '\xa9nam'), ('artist', '\xa9ART'), ('album', '\xa9alb'), ('date', '\xa9day')):
+            if value := metadata.get(key):
+                tags[atom] = [value]
+
+    if cover_data:
+        image_format = MP4Cover.FORMAT_PNG if cover_mime == 'image/png' else MP4Cover.FORMAT_JPEG
+        tags['covr'] = [MP4Cover(cover_data, imageformat=image_format)]
+
+    audio.save()
+
+
+def _write_generic_tags(audio_path: str, metadata: Optional[Dict]):
+    """其他容器（如保留原始格式时的 webm/opus）只写入文字元数据"""
+    audio = mutagen.File(audio_path, easy=True)
+    if audio is None:
+        raise ValueError(f"不支持写入标签的音频格式: {os.path.basename(audio_path)}")
+    if audio.tags is None:
+        audio.add_tags()
+    for key in ('title', 'artist', 'album', 'date'):
+        if metadata and (value := metadata.get(key)):
+            audio[key] = value
+    audio.save()
+
+
+class TagWorkerPool:
+    """标签写入线程池
+
+    任务放入有界队列，队列满时提交方阻塞（背压），由固定数量的后台线程依次写入标签，
+    这样每个文件下载完成后即可写入封面，与后续分 P 的下载并行进行。
+    """
+
+    def __init__(self, workers: Optional[int] = None, max_pending: Optional[int] = None):
+        self.workers = workers or int(os.getenv('TAG_WORKERS', '2'))
+        self._queue = queue.Queue(maxsize=max_pending or int(os.getenv('TAG_QUEUE_SIZE', '32')))
+        self._busy = 0
+        self._busy_lock = threading.Lock()
+        self._threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'tag-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        get_metrics().add_collector(self._collect_metrics)
+        logger.info(f"标签写入线程池启动：{self.workers} 个线程")
+
+    def submit(self, audio_path: str, metadata: Optional[Dict] = None, cover_data: Optional[bytes] = None,
+               callback: Optional[Callable[[Future], None]] = None) -> Future:
+        """提交标签写入任务，队列已满时阻塞等待"""
+        future = Future()
+        if callback:
+            future.add_done_callback(callback)
+        self._queue.put((future, audio_path, metadata, cover_data, get_tracer().current(), time.monotonic()))
+        return future
+
+    def pending(self) -> int:
+        """等待写入的任务数"""
+        return self._queue.qsize()
+
+    def _collect_metrics(self, metrics: MetricsRegistry):
+        metrics.set('bilipala_queue_depth', self.pending(), queue='tag')
+        with self._busy_lock:
+            metrics.set('bilipala_active_workers', self._busy, pool='tag')
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                break
+            future, audio_path, metadata, cover_data, trace, queued_at = job
+            with self._busy_lock:
+                self._busy += 1
+            try:
+                if future.set_running_or_notify_cancel():
+                    # 继续记录提交方任务的追踪
+                    with get_tracer().bind(trace):
+                        get_tracer().record('tag_queue_wait', queued_at)
+                        with get_metrics().stage('tag', file=os.path.basename(audio_path)):
+                            write_tags(audio_path, metadata, cover_data)
+                    future.set_result(audio_path)
+            except Exception as e:
+                logger.error(f"标签写入失败：{os.path.basename(audio_path)} - {str(e)}")
+                future.set_exception(e)
+            finally:
+                with self._busy_lock:
+                    self._busy -= 1
+                self._queue.task_done()
+
+    def shutdown(self):
+        """处理完已提交的任务后停止工作线程"""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+def get_tag_pool() -> TagWorkerPool:
+    """获取进程内共享的标签写入线程池"""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = TagWorkerPool()
+        return _shared_pool
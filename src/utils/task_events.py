@@ -0,0 +1,82 @@
+import os
+import time
+import logging
+import threading
+from typing import Dict, Any, Optional, Iterable
+
+logger = logging.getLogger('TaskEvents')
+
+
+class TaskEventStream:
+    """单个订阅者的任务进度流
+
+    同一任务在两次推送之间的多次更新会合并为一个增量，推送间隔不小于 min_interval。
+    """
+
+    def __init__(self, task_ids: Optional[Iterable[str]] = None, min_interval: Optional[float] = None):
+        self.task_ids = set(task_ids) if task_ids else None
+        self.min_interval = min_interval if min_interval is not None else float(os.getenv('PROGRESS_EMIT_INTERVAL', '0.5'))
+        self._pending = {}  # 任务ID -> 合并后的增量
+        self._condition = threading.Condition()
+        self._last_emit = 0.0
+        self.closed = False
+
+    def publish(self, task_id: str, delta: Dict[str, Any]):
+        """合并一次任务更新"""
+        if self.task_ids is not None and task_id not in self.task_ids:
+            return
+        with self._condition:
+            self._pending.setdefault(task_id, {}).update(delta)
+            self._condition.notify()
+
+    def next_batch(self, timeout: float = 15) -> Dict[str, Dict[str, Any]]:
+        """等待下一批增量，超时返回空字典（用于发送心跳）"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while not self._pending and not self.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return {}
+                self._condition.wait(remaining)
+
+            # 距离上次推送不足最小间隔时，继续合并后续更新
+            wait = self._last_emit + self.min_interval - time.monotonic()
+            if wait > 0 and not self.closed:
+                self._condition.wait_for(lambda: self.closed, wait)
+
+            batch, self._pending = self._pending, {}
+            self._last_emit = time.monotonic()
+            return batch
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+
+class TaskEventHub:
+    """任务进度的发布订阅中心"""
+
+    def __init__(self):
+        self._streams = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, task_ids: Optional[Iterable[str]] = None) -> TaskEventStream:
+        stream = TaskEventStream(task_ids)
+        with self._lock:
+            self._streams.add(stream)
+        logger.info(f"新增进度订阅，当前 {len(self._streams)} 个")
+        return stream
+
+    def unsubscribe(self, stream: TaskEventStream):
+        stream.close()
+        with self._lock:
+            self._streams.discard(stream)
+
+    def publish(self, task_id: str, delta: Dict[str, Any]):
+        if not delta:
+            return
+        with self._lock:
+            streams = list(self._streams)
+        for stream in streams:
+            stream.publish(task_id, delta)
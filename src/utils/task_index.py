@@ -0,0 +1,123 @@
+import json
+import heapq
+import base64
+import bisect
+import threading
+from itertools import islice
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+Key = Tuple[str, str]
+
+
+class TaskIndex:
+    """任务摘要的有序索引
+
+    按创建时间维护一个有序列表，按状态各维护一个有序列表。最新任务直接取列表末尾；
+    分页用 (创建时间, 任务ID) 作为游标二分定位，多个状态的列表归并后取一页。
+    """
+
+    def __init__(self, summaries: Iterable[Dict[str, Any]] = ()):
+        self._tasks = {}  # 任务ID -> 摘要
+        self._order = []  # [(创建时间, 任务ID)]，从旧到新
+        self._by_status = {}  # 状态 -> [(创建时间, 任务ID)]
+        self._lock = threading.RLock()
+        for summary in sorted(summaries, key=self._key):
+            self._insert(dict(summary))
+
+    @staticmethod
+    def _key(summary: Dict[str, Any]) -> Key:
+        return summary.get('created_at') or '', summary['task_id']
+
+    @staticmethod
+    def encode_cursor(key: Key) -> str:
+        return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Key:
+        """解析游标，格式错误时抛出 ValueError"""
+        try:
+            created_at, task_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return str(created_at), str(task_id)
+        except Exception:
+            raise ValueError(f"无效的游标：{cursor}")
+
+    def _insert(self, summary: Dict[str, Any]):
+        key = self._key(summary)
+        self._tasks[summary['task_id']] = summary
+        # 新任务的创建时间最大，insort 落在末尾
+        bisect.insort(self._order, key)
+        bisect.insort(self._by_status.setdefault(summary.get('status'), []), key)
+
+    def _delete(self, summary: Dict[str, Any]):
+        key = self._key(summary)
+        del self._tasks[summary['task_id']]
+        for keys in (self._order, self._by_status.get(summary.get('status'), [])):
+            i = bisect.bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                del keys[i]
+        if not self._by_status.get(summary.get('status'), True):
+            del self._by_status[summary.get('status')]
+
+    def update(self, summary: Dict[str, Any]):
+        """添加或更新任务摘要"""
+        summary = dict(summary)
+        with self._lock:
+            old = self._tasks.get(summary['task_id'])
+            if old is not None and self._key(old) == self._key(summary) and old.get('status') == summary.get('status'):
+                self._tasks[summary['task_id']] = summary
+                return
+            if old is not None:
+                self._delete(old)
+            self._insert(summary)
+
+    def remove(self, task_id: str):
+        with self._lock:
+            if summary := self._tasks.get(task_id):
+                self._delete(summary)
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            summary = self._tasks.get(task_id)
+            return dict(summary) if summary else None
+
+    def latest(self) -> Optional[Dict[str, Any]]:
+        """最新创建的任务"""
+        with self._lock:
+            return dict(self._tasks[self._order[-1][1]]) if self._order else None
+
+    def counts(self) -> Dict[str, int]:
+        """各状态的任务数"""
+        with self._lock:
+            return {status: len(keys) for status, keys in self._by_status.items()}
+
+    def count(self, statuses: Optional[Iterable[str]] = None) -> int:
+        with self._lock:
+            if statuses is None:
+                return len(self._order)
+            return sum(len(self._by_status.get(status, [])) for status in set(statuses))
+
+    def page(self, statuses: Optional[Iterable[str]] = None, cursor: Optional[str] = None,
+             limit: int = 50) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """从新到旧取一页任务摘要，返回 (摘要列表, 下一页游标)"""
+        bound = self.decode_cursor(cursor) if cursor else None
+        with self._lock:
+            if statuses is None:
+                lists = [self._order]
+            else:
+                lists = [self._by_status.get(status, []) for status in set(statuses)]
+            iterators = []
+            for keys in lists:
+                end = bisect.bisect_left(keys, bound) if bound else len(keys)
+                iterators.append(map(keys.__getitem__, range(end - 1, -1, -1)))
+            found = list(islice(heapq.merge(*iterators, reverse=True), limit + 1))
+            summaries = [dict(self._tasks[task_id]) for _, task_id in found[:limit]]
+        next_cursor = self.encode_cursor(found[limit - 1]) if len(found) > limit else None
+        return summaries, next_cursor
+
+    def __contains__(self, task_id: str) -> bool:
+        with self._lock:
+            return task_id in self._tasks
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._tasks)
@@ -2,51 +2,101 @@ import os
 import json
 import time
 import logging
+import threading
 from datetime import datetime
 import hashlib
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from .downloader import BiliDownloader
 from .title_filter import TitleFilter
+from .task_events import TaskEventHub, TaskEventStream
+from .task_store import TaskStore, FLUSH_STATUSES
+from .task_index import TaskIndex
+from .database import Database, get_database
+from .job_queue import JobQueue
+from .metrics import get_metrics, MetricsRegistry
+from .tracing import get_tracer
 import yt_dlp
 
 logger = logging.getLogger('TaskManager')
 
+# 任务级状态；下载事件的其他状态（progress/success/skip/error）记录在 part_status 中
+TASK_STATUSES = ('pending', 'queued', 'running', 'completed', 'failed')
+# 已结束的任务不再变化，不保留在内存中，需要时从数据库读取
+FINISHED_STATUSES = ('completed', 'failed')
+
 class TaskManager:
-    def __init__(self):
+    def __init__(self, db: Optional[Database] = None):
         self.tasks_dir = "download_tasks"
-        os.makedirs(self.tasks_dir, exist_ok=True)
-        self.active_tasks = {}
-        self._load_tasks()
+        self.active_tasks = {}  # 未结束任务的内容（本次运行创建或按需读取）
+        self._index = None  # 任务摘要的有序索引，首次列出任务时从数据库读取
+        self._index_lock = threading.RLock()
+        self.db = db or get_database()
+        # 一次性导入旧版的任务 JSON 文件（含 active_tasks.json）
+        self.db.migrate_tasks_dir(self.tasks_dir)
+        self.store = TaskStore(self.db)  # 合并写入任务
+        self.events = TaskEventHub()  # 推送任务进度增量
         logger.info("任务管理器初始化完成")
-        self.downloader = BiliDownloader()
+        self.downloader = BiliDownloader(db=self.db)
         self.title_filter = TitleFilter()
-        self.tasks_file = "download_tasks/active_tasks.json"
-        self.load_tasks()
+        self._abandon_queued_tasks()
+        # 全局任务队列：固定数量的工作线程执行下载，排队位置变化时推送给前端
+        self._queue_lock = threading.Lock()
+        self.jobs = JobQueue(on_change=self._update_queue_positions)
+        self._enqueued_at = {}  # 任务ID -> 入队时间，用于统计排队等待时间
+        self.metrics = get_metrics()
+        self.metrics.add_collector(self._collect_metrics)
+        self.tracer = get_tracer()  # 按任务记录各阶段的时间线（TRACE_TASKS=0 时关闭）
         
-    def _load_tasks(self):
-        """加载已有任务"""
-        try:
-            for filename in os.listdir(self.tasks_dir):
-                if filename.endswith('.json'):
-                    task_id = filename[:-5]  # 移除 .json 后缀
-                    task_file = os.path.join(self.tasks_dir, filename)
-                    with open(task_file, 'r', encoding='utf-8') as f:
-                        task_data = json.load(f)
-                        self.active_tasks[task_id] = task_data
-            logger.info(f"加载了 {len(self.active_tasks)} 个任务")
-        except Exception as e:
-            logger.error(f"加载任务失败：{str(e)}")
+    def _task_index(self) -> TaskIndex:
+        """任务摘要（ID、状态、创建时间、标题），只读取一次"""
+        with self._index_lock:
+            if self._index is None:
+                try:
+                    summaries = self.store.load_index()
+                except Exception as e:
+                    logger.error(f"加载任务索引失败：{str(e)}")
+                    summaries = {}
+                # 合并尚未写入数据库的任务
+                for task in list(self.active_tasks.values()):
+                    summaries[task['task_id']] = self._summary(task)
+                index = TaskIndex(summaries.values())
+                self._index = index
+                logger.info(f"加载了 {len(index)} 个任务摘要")
+            return self._index
+
+    @staticmethod
+    def _summary(task: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: task.get(key) for key in ('task_id', 'status', 'created_at', 'title')}
+
+    def _index_task(self, task: Dict[str, Any]):
+        """同步任务摘要（索引尚未加载时由数据库提供）"""
+        with self._index_lock:
+            if self._index is not None:
+                self._index.update(self._summary(task))
+
+    def _remove_task(self, task_id: str):
+        self.store.delete(task_id)
+        self.active_tasks.pop(task_id, None)
+        self.tracer.discard(task_id)
+        with self._index_lock:
+            if self._index is not None:
+                self._index.remove(task_id)
     
-    def _save_task(self, task_id: str):
-        """保存任务到文件"""
+    def _save_task(self, task_id: str, task: Dict[str, Any], immediate: bool = False):
+        """保存任务（进度更新按间隔合并写入，状态变化时立即写入）
+
+        已结束的任务立即写入并移出 active_tasks，之后按需从数据库读取。
+        """
+        finished = task.get('status') in FINISHED_STATUSES
         try:
-            task_file = os.path.join(self.tasks_dir, f"{task_id}.json")
-            with open(task_file, 'w', encoding='utf-8') as f:
-                json.dump(self.active_tasks[task_id], f, ensure_ascii=False, indent=2)
+            self.store.save(task_id, task, immediate or finished)
         except Exception as e:
             logger.error(f"保存任务失败：{str(e)}")
+        if finished:
+            self.active_tasks.pop(task_id, None)
     
-    def create_task(self, bvid: str = None, series_id: str = None, output_dir: str = '', rename: bool = False, is_series: bool = False) -> str:
+    def create_task(self, bvid: str = None, series_id: str = None, output_dir: str = '', rename: bool = False, is_series: bool = False,
+                    status: str = 'pending') -> str:
         """创建新任务"""
         try:
             # 生成任务ID
@@ -54,10 +104,11 @@ class TaskManager:
             
             # 创建任务数据
             task_data = {
+                'task_id': task_id,
                 'created_at': datetime.now().isoformat(),
                 'output_dir': output_dir,
                 'rename': rename,
-                'status': 'pending',
+                'status': status,
                 'progress': 0,
                 'error': None
             }
@@ -78,7 +129,9 @@ class TaskManager:
                 })
             
             self.active_tasks[task_id] = task_data
-            self._save_task(task_id)
+            self._index_task(task_data)
+            self._save_task(task_id, task_data, immediate=True)
+            self.events.publish(task_id, dict(task_data))
             
             logger.info(f"创建{'合集' if is_series else '视频'}任务：{task_id}")
             return task_id
@@ -90,15 +143,19 @@ class TaskManager:
     def update_task(self, task_id: str, progress_info: Dict[str, Any]):
         """更新任务状态"""
         try:
-            if task_id not in self.active_tasks:
+            task = self.get_task(task_id)
+            if task is None:
                 logger.warning(f"任务不存在：{task_id}")
                 return
             
-            task = self.active_tasks[task_id]
+            before = dict(task)
             
             # 更新任务状态
             if 'status' in progress_info:
-                task['status'] = progress_info['status']
+                if progress_info['status'] in TASK_STATUSES:
+                    task['status'] = progress_info['status']
+                else:
+                    task['part_status'] = progress_info['status']
             
             # 更新进度信息
             if task['is_series']:
@@ -115,11 +172,18 @@ class TaskManager:
                 # 单视频任务进度更新
                 if 'progress' in progress_info:
                     task['progress'] = progress_info['progress']
+                # 已完成（下载或跳过）的分 P 数，进度推送合并时也不会丢失
+                if progress_info.get('status') in ('success', 'skip'):
+                    task['parts_done'] = task.get('parts_done', 0) + 1
             
             # 更新标题
             if 'title' in progress_info:
                 task['title'] = progress_info['title']
             
+            # 更新排队位置
+            if 'queue_position' in progress_info:
+                task['queue_position'] = progress_info['queue_position']
+            
             # 更新错误信息
             if 'error' in progress_info:
                 task['error'] = progress_info['error']
@@ -128,51 +192,173 @@ class TaskManager:
             if progress_info.get('status') in ['completed', 'failed']:
                 task['completed_at'] = datetime.now().isoformat()
             
-            self._save_task(task_id)
+            status = task.get('status')
+            if status != before.get('status') or task.get('title') != before.get('title'):
+                self._index_task(task)
+            self._save_task(task_id, task, immediate=status != before.get('status') and status in FLUSH_STATUSES)
+            
+            # 只推送发生变化的字段
+            self.events.publish(task_id, {k: v for k, v in task.items() if before.get(k) != v})
             
         except Exception as e:
             logger.error(f"更新任务状态失败：{str(e)}")
     
+    def submit_download(self, bvid: str, output_dir: str, rename: bool = False,
+                        priority: int = 0, client: str = '') -> str:
+        """创建视频下载任务并加入队列，立即返回任务ID；队列已满时抛出 JobQueueFull"""
+        task_id = self.create_task(bvid=bvid, output_dir=output_dir, rename=rename, status='queued')
+        self._enqueue(task_id, lambda: self._run_download(task_id), priority, client)
+        return task_id
+
+    def submit_series(self, url: str, series_id: str, output_dir: str, rename: bool = False,
+                      priority: int = 0, client: str = '') -> str:
+        """创建合集下载任务并加入队列，立即返回任务ID；队列已满时抛出 JobQueueFull"""
+        task_id = self.create_task(series_id=series_id, output_dir=output_dir, rename=rename,
+                                   is_series=True, status='queued')
+        self._enqueue(task_id, lambda: self._run_series(task_id, url), priority, client)
+        return task_id
+
+    def _enqueue(self, task_id: str, fn, priority: int, client: str):
+        self._enqueued_at[task_id] = time.monotonic()
+        try:
+            self.jobs.submit(task_id, fn, priority=priority, client=client)
+        except Exception:
+            # 未能入队的任务不保留
+            self._enqueued_at.pop(task_id, None)
+            self._remove_task(task_id)
+            raise
+        task = self.get_task(task_id)
+        self.metrics.inc('bilipala_tasks_submitted_total', kind='series' if task and task.get('is_series') else 'video')
+        logger.info(f"任务已加入队列：{task_id}（优先级 {priority}，客户端 {client or '-'}）")
+
+    def _update_queue_positions(self):
+        """把排队位置写入仍在排队的任务"""
+        with self._queue_lock:
+            for task_id, position in self.jobs.positions().items():
+                task = self.get_task(task_id)
+                if task and task.get('status') == 'queued' and task.get('queue_position') != position:
+                    self.update_task(task_id, {'queue_position': position})
+
+    def _start_job(self, task_id: str):
+        """任务离开队列，开始执行"""
+        if (enqueued_at := self._enqueued_at.pop(task_id, None)) is not None:
+            self.metrics.observe('bilipala_job_wait_seconds', time.monotonic() - enqueued_at)
+            self.tracer.record('queue_wait', enqueued_at)
+        with self._queue_lock:
+            self.update_task(task_id, {'status': 'running', 'queue_position': None})
+
+    def _collect_metrics(self, metrics: MetricsRegistry):
+        metrics.set('bilipala_queue_depth', self.jobs.pending(), queue='jobs')
+        metrics.set('bilipala_active_workers', self.jobs.running(), pool='jobs')
+
+    def _run_download(self, task_id: str):
+        """队列中执行视频下载任务"""
+        task = self.get_task(task_id)
+        with self.tracer.task(task_id), self.tracer.span('job', cat='task', bvid=task['bvid']):
+            self._start_job(task_id)
+            try:
+                for progress in self.downloader.download(task['bvid'], task['output_dir'], task['rename']):
+                    self.update_task(task_id, progress)
+            except Exception as e:
+                logger.error(f"下载失败：{str(e)}")
+                self.update_task(task_id, {
+                    'status': 'failed',
+                    'error': str(e)
+                })
+
+    def _run_series(self, task_id: str, url: str):
+        """队列中执行合集下载任务"""
+        task = self.get_task(task_id)
+        with self.tracer.task(task_id), self.tracer.span('job', cat='task', series_id=task['series_id']):
+            self._start_job(task_id)
+            try:
+                for progress in self.downloader.download_series(url, task['output_dir'], task['rename']):
+                    # 更新任务状态，添加合集相关信息
+                    progress.update({
+                        'series_id': task['series_id'],
+                        'is_series': True
+                    })
+                    self.update_task(task_id, progress)
+            except Exception as e:
+                logger.error(f"合集下载失败：{str(e)}")
+                self.update_task(task_id, {
+                    'status': 'failed',
+                    'error': str(e),
+                    'series_id': task['series_id'],
+                    'is_series': True
+                })
+
+    def _abandon_queued_tasks(self):
+        """上次运行时仍在排队的任务不会再执行，标记为失败"""
+        try:
+            queued = self.store.load_by_status('queued')
+        except Exception as e:
+            logger.error(f"加载排队任务失败：{str(e)}")
+            return
+        for task_id, task in queued.items():
+            task.setdefault('task_id', task_id)
+            task.update({
+                'status': 'failed',
+                'error': '服务重启，排队中的任务已取消',
+                'queue_position': None,
+                'completed_at': datetime.now().isoformat()
+            })
+            self._save_task(task_id, task, immediate=True)
+
     def get_task(self, task_id: str) -> Optional[Dict[str, Any]]:
-        """获取任务信息"""
-        return self.active_tasks.get(task_id)
+        """获取任务信息（未加载的任务从数据库读取）"""
+        if task := self.active_tasks.get(task_id):
+            return task
+        try:
+            task = self.store.load(task_id)
+        except Exception as e:
+            logger.error(f"加载任务失败：{str(e)}")
+            return None
+        if task is None:
+            return None
+        task.setdefault('task_id', task_id)
+        if task.get('status') in FINISHED_STATUSES:
+            return task
+        return self.active_tasks.setdefault(task_id, task)
     
-    def get_active_tasks(self) -> List[Dict[str, Any]]:
-        """获取所有活动任务"""
-        return list(self.active_tasks.values())
+    def get_task_trace(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """任务的时间线（Chrome trace 格式），未记录时返回 None"""
+        return self.tracer.export(task_id)
+
+    def subscribe(self, task_id: Optional[str] = None) -> TaskEventStream:
+        """订阅任务进度增量，task_id 为空时订阅所有任务"""
+        return self.events.subscribe([task_id] if task_id else None)
+
+    def unsubscribe(self, stream: TaskEventStream):
+        """取消订阅"""
+        self.events.unsubscribe(stream)
+    
+    def get_active_tasks(self, statuses: Optional[List[str]] = None, cursor: Optional[str] = None,
+                         limit: int = 50) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """从新到旧分页获取任务，返回 (任务列表, 下一页游标)；游标无效时抛出 ValueError"""
+        summaries, next_cursor = self._task_index().page(statuses, cursor, limit)
+        tasks = [task for summary in summaries if (task := self.get_task(summary['task_id']))]
+        return tasks, next_cursor
+
+    def count_tasks(self, statuses: Optional[List[str]] = None) -> int:
+        """任务数（可按状态筛选）"""
+        return self._task_index().count(statuses)
     
     def get_latest_task(self) -> Optional[Dict[str, Any]]:
         """获取最新任务"""
-        if not self.active_tasks:
-            return None
-        
-        # 按创建时间排序，返回最新的任务
-        sorted_tasks = sorted(
-            self.active_tasks.values(),
-            key=lambda x: x.get('created_at', ''),
-            reverse=True
-        )
-        return sorted_tasks[0] if sorted_tasks else None
+        latest = self._task_index().latest()
+        return self.get_task(latest['task_id']) if latest else None
     
     def cleanup_completed_tasks(self, max_age_hours: int = 24):
         """清理已完成的旧任务"""
         try:
-            now = datetime.now()
-            to_remove = []
-            
-            for task_id, task in self.active_tasks.items():
-                if task.get('status') in ['completed', 'failed']:
-                    completed_at = datetime.fromisoformat(task.get('completed_at', ''))
-                    age = (now - completed_at).total_seconds() / 3600
-                    
-                    if age > max_age_hours:
-                        to_remove.append(task_id)
+            # 在数据库中按完成时间筛选，不加载任务内容
+            self.store.flush()
+            cutoff = datetime.fromtimestamp(time.time() - max_age_hours * 3600).isoformat()
+            to_remove = self.db.find_finished_tasks(cutoff)
             
             for task_id in to_remove:
-                task_file = os.path.join(self.tasks_dir, f"{task_id}.json")
-                if os.path.exists(task_file):
-                    os.remove(task_file)
-                del self.active_tasks[task_id]
+                self._remove_task(task_id)
             
             if to_remove:
                 logger.info(f"清理了 {len(to_remove)} 个已完成的旧任务")
@@ -181,23 +367,21 @@ class TaskManager:
             logger.error(f"清理任务失败：{str(e)}")
 
     def load_tasks(self):
-        """加载保存的任务状态"""
+        """重新加载保存的任务状态（丢弃已加载的任务内容，按需重新读取）"""
         try:
-            if os.path.exists(self.tasks_file):
-                with open(self.tasks_file, 'r', encoding='utf-8') as f:
-                    saved_tasks = json.load(f)
-                    self.active_tasks = saved_tasks
-                logger.info(f"已加载 {len(self.active_tasks)} 个保存的任务")
+            self.store.flush()
         except Exception as e:
             logger.error(f"加载任务状态失败: {str(e)}")
+        with self._index_lock:
             self.active_tasks = {}
+            self._index = None
 
     def save_tasks(self):
         """保存当前任务状态"""
         try:
-            os.makedirs(os.path.dirname(self.tasks_file), exist_ok=True)
-            with open(self.tasks_file, 'w', encoding='utf-8') as f:
-                json.dump(self.active_tasks, f, ensure_ascii=False, indent=2)
+            for task_id, task in list(self.active_tasks.items()):
+                self.store.save(task_id, task)
+            self.store.flush()
             logger.info("任务状态已保存")
         except Exception as e:
             logger.error(f"保存任务状态失败: {str(e)}")
@@ -205,9 +389,9 @@ class TaskManager:
     def _download_task(self, task_id: str):
         """执行下载任务"""
         try:
-            task = self.active_tasks[task_id]
+            task = self.get_task(task_id)
             task['status'] = 'running'
-            self._save_task(task_id)
+            self._save_task(task_id, task, immediate=True)
 
             # 开始下载
             for progress in self.downloader.download(task['bvid'], task['output_dir'], task['rename']):
@@ -225,18 +409,18 @@ class TaskManager:
                         task['title'] = self.title_filter.filter_title(title)
                     
                     task['last_update'] = datetime.now().isoformat()
-                    self._save_task(task_id)
+                    self._save_task(task_id, task, immediate=task['status'] in ('completed', 'failed'))
 
             # 如果没有出错且没有被标记为完成，则标记为完成
             if task['status'] not in ['completed', 'failed']:
                 task['status'] = 'completed'
                 task['progress'] = 100
                 task['last_update'] = datetime.now().isoformat()
-                self._save_task(task_id)
+                self._save_task(task_id, task, immediate=True)
 
         except Exception as e:
             logger.error(f"下载任务执行失败: {str(e)}")
             task['status'] = 'failed'
             task['error'] = str(e)
             task['last_update'] = datetime.now().isoformat()
-            self._save_task(task_id) 
\ No newline at end of file
+            self._save_task(task_id, task, immediate=True)
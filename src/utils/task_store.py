@@ -0,0 +1,94 @@
+import os
+import atexit
+import logging
+import threading
+from typing import Dict, Any, Optional
+
+from .database import Database
+
+logger = logging.getLogger('TaskStore')
+
+# 进入这些状态时立即落盘，其余的进度更新按间隔合并写入
+FLUSH_STATUSES = ('pending', 'queued', 'running', 'completed', 'failed')
+
+
+class TaskStore:
+    """任务存储：任务状态保存在内存中，脏任务按间隔批量写入数据库
+
+    每次刷新在一个事务中写入所有脏任务；进程崩溃最多丢失一个刷新间隔内的进度。
+    刷新按顺序执行，较早取出的旧状态不会覆盖随后写入的新状态。
+    """
+
+    def __init__(self, db: Database, flush_interval: Optional[float] = None):
+        self.db = db
+        self.flush_interval = flush_interval if flush_interval is not None else float(os.getenv('TASK_FLUSH_INTERVAL', '2'))
+        self._dirty = {}  # 任务ID -> 待写入的任务数据
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # 从取出脏任务到写入数据库期间持有
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name='task-store-flusher', daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def load_all(self) -> Dict[str, Dict[str, Any]]:
+        """加载所有任务"""
+        return self.db.load_tasks()
+
+    def load(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """加载单个任务（优先返回尚未写入的数据）"""
+        with self._lock:
+            if task_id in self._dirty:
+                return self._dirty[task_id]
+        return self.db.load_task(task_id)
+
+    def load_index(self) -> Dict[str, Dict[str, Any]]:
+        """加载任务摘要，调用方需自行合并尚未写入的任务"""
+        return self.db.load_task_index()
+
+    def load_by_status(self, status: str) -> Dict[str, Dict[str, Any]]:
+        """加载指定状态的任务"""
+        return self.db.load_tasks_by_status(status)
+
+    def save(self, task_id: str, task: Dict[str, Any], immediate: bool = False):
+        """标记任务待写入，immediate 为真时立即写入"""
+        with self._lock:
+            self._dirty[task_id] = task
+        if immediate:
+            self.flush(task_id)
+
+    def flush(self, task_id: Optional[str] = None):
+        """写入脏任务（指定 task_id 时只写入该任务）"""
+        with self._write_lock:
+            with self._lock:
+                if task_id is None:
+                    pending, self._dirty = self._dirty, {}
+                elif task_id in self._dirty:
+                    pending = {task_id: self._dirty.pop(task_id)}
+                else:
+                    return
+                # 在锁内复制，避免写入时任务被其他线程修改
+                pending = {tid: dict(task) for tid, task in pending.items()}
+
+            try:
+                self.db.save_tasks(pending.items())
+            except Exception as e:
+                logger.error(f"保存任务失败：{str(e)}")
+                # 写入失败时放回待写入队列，下次刷新重试
+                with self._lock:
+                    for tid, task in pending.items():
+                        self._dirty.setdefault(tid, task)
+
+    def delete(self, task_id: str):
+        """删除任务"""
+        with self._lock:
+            self._dirty.pop(task_id, None)
+        self.db.delete_task(task_id)
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        """停止后台刷新并写入剩余数据"""
+        self._stop.set()
+        self.flush()
@@ -1,16 +1,53 @@
 import os
+import re
 import json
 import logging
+from functools import lru_cache
+from typing import Iterable, List
 
 logger = logging.getLogger('TitleFilter')
 
+
+def _alternation(words: Iterable[str]) -> re.Pattern:
+    """将多个关键词编译为一个正则，较长的关键词优先匹配"""
+    return re.compile('|'.join(re.escape(word) for word in sorted(words, key=len, reverse=True)))
+
+
 class TitleFilter:
-    def __init__(self, config_file: str = 'config/keywords_filter.json'):
+    """标题过滤器
+
+    规则在加载和保存配置时编译一次：单字符通过 str.translate 删除，关键词和替换规则
+    各编译为一个正则，每个标题只需扫描固定的几遍，与规则数量无关。
+    过滤结果按标题缓存，规则变化时清空。
+    """
+
+    def __init__(self, config_file: str = 'config/keywords_filter.json', cache_size: int = 4096):
         self.config_file = config_file
+        self.cache_size = cache_size
         self.remove_chars = []
         self.remove_words = []
         self.replace_rules = []
+        self._compile()
         self.load_config()
+
+    def _compile(self):
+        """根据当前规则重建匹配器并清空缓存"""
+        # 单字符放入删除表，多字符的“字符”按关键词处理（在其他关键词之前删除）
+        self._char_table = str.maketrans('', '', ''.join(c for c in self.remove_chars if len(c) == 1))
+        long_chars = [c for c in self.remove_chars if len(c) > 1]
+        words = [w for w in self.remove_words if w]
+        self._char_pattern = _alternation(long_chars) if long_chars else None
+        self._word_pattern = _alternation(words) if words else None
+
+        # 同一个原文有多条规则时，与逐条替换一致，以第一条为准
+        replacements = {}
+        for rule in self.replace_rules:
+            if rule.get('from'):
+                replacements.setdefault(rule['from'], rule.get('to', ''))
+        self._replacements = replacements
+        self._replace_pattern = _alternation(replacements) if replacements else None
+
+        self._cached_filter = lru_cache(maxsize=self.cache_size)(self._apply)
     
     def load_config(self):
         """加载过滤配置"""
@@ -21,37 +58,46 @@ class TitleFilter:
                     self.remove_chars = config.get('remove_chars', [])
                     self.remove_words = config.get('remove_words', [])
                     self.replace_rules = config.get('replace_rules', [])
+                self._compile()
                 logger.info(f"加载标题过滤配置：{len(self.remove_chars)} 个字符，{len(self.remove_words)} 个关键词，{len(self.replace_rules)} 个替换规则")
             else:
                 logger.warning(f"过滤配置文件不存在：{self.config_file}")
         except Exception as e:
             logger.error(f"加载过滤配置失败：{str(e)}")
     
-    def filter_title(self, title: str) -> str:
-        """过滤标题"""
-        if not title:
-            return title
-            
+    def _apply(self, title: str) -> str:
         # 移除特殊字符
-        filtered_title = title
-        for char in self.remove_chars:
-            filtered_title = filtered_title.replace(char, '')
-        
+        filtered_title = title.translate(self._char_table)
+        if self._char_pattern:
+            filtered_title = self._char_pattern.sub('', filtered_title)
+
         # 移除关键词
-        for word in self.remove_words:
-            filtered_title = filtered_title.replace(word, '')
-        
+        if self._word_pattern:
+            filtered_title = self._word_pattern.sub('', filtered_title)
+
         # 应用替换规则
-        for rule in self.replace_rules:
-            filtered_title = filtered_title.replace(rule['from'], rule['to'])
-        
+        if self._replace_pattern:
+            replacements = self._replacements
+            filtered_title = self._replace_pattern.sub(lambda m: replacements[m.group(0)], filtered_title)
+
         # 清理多余的空格
-        filtered_title = ' '.join(filtered_title.split())
-        
-        return filtered_title
+        return ' '.join(filtered_title.split())
+
+    def filter_title(self, title: str) -> str:
+        """过滤标题"""
+        if not title:
+            return title
+        return self._cached_filter(title)
+
+    def filter_titles(self, titles: Iterable[str]) -> List[str]:
+        """批量过滤标题"""
+        cached_filter = self._cached_filter
+        return [cached_filter(title) if title else title for title in titles]
     
     def save_config(self):
         """保存过滤配置"""
+        # 规则可能已被直接修改（如 Web 接口），保存时重新编译
+        self._compile()
         try:
             os.makedirs(os.path.dirname(self.config_file), exist_ok=True)
             with open(self.config_file, 'w', encoding='utf-8') as f:
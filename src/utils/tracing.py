@@ -0,0 +1,201 @@
+import os
+import time
+import logging
+import threading
+import contextvars
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger('Tracing')
+
+# 当前线程（上下文）正在记录的任务追踪
+_current = contextvars.ContextVar('bilipala_trace', default=None)
+
+
+class _NullSpan:
+    """关闭追踪或不在任务中时使用，进入和退出都不做任何事"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class TaskTrace:
+    """一个任务的追踪事件（Chrome trace 的完整事件，时间单位为微秒）"""
+
+    def __init__(self, task_id: str, epoch: float, max_events: int):
+        self.task_id = task_id
+        self.epoch = epoch
+        self.max_events = max_events
+        self.pid = os.getpid()
+        self.dropped = 0
+        self._events = []
+        self._threads = {}  # 线程ID -> 线程名
+        self._lock = threading.Lock()
+
+    def add(self, name: str, cat: str, start: float, end: float, args: Optional[Dict[str, Any]] = None):
+        thread = threading.current_thread()
+        event = {
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'ts': round((start - self.epoch) * 1e6, 1),
+            'dur': round((end - start) * 1e6, 1),
+            'pid': self.pid,
+            'tid': thread.ident
+        }
+        if args:
+            event['args'] = args
+        with self._lock:
+            if len(self._events) >= self.max_events:
+                self.dropped += 1
+                return
+            self._events.append(event)
+            self._threads[thread.ident] = thread.name
+
+    def export(self) -> Dict[str, Any]:
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+            dropped = self.dropped
+        metadata = [{'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'tid': 0,
+                     'args': {'name': f'task {self.task_id}'}}]
+        metadata.extend({'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}}
+                        for tid, name in threads.items())
+        return {
+            'traceEvents': metadata + events,
+            'displayTimeUnit': 'ms',
+            'otherData': {'task_id': self.task_id, 'dropped_events': dropped}
+        }
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'cat', 'args', 'start')
+
+    def __init__(self, trace: TaskTrace, name: str, cat: str, args: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args['error'] = f'{exc_type.__name__}: {exc}'[:200]
+        self.trace.add(self.name, self.cat, self.start, time.monotonic(), self.args)
+        return False
+
+    def set(self, **args):
+        """补充记录到事件中的参数"""
+        self.args.update(args)
+
+
+class _Binding:
+    __slots__ = ('trace', 'token')
+
+    def __init__(self, trace: TaskTrace):
+        self.trace = trace
+
+    def __enter__(self):
+        self.token = _current.set(self.trace)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self.token)
+        return False
+
+
+class Tracer:
+    """按任务记录各处理阶段的时间线，导出为 Chrome trace 格式（chrome://tracing、Perfetto）
+
+    TRACE_TASKS 为保留追踪的最近任务数，为 0（默认）时关闭记录，此时 span() 只多一次
+    上下文变量查询。追踪只保存在内存中；交给其他线程的工作用 current() 取出追踪，
+    在工作线程中用 bind() 继续记录。
+    """
+
+    def __init__(self, max_tasks: Optional[int] = None, max_events: Optional[int] = None):
+        self.max_tasks = int(os.getenv('TRACE_TASKS', '0')) if max_tasks is None else max_tasks
+        self.max_events = max_events or int(os.getenv('TRACE_MAX_EVENTS', '20000'))
+        self.epoch = time.monotonic()
+        self._traces = OrderedDict()  # 任务ID -> TaskTrace，按最近使用排序
+        self._lock = threading.Lock()
+        if self.enabled:
+            logger.info(f"任务追踪已开启：保留最近 {self.max_tasks} 个任务")
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_tasks > 0
+
+    def task(self, task_id: str):
+        """在当前上下文中记录任务的追踪（关闭时什么也不做）"""
+        if not self.enabled:
+            return _NULL_SPAN
+        with self._lock:
+            trace = self._traces.get(task_id)
+            if trace is None:
+                trace = self._traces[task_id] = TaskTrace(task_id, self.epoch, self.max_events)
+                while len(self._traces) > self.max_tasks:
+                    self._traces.popitem(last=False)
+            else:
+                self._traces.move_to_end(task_id)
+        return _Binding(trace)
+
+    @staticmethod
+    def current() -> Optional[TaskTrace]:
+        """当前上下文的追踪，用于交给其他线程"""
+        return _current.get()
+
+    @staticmethod
+    def bind(trace: Optional[TaskTrace]):
+        """在工作线程中继续记录提交方的追踪"""
+        return _Binding(trace) if trace is not None else _NULL_SPAN
+
+    @staticmethod
+    def span(name: str, cat: str = 'stage', **args):
+        """记录代码块的起止时间（不在任务追踪中时什么也不做）"""
+        trace = _current.get()
+        if trace is None:
+            return _NULL_SPAN
+        return _Span(trace, name, cat, args)
+
+    @staticmethod
+    def record(name: str, start: float, end: Optional[float] = None, cat: str = 'wait', **args):
+        """补记一段已经结束的时间（time.monotonic()），如排队等待"""
+        trace = _current.get()
+        if trace is not None:
+            trace.add(name, cat, start, time.monotonic() if end is None else end, args)
+
+    def export(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """导出任务的追踪，没有记录时返回 None"""
+        with self._lock:
+            trace = self._traces.get(task_id)
+        return trace.export() if trace else None
+
+    def discard(self, task_id: str):
+        """删除任务的追踪"""
+        with self._lock:
+            self._traces.pop(task_id, None)
+
+
+_shared_tracer = None
+_shared_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """获取进程内共享的追踪器"""
+    global _shared_tracer
+    with _shared_tracer_lock:
+        if _shared_tracer is None:
+            _shared_tracer = Tracer()
+        return _shared_tracer
@@ -0,0 +1,105 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Optional, Callable
+
+from .media_processor import MediaProcessor
+from .metrics import get_metrics, MetricsRegistry
+from .tracing import get_tracer
+
+logger = logging.getLogger('TranscodeWorker')
+
+
+class TranscodePool:
+    """转码线程池
+
+    下载线程只负责把原始音频落盘，转码交给这里按 CPU 核数并行执行（每个任务启动一个
+    FFmpeg 进程）。任务放入有界队列，队列满时下载方阻塞（背压），这样网络下载和 CPU
+    编码可以在不同分 P 之间重叠进行。
+    """
+
+    def __init__(self, workers: Optional[int] = None, max_pending: Optional[int] = None,
+                 processor: Optional[MediaProcessor] = None):
+        self.workers = workers or int(os.getenv('TRANSCODE_WORKERS', '0')) or os.cpu_count() or 2
+        self.quality = os.getenv('AUDIO_QUALITY', '192k')
+        self.processor = processor or MediaProcessor()
+        self._queue = queue.Queue(maxsize=max_pending or int(os.getenv('TRANSCODE_QUEUE_SIZE', '0')) or self.workers * 2)
+        self._busy = 0
+        self._busy_lock = threading.Lock()
+        self._threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'transcode-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        get_metrics().add_collector(self._collect_metrics)
+        logger.info(f"转码线程池启动：{self.workers} 个线程")
+
+    def submit(self, input_path: str, output_path: str, audio_format: str = 'mp3',
+               callback: Optional[Callable[[Future], None]] = None) -> Future:
+        """提交转码任务，队列已满时阻塞等待；转码成功后删除原始文件"""
+        future = Future()
+        if callback:
+            future.add_done_callback(callback)
+        self._queue.put((future, input_path, output_path, audio_format, get_tracer().current(), time.monotonic()))
+        return future
+
+    def pending(self) -> int:
+        """等待转码的任务数"""
+        return self._queue.qsize()
+
+    def _collect_metrics(self, metrics: MetricsRegistry):
+        metrics.set('bilipala_queue_depth', self.pending(), queue='transcode')
+        with self._busy_lock:
+            metrics.set('bilipala_active_workers', self._busy, pool='transcode')
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                break
+            future, input_path, output_path, audio_format, trace, queued_at = job
+            with self._busy_lock:
+                self._busy += 1
+            try:
+                if future.set_running_or_notify_cancel():
+                    # 继续记录提交方任务的追踪（包括回调中提交的标签写入）
+                    with get_tracer().bind(trace):
+                        get_tracer().record('transcode_queue_wait', queued_at)
+                        if not self.processor.extract_audio(input_path, output_path, quality=self.quality,
+                                                            audio_format=audio_format):
+                            raise RuntimeError(f"音频转换失败: {os.path.basename(input_path)}")
+                        if input_path != output_path and os.path.exists(input_path):
+                            os.remove(input_path)
+                        logger.info(f"转码完成: {os.path.basename(output_path)}")
+                        future.set_result(output_path)
+            except Exception as e:
+                logger.error(f"转码失败：{os.path.basename(input_path)} - {str(e)}")
+                future.set_exception(e)
+            finally:
+                with self._busy_lock:
+                    self._busy -= 1
+                self._queue.task_done()
+
+    def shutdown(self):
+        """处理完已提交的任务后停止工作线程"""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+def get_transcode_pool() -> TranscodePool:
+    """获取进程内共享的转码线程池"""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = TranscodePool()
+        return _shared_pool
@@ -0,0 +1,73 @@
+import importlib
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+from bili_server import StandInServer, attach  # noqa: E402
+
+
+class TestApp(unittest.TestCase):
+    """通过 Flask 接口在本地替身服务器上下载"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.env = mock.patch.dict(os.environ, {
+            'DB_PATH': os.path.join(cls.tmp.name, 'test.db'),
+            'DOWNLOAD_DIR': os.path.join(cls.tmp.name, 'audiobooks'),
+            'COVER_CACHE_DIR': os.path.join(cls.tmp.name, 'cover_cache'),
+            'AUDIO_FORMAT': 'original',
+        })
+        cls.env.start()
+        sys.path.insert(0, os.path.join(ROOT, 'src'))
+        cls.web = importlib.import_module('app')
+        cls.server = StandInServer({'BV1bench': 2}, audio_size=128 * 1024).start()
+        attach(cls.web.task_manager.downloader, cls.server.url)
+        cls.client = cls.web.app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.web.task_manager.jobs.shutdown()
+        cls.web.task_manager.store.close()
+        cls.server.stop()
+        cls.env.stop()
+        cls.tmp.cleanup()
+
+    def _wait(self, task_id):
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            task = self.client.get(f'/task_status?task_id={task_id}').get_json()
+            if task['status'] in ('completed', 'failed'):
+                return task
+            time.sleep(0.05)
+        self.fail('任务超时')
+
+    def test_download_reuses_checked_playlist(self):
+        result = self.client.post('/check_playlist', json={'bvid': 'BV1bench'}).get_json()
+        self.assertEqual(result['count'], 2)
+
+        result = self.client.post('/download', json={'bvid': 'BV1bench', 'output_dir': 'app'}).get_json()
+        self.assertTrue(result['success'])
+        self.assertEqual(self._wait(result['task_id'])['status'], 'completed')
+        # 播放列表信息只请求一次
+        self.assertEqual(self.server.snapshot()['view'], 1)
+
+    def test_job_options_are_validated(self):
+        with mock.patch.object(self.web.task_manager, 'submit_download', return_value='queued-task') as submit:
+            response = self.client.post('/download', json={'bvid': 'BV1bench', 'output_dir': 'app', 'priority': 'high'})
+            self.assertEqual(response.status_code, 400)
+            submit.assert_not_called()
+
+            # 优先级限制在配置范围内，未开启 TRUST_CLIENT_ID 时忽略 X-Client-Id
+            self.client.post('/download', json={'bvid': 'BV1bench', 'output_dir': 'app', 'priority': 10 ** 9},
+                             headers={'X-Client-Id': 'someone-else'})
+            self.assertEqual(submit.call_args.kwargs, {'priority': self.web.JOB_MAX_PRIORITY, 'client': '127.0.0.1'})
+
+
+if __name__ == '__main__':
+    unittest.main()
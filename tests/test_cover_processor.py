@@ -0,0 +1,40 @@
+import unittest
+from io import BytesIO
+
+from PIL import Image
+
+from src.utils.cover_processor import CoverProcessor
+
+
+class TestCoverProcessor(unittest.TestCase):
+    def setUp(self):
+        self.processor = CoverProcessor()
+
+    def _encode(self, img):
+        output = BytesIO()
+        img.save(output, format='JPEG', quality=95)
+        return output.getvalue()
+
+    def test_render_square(self):
+        for size in [(1920, 1080), (1080, 1920), (320, 180), (400, 400)]:
+            with self.subTest(size=size):
+                data = self._encode(Image.new('RGB', size, (200, 30, 30)))
+                img = Image.open(BytesIO(self.processor.render(data)))
+                self.assertEqual(img.size, (400, 400))
+                self.assertEqual(img.format, 'JPEG')
+
+    def test_padding_extends_edges(self):
+        # 左半红、右半蓝的横图，上下填充区应延续原图边缘颜色
+        img = Image.new('RGB', (800, 400), (255, 0, 0))
+        img.paste((0, 0, 255), (400, 0, 800, 400))
+        square = self.processor.square(img)
+        r, g, b = square.getpixel((50, 5))
+        self.assertGreater(r, 200)
+        self.assertLess(b, 50)
+        r, g, b = square.getpixel((350, 395))
+        self.assertGreater(b, 200)
+        self.assertLess(r, 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
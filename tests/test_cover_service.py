@@ -0,0 +1,73 @@
+import os
+import tempfile
+import threading
+import unittest
+from io import BytesIO
+from unittest import mock
+
+from PIL import Image
+
+from src.utils.cover_service import CoverService
+
+
+class TestCoverService(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        output = BytesIO()
+        Image.new('RGB', (640, 360), (10, 120, 200)).save(output, format='JPEG')
+        self.response = mock.Mock(status_code=200, content=output.getvalue())
+        self.http = mock.Mock()
+        self.http.get.return_value = self.response
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def test_shared_thumbnail_fetched_once(self):
+        service = CoverService(self.http, cache_dir=self.cache_dir.name)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(service.get('https://i0.hdslb.com/a.jpg')))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.http.get.assert_called_once()
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(Image.open(BytesIO(results[0])).size, (400, 400))
+        # 请求结束后不保留该 URL 的锁
+        self.assertEqual(service._url_locks, {})
+
+    def test_disk_cache_survives_restart(self):
+        first = CoverService(self.http, cache_dir=self.cache_dir.name).get('https://i0.hdslb.com/a.jpg')
+        second = CoverService(self.http, cache_dir=self.cache_dir.name).get('https://i0.hdslb.com/a.jpg')
+
+        self.http.get.assert_called_once()
+        self.assertEqual(first, second)
+
+    def test_disk_cache_is_bounded(self):
+        def image(color):
+            output = BytesIO()
+            Image.new('RGB', (64, 64), color).save(output, format='JPEG')
+            return mock.Mock(status_code=200, content=output.getvalue())
+
+        self.http.get.side_effect = lambda url, **kwargs: image((int(url[-5]) * 50, 0, 0))
+        service = CoverService(self.http, cache_dir=self.cache_dir.name, max_items=1, max_disk_items=2)
+        for i in range(4):
+            service.get(f'https://i0.hdslb.com/{i}.jpg')
+            # 保证修改时间有先后
+            for name in os.listdir(self.cache_dir.name):
+                path = os.path.join(self.cache_dir.name, name)
+                os.utime(path, ns=(os.stat(path).st_mtime_ns - 10 ** 9,) * 2)
+
+        names = os.listdir(self.cache_dir.name)
+        self.assertEqual(len([name for name in names if name.endswith('.jpg')]), 2)
+        self.assertEqual(len([name for name in names if name.endswith('.ref')]), 2)
+        # 最近的封面仍在磁盘缓存中
+        self.http.get.reset_mock()
+        CoverService(self.http, cache_dir=self.cache_dir.name).get('https://i0.hdslb.com/3.jpg')
+        self.http.get.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
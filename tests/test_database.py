@@ -0,0 +1,70 @@
+import json
+import os
+import tempfile
+import unittest
+
+from src.utils.database import Database
+
+
+class TestDatabaseMigration(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.tmp.name, 'test.db'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+
+    def test_migrate_tasks_dir(self):
+        tasks_dir = os.path.join(self.tmp.name, 'download_tasks')
+        self._write(os.path.join(tasks_dir, 'a.json'), {'created_at': '2025-01-01T00:00:00', 'status': 'completed'})
+        self._write(os.path.join(tasks_dir, 'active_tasks.json'),
+                    {'b': {'created_at': '2025-01-02T00:00:00', 'status': 'running'}})
+        # 下载器写入的运行状态文件没有 created_at
+        self._write(os.path.join(tasks_dir, 'run.json'), {'bvid': 'BV1', 'status': 'running'})
+
+        self.db.migrate_tasks_dir(tasks_dir)
+        self.db.migrate_tasks_dir(tasks_dir)
+
+        tasks = self.db.load_tasks()
+        self.assertEqual(list(tasks), ['a', 'b'])
+        self.assertEqual(tasks['b']['task_id'], 'b')
+        self.assertEqual(self.db.load_run('run')['bvid'], 'BV1')
+        self.assertFalse(any(name.endswith('.json') for name in os.listdir(tasks_dir)))
+
+    def test_migrate_history(self):
+        history_file = os.path.join(self.tmp.name, 'download_history', 'history.json')
+        self._write(history_file, {'key': {'bvid': 'BV1', 'p': 2, 'title': '第二集', 'file_path': 'x.mp3'}})
+
+        self.db.migrate_history(history_file)
+
+        self.assertEqual(self.db.count_history(), 1)
+        self.assertEqual(self.db.get_history('key')['title'], '第二集')
+        self.assertTrue(os.path.exists(f'{history_file}.migrated'))
+
+
+class TestDatabaseCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'test.db')
+        self.db = Database(self.path, checkpoint_interval=3600)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_writes_append_to_wal_until_checkpoint(self):
+        for i in range(50):
+            self.db.save_file_entry(f'BV{i}', {'checksum': str(i)})
+        self.assertGreater(os.path.getsize(f'{self.path}-wal'), 0)
+
+        self.db.close()
+        self.assertEqual(os.path.getsize(f'{self.path}-wal'), 0)
+        self.assertEqual(len(Database(self.path, checkpoint_interval=0).load_files()), 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,19 @@
+import os
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
+from src.utils.database import Database
 from src.utils.downloader import BiliDownloader
 
 class TestBiliDownloader(unittest.TestCase):
     def setUp(self):
-        self.downloader = BiliDownloader()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.downloader = BiliDownloader(db=Database(os.path.join(self.tmp.name, 'test.db')))
+
+    def tearDown(self):
+        self.tmp.cleanup()
 
     def test_extract_bvid(self):
         test_cases = [
@@ -21,5 +31,128 @@ class TestBiliDownloader(unittest.TestCase):
         with self.assertRaises(ValueError):
             self.downloader.extract_bvid("https://www.example.com")
 
+    def test_parallel_parts_keep_order(self):
+        # 后面的分 P 先完成，结果和下载历史仍应按分 P 顺序输出
+        def fake_part(bvid, p, count, base_path, output_dir, rename, ydl_opts, part_info, events, state, resume_id=None):
+            time.sleep(0.05 * (count - p))
+            return {'status': 'success', 'file_path': f'{output_dir}-{p}.mp3', 'info': {}, 'title': f'P{p}'}
+
+        history = []
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.dict(os.environ, {'DOWNLOAD_DIR': tmp, 'PART_WORKERS': '4'}), \
+                mock.patch.object(self.downloader, 'check_playlist', return_value=4), \
+                mock.patch.object(self.downloader, '_download_part', side_effect=fake_part), \
+                mock.patch.object(self.downloader, 'save_task_state'), \
+                mock.patch.object(self.downloader, 'add_download_history',
+                                  side_effect=lambda bvid, p, path, info: history.append(p)):
+            results = [e for e in self.downloader.download('BV1xx411c7mD', 'book') if e['status'] == 'success']
+
+        self.assertEqual([e['part'] for e in results], [1, 2, 3, 4])
+        self.assertEqual(history, [1, 2, 3, 4])
+        self.assertEqual(results[-1]['progress'], 100)
+
+    def test_indexed_parts_skip_without_network(self):
+        base_path = os.path.join(self.tmp.name, 'book')
+        os.makedirs(base_path)
+        for p in (1, 2):
+            path = os.path.join(base_path, f'book-{p}.mp3')
+            with open(path, 'wb') as f:
+                f.write(b'audio')
+            self.downloader.index_download('BV1xx411c7mD', p, path, cid=100 + p)
+        # 第 2 集文件在索引之后被修改，需要重新检查
+        os.utime(os.path.join(base_path, 'book-2.mp3'), ns=(0, 0))
+
+        checked = []
+
+        def fake_part(bvid, p, count, base_path, output_dir, rename, ydl_opts, part_info, events, state, resume_id=None):
+            checked.append(p)
+            return {'status': 'skip', 'file_path': os.path.join(base_path, f'book-{p}.mp3'), 'title': f'P{p}'}
+
+        playlist = {'title': '有声书', 'parts': [{'p': 1, 'cid': 101, 'title': 'P1'}, {'p': 2, 'cid': 102, 'title': 'P2'}]}
+        with mock.patch.dict(os.environ, {'DOWNLOAD_DIR': self.tmp.name}), \
+                mock.patch.object(self.downloader, 'check_playlist', return_value=2), \
+                mock.patch.object(self.downloader, 'get_cached_playlist', return_value=playlist), \
+                mock.patch.object(self.downloader, '_download_part', side_effect=fake_part):
+            results = [e for e in self.downloader.download('BV1xx411c7mD', 'book') if e['status'] == 'skip']
+
+        self.assertEqual([e['part'] for e in results], [1, 2])
+        self.assertEqual(checked, [2])
+        # 第 2 集重新检查后补入索引
+        entry = self.downloader.db.load_skip_entries('BV1xx411c7mD')[2]
+        self.assertTrue(self.downloader.check_skip_index('BV1xx411c7mD', 2, entry, 102))
+        self.assertFalse(self.downloader.check_skip_index('BV1xx411c7mD', 2, entry, 999))
+
+    def test_concurrent_requests_share_one_download(self):
+        calls = []
+        started = threading.Event()
+
+        def fake_part(bvid, p, count, base_path, output_dir, rename, ydl_opts, part_info, events, state, resume_id=None):
+            calls.append((output_dir, p))
+            started.set()
+            time.sleep(0.2)
+            path = os.path.join(base_path, f'有声书 p{p:02d}.m4a')
+            with open(path, 'wb') as f:
+                f.write(b'audio')
+            return {'status': 'success', 'file_path': path, 'info': {'cid': 100 + p}, 'title': f'P{p}'}
+
+        results = {}
+
+        def run(output_dir):
+            results[output_dir] = [e for e in self.downloader.download('BV1xx411c7mD', output_dir)
+                                   if e['status'] == 'success']
+
+        with mock.patch.dict(os.environ, {'DOWNLOAD_DIR': self.tmp.name}), \
+                mock.patch.object(self.downloader, 'check_playlist', return_value=2), \
+                mock.patch.object(self.downloader, '_download_part', side_effect=fake_part):
+            first = threading.Thread(target=run, args=('book',))
+            first.start()
+            started.wait(5)
+            run('copy')
+            first.join(5)
+
+        # 每个分 P 只下载一次，两个任务都得到各自目录下的文件
+        self.assertEqual(sorted(p for _, p in calls), [1, 2])
+        for output_dir in ('book', 'copy'):
+            self.assertEqual([e['part'] for e in results[output_dir]], [1, 2])
+            for p in (1, 2):
+                with open(os.path.join(self.tmp.name, output_dir, f'有声书 p{p:02d}.m4a'), 'rb') as f:
+                    self.assertEqual(f.read(), b'audio')
+        self.assertEqual(len(self.downloader.inflight), 0)
+
+    def test_audio_format_options(self):
+        self.downloader.audio_format = 'm4b'
+        self.assertEqual(self.downloader.audio_postprocessors(), [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'm4a'}])
+        self.assertEqual(self.downloader.audio_extensions({'ext': 'm4a'}), ('m4a', 'm4b'))
+
+        self.downloader.audio_format = 'original'
+        self.assertEqual(self.downloader.audio_postprocessors(), [])
+        self.assertEqual(self.downloader.audio_extensions({'ext': 'webm'}), ('webm', 'webm'))
+
+        # mp3 先下载原始音频，再交给转码线程池
+        self.downloader.audio_format = 'mp3'
+        self.assertEqual(self.downloader.audio_postprocessors(), [])
+        self.assertEqual(self.downloader.audio_extensions({'ext': 'm4a'}), ('m4a', 'mp3'))
+
+    def test_playlist_info_single_request(self):
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {'code': 0, 'data': {
+            'bvid': 'BV1xx411c7mD',
+            'title': '有声书',
+            'pic': 'https://i0.hdslb.com/cover.jpg',
+            'owner': {'name': 'up'},
+            'pages': [
+                {'page': 1, 'cid': 101, 'part': '第一章', 'duration': 600},
+                {'page': 2, 'cid': 102, 'part': '第二章', 'duration': 620},
+            ]
+        }}
+        with mock.patch.object(self.downloader.http, 'get', return_value=response) as get:
+            self.assertEqual(self.downloader.check_playlist('BV1xx411c7mD'), 2)
+            playlist = self.downloader.get_playlist_info('BV1xx411c7mD')
+
+        get.assert_called_once()
+        self.assertEqual(playlist['parts'][1]['cid'], 102)
+        self.assertEqual(playlist['parts'][1]['title'], '有声书 p02 第二章')
+        self.assertEqual(playlist['parts'][0]['thumbnail'], 'https://i0.hdslb.com/cover.jpg')
+
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file
@@ -0,0 +1,163 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from mutagen.mp4 import MP4
+
+from src.utils.database import Database
+from src.utils.downloader import BiliDownloader
+from src.utils.task_manager import TaskManager
+from src.utils.transcode_worker import TranscodePool
+from src.utils.tracing import Tracer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from bili_server import StandInServer, attach  # noqa: E402
+
+
+class FakeProcessor:
+    """代替 FFmpeg：成功时写入几帧静音 MP3，失败时留下不完整的输出"""
+    frame = b'\xff\xfb\x90\x64' + b'\x00' * 413  # MPEG-1 Layer III，128 kbps，44.1 kHz
+
+    def __init__(self, ok: bool):
+        self.ok = ok
+
+    def extract_audio(self, input_path, output_path, quality='192k', audio_format='mp3'):
+        with open(output_path, 'wb') as f:
+            f.write(self.frame * 20 if self.ok else self.frame[:100])
+        return self.ok
+
+
+class TestEndToEnd(unittest.TestCase):
+    """在本地替身服务器上走完整的下载流程"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StandInServer({'BV1bench': 3}, audio_size=256 * 1024).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.env = mock.patch.dict(os.environ, {
+            'DOWNLOAD_DIR': os.path.join(self.tmp.name, 'audiobooks'),
+            'COVER_CACHE_DIR': os.path.join(self.tmp.name, 'cover_cache'),
+            'AUDIO_FORMAT': 'original',
+        })
+        self.env.start()
+        self.downloader = attach(BiliDownloader(db=Database(os.path.join(self.tmp.name, 'test.db'))),
+                                 self.server.url)
+
+    def tearDown(self):
+        self.env.stop()
+        self.tmp.cleanup()
+
+    def _run(self):
+        return list(self.downloader.download('BV1bench', 'e2e'))
+
+    def test_download_playlist(self):
+        events = self._run()
+        successes = [event for event in events if event['status'] == 'success']
+        self.assertEqual([event['part'] for event in successes], [1, 2, 3])
+        self.assertEqual(events[-1]['status'], 'completed')
+
+        output_dir = os.path.join(self.tmp.name, 'audiobooks', 'e2e')
+        files = sorted(os.listdir(output_dir))
+        self.assertEqual(len(files), 3)
+        for name in files:
+            tags = MP4(os.path.join(output_dir, name)).tags
+            self.assertEqual(tags['\xa9nam'], [os.path.splitext(name)[0]])
+            self.assertIn('covr', tags)
+
+        # 再次下载时全部跳过，不再请求替身服务器
+        before = self.server.snapshot()
+        events = self._run()
+        self.assertEqual([event['status'] for event in events if event.get('part')], ['skip'] * 3)
+        self.assertEqual(events[-1]['status'], 'completed')
+        self.assertEqual(self.server.snapshot(), before)
+
+    def test_ydl_uses_http_client_settings(self):
+        self.downloader.http.max_retries = 7
+        self.downloader.http.timeout = (5, 25)
+        options = []
+        new_ydl = self.downloader._new_ydl
+
+        def capture(opts, resume_id, p):
+            options.append(opts)
+            return new_ydl(opts, resume_id, p)
+
+        self.downloader._new_ydl = capture
+        self._run()
+        self.assertTrue(options)
+        self.assertTrue(all(opts['retries'] == 7 and opts['socket_timeout'] == 25 for opts in options))
+
+    def _run_transcoded(self, ok: bool):
+        self.downloader.audio_format = 'mp3'
+        pool = TranscodePool(workers=1, processor=FakeProcessor(ok))
+        try:
+            with mock.patch.object(BiliDownloader, 'transcode_pool', new_callable=mock.PropertyMock,
+                                   return_value=pool):
+                return self._run()
+        finally:
+            pool.shutdown()
+
+    def test_transcoded_part_succeeds_after_transcode(self):
+        events = self._run_transcoded(True)
+        # 转码的分 P 按转码完成的顺序输出
+        successes = [event for event in events if event['status'] == 'success']
+        self.assertEqual(sorted(event['part'] for event in successes), [1, 2, 3])
+        self.assertFalse(any(event.get('error') for event in successes))
+        self.assertEqual(events[-1]['status'], 'completed')
+
+        output_dir = os.path.join(self.tmp.name, 'audiobooks', 'e2e')
+        files = sorted(os.listdir(output_dir))
+        self.assertEqual([os.path.splitext(name)[1] for name in files], ['.mp3'] * 3)
+        self.assertEqual(self.downloader.db.count_history(), 3)
+        for p, name in enumerate(files, 1):
+            video_key = self.downloader.get_video_key('BV1bench', p, os.path.splitext(name)[0])
+            self.assertGreater(self.downloader.db.get_history(video_key)['file_size'], 0)
+
+    def test_failed_transcode_reports_error(self):
+        events = self._run_transcoded(False)
+        part_events = [event for event in events if event.get('part') and event['status'] != 'progress']
+        self.assertEqual([event['status'] for event in part_events], ['error'] * 3)
+        self.assertIn('失败 3 个', events[-1]['message'])
+        # 不完整的输出和原始文件都已删除，也没有写入下载历史
+        self.assertEqual(os.listdir(os.path.join(self.tmp.name, 'audiobooks', 'e2e')), [])
+        self.assertEqual(self.downloader.db.count_history(), 0)
+
+    def test_task_trace(self):
+        manager = TaskManager(db=Database(os.path.join(self.tmp.name, 'tasks.db')))
+        attach(manager.downloader, self.server.url)
+        manager.tracer = Tracer(max_tasks=5)
+        try:
+            task_id = manager.submit_download('BV1bench', 'trace')
+            deadline = time.monotonic() + 30
+
+            def spans():
+                return [event for event in manager.get_task_trace(task_id)['traceEvents'] if event['ph'] == 'X']
+
+            # 等到任务结束，且 job 追踪已记录（在最后一次状态更新之后结束）
+            while time.monotonic() < deadline and (
+                    manager.get_task(task_id)['status'] not in ('completed', 'failed')
+                    or not any(event['name'] == 'job' for event in spans())):
+                time.sleep(0.05)
+            self.assertEqual(manager.get_task(task_id)['status'], 'completed')
+            self.assertEqual(manager.get_task(task_id)['parts_done'], 3)
+
+            events = spans()
+            names = {event['name'] for event in events}
+            for name in ('job', 'queue_wait', 'playlist', 'part', 'extract_info', 'download', 'wait_for_file', 'tag'):
+                self.assertIn(name, names)
+            self.assertEqual(sorted(event['args']['part'] for event in events if event['name'] == 'part'), [1, 2, 3])
+        finally:
+            manager.jobs.shutdown()
+            manager.store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
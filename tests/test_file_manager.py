@@ -0,0 +1,88 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from src.utils.database import Database
+from src.utils.file_manager import FileManager, hash_file
+
+
+class TestFileManager(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.manager = FileManager(os.path.join(self.tmp.name, 'downloads'),
+                                   db=Database(os.path.join(self.tmp.name, 'test.db')))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _download(self, bvid, chunks):
+        for chunk in chunks:
+            self.manager.record_download_progress(bvid, 'video', chunk)
+        final_path = os.path.join(self.tmp.name, f'{bvid}.mp4')
+        shutil.move(self.manager.get_temp_path(bvid, 'video'), final_path)
+        self.manager.update_file_metadata(bvid, 'video', final_path)
+        return final_path
+
+    def test_checksum_computed_while_writing(self):
+        final_path = self._download('BV1', [b'a' * 1000, b'b' * 1000])
+
+        entry = self.manager.metadata['BV1']
+        self.assertEqual(entry['checksum'], hash_file(final_path, 'blake2b').hexdigest())
+        self.assertEqual(entry['hash_algo'], 'blake2b')
+        with mock.patch('src.utils.file_manager.hash_file') as rehash:
+            self.assertTrue(self.manager.check_file_exists('BV1', 'video')['completed'])
+        rehash.assert_not_called()
+
+    def test_changed_mtime_forces_verify(self):
+        final_path = self._download('BV1', [b'audio'])
+        os.utime(final_path, ns=(0, 0))
+        self.assertTrue(self.manager.check_file_exists('BV1', 'video')['completed'])
+        self.assertEqual(self.manager.metadata['BV1']['file_mtime'], 0)
+
+        # 内容被改写（大小不变）时校验失败
+        with open(final_path, 'wb') as f:
+            f.write(b'AUDIO')
+        self.assertFalse(self.manager.check_file_exists('BV1', 'video', verify=True)['completed'])
+
+    def test_resume_after_restart(self):
+        self.manager.record_download_progress('BV1', 'video', b'first')
+        restarted = FileManager(self.manager.base_path, db=self.manager.db)
+        restarted.record_download_progress('BV1', 'video', b'second')
+        expected = hash_file(restarted.get_temp_path('BV1', 'video'), 'blake2b').hexdigest()
+        self.assertEqual(restarted.get_download_checksum('BV1', 'video'), expected)
+
+    def test_store_stream(self):
+        chunks = [b'x' * 4096 for _ in range(10)]
+        path = self.manager.store_stream('audio', iter(chunks), 'BV1', {'title': '第一集'})
+
+        expected = hash_file(path, 'blake2b').hexdigest()
+        self.assertEqual(os.path.basename(path), f'BV1_{expected[:8]}.mp3')
+        self.assertEqual(self.manager.metadata['BV1']['checksum'], expected)
+        self.assertEqual(os.listdir(os.path.dirname(path)), [os.path.basename(path)])
+        # 与直接创建的文件权限一致，而不是临时文件的 0600
+        umask = os.umask(0)
+        os.umask(umask)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o666 & ~umask)
+
+        # 文件对象与一次性传入的字节内容得到相同的文件
+        same = self.manager.store_stream('audio', io.BytesIO(b''.join(chunks)), 'BV1', {})
+        self.assertEqual(same, path)
+        self.assertEqual(self.manager.store_file('audio', b''.join(chunks), 'BV1', {}), path)
+
+    def test_store_stream_failure_leaves_no_temp_file(self):
+        def broken():
+            yield b'data'
+            raise IOError('连接中断')
+
+        with self.assertRaises(IOError):
+            self.manager.store_stream('audio', broken(), 'BV1', {})
+        storage_dir = self.manager._storage_dir('audio')
+        self.assertEqual(os.listdir(storage_dir), [])
+        self.assertNotIn('BV1', self.manager.metadata)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import os
+import threading
+import unittest
+from unittest import mock
+
+import requests
+
+from src.utils.http_client import HttpClient
+
+
+class TestHttpClient(unittest.TestCase):
+    def test_session_per_thread_shares_adapter(self):
+        client = HttpClient({'User-Agent': 'test-agent'})
+        session = client.session
+        self.assertIs(client.session, session)
+        self.assertEqual(session.headers['User-Agent'], 'test-agent')
+
+        other = []
+        thread = threading.Thread(target=lambda: other.append(client.session))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], session)
+        # 各线程的 Session 共用同一个连接池
+        self.assertIs(other[0].get_adapter('https://api.bilibili.com/'), session.get_adapter('https://www.bilibili.com/'))
+
+    def test_retry_configuration(self):
+        client = HttpClient(max_retries=3, backoff_factor=0.2)
+        retry = client.session.get_adapter('https://api.bilibili.com/').max_retries
+        self.assertEqual(retry.total, 3)
+        self.assertEqual(retry.backoff_factor, 0.2)
+        self.assertIn(503, retry.status_forcelist)
+        self.assertFalse(retry.raise_on_status)
+        self.assertEqual(client.ydl_options()['retries'], 3)
+
+    def test_default_timeout(self):
+        with mock.patch.dict(os.environ, {'HTTP_CONNECT_TIMEOUT': '4', 'TIMEOUT': '20'}):
+            client = HttpClient()
+        self.assertEqual(client.timeout, (4.0, 20.0))
+        self.assertEqual(client.ydl_options()['socket_timeout'], 20.0)
+
+        response = mock.Mock(status_code=200, raw=None)
+        with mock.patch.object(requests.Session, 'get', return_value=response) as get:
+            client.get('https://api.bilibili.com/x/web-interface/view')
+            self.assertEqual(get.call_args.kwargs['timeout'], (4.0, 20.0))
+            # 调用方指定的超时优先
+            client.get('https://api.bilibili.com/x/web-interface/view', timeout=1)
+            self.assertEqual(get.call_args.kwargs['timeout'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
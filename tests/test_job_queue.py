@@ -0,0 +1,82 @@
+import threading
+import time
+import unittest
+
+from src.utils.job_queue import JobQueue, JobQueueFull
+
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.executed = []
+        self.lock = threading.Lock()
+        self.changes = 0
+        self.jobs = JobQueue(workers=1, max_pending=5, on_change=self._changed)
+        # 占住唯一的工作线程，后续任务都在队列中等待
+        self.jobs.submit('blocker', self._blocker)
+        self.assertTrue(self.started.wait(5))
+
+    def tearDown(self):
+        self.release.set()
+        self.jobs.shutdown()
+
+    def _changed(self):
+        with self.lock:
+            self.changes += 1
+
+    def _blocker(self):
+        self.started.set()
+        self.release.wait(5)
+
+    def _job(self, name):
+        def run():
+            with self.lock:
+                self.executed.append(name)
+        return run
+
+    def _drain(self, count):
+        self.release.set()
+        deadline = time.time() + 5
+        while len(self.executed) < count and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_priority_and_client_fairness(self):
+        for name in ('a1', 'a2', 'a3'):
+            self.jobs.submit(name, self._job(name), client='a')
+        self.jobs.submit('b1', self._job('b1'), client='b')
+        self.jobs.submit('urgent', self._job('urgent'), priority=5, client='a')
+
+        expected = ['urgent', 'a1', 'b1', 'a2', 'a3']
+        self.assertEqual(self.jobs.order(), expected)
+        self.assertEqual(self.jobs.positions()['b1'], 3)
+
+        self._drain(5)
+        self.assertEqual(self.executed, expected)
+        self.assertEqual(self.jobs.pending(), 0)
+
+    def test_submit_returns_position_and_notifies(self):
+        self.assertEqual(self.jobs.submit('x', self._job('x'), client='a'), 1)
+        self.assertEqual(self.jobs.submit('y', self._job('y'), client='a'), 2)
+        self.assertGreaterEqual(self.changes, 3)
+
+    def test_bounded_queue_rejects_new_jobs(self):
+        for i in range(5):
+            self.jobs.submit(f'job{i}', self._job(i))
+        with self.assertRaises(JobQueueFull):
+            self.jobs.submit('overflow', self._job('overflow'))
+        self.assertEqual(self.jobs.pending(), 5)
+
+    def test_cancel_removes_queued_job(self):
+        self.jobs.submit('x', self._job('x'), client='a')
+        self.jobs.submit('y', self._job('y'), client='b')
+        self.assertTrue(self.jobs.cancel('x'))
+        self.assertFalse(self.jobs.cancel('x'))
+        self.assertEqual(self.jobs.order(), ['y'])
+
+        self._drain(1)
+        self.assertEqual(self.executed, ['y'])
+
+
+if __name__ == '__main__':
+    unittest.main()
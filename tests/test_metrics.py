@@ -0,0 +1,62 @@
+import unittest
+
+from src.utils.metrics import MetricsRegistry
+
+
+class Pool:
+    def __init__(self, pending):
+        self.pending = pending
+
+    def collect(self, metrics):
+        metrics.set('bilipala_queue_depth', self.pending, queue='tag')
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def setUp(self):
+        self.metrics = MetricsRegistry()
+
+    def test_counters_and_histograms_render(self):
+        self.metrics.inc('bilipala_downloaded_bytes_total', 1024)
+        self.metrics.inc('bilipala_http_responses_total', host='api.bilibili.com', code=200)
+        self.metrics.observe('bilipala_stage_duration_seconds', 0.3, stage='extract_info')
+        self.metrics.observe('bilipala_stage_duration_seconds', 700, stage='extract_info')
+
+        text = self.metrics.render()
+        self.assertIn('# TYPE bilipala_stage_duration_seconds histogram', text)
+        self.assertIn('bilipala_downloaded_bytes_total 1024', text)
+        self.assertIn('bilipala_http_responses_total{code="200",host="api.bilibili.com"} 1', text)
+        self.assertIn('bilipala_stage_duration_seconds_bucket{stage="extract_info",le="0.25"} 0', text)
+        self.assertIn('bilipala_stage_duration_seconds_bucket{stage="extract_info",le="0.5"} 1', text)
+        self.assertIn('bilipala_stage_duration_seconds_bucket{stage="extract_info",le="+Inf"} 2', text)
+        self.assertIn('bilipala_stage_duration_seconds_count{stage="extract_info"} 2', text)
+
+    def test_stage_timer_records_failures(self):
+        with self.assertRaises(RuntimeError):
+            with self.metrics.stage('download'):
+                raise RuntimeError('网络错误')
+        count, total = self.metrics.value('bilipala_stage_duration_seconds', stage='download')
+        self.assertEqual(count, 1)
+        self.assertGreaterEqual(total, 0)
+
+    def test_collectors_are_weak(self):
+        pool = Pool(3)
+        self.metrics.add_collector(pool.collect)
+        self.assertIn('bilipala_queue_depth{queue="tag"} 3', self.metrics.render())
+
+        pool.pending = 0
+        self.metrics.render()
+        self.assertEqual(self.metrics.value('bilipala_queue_depth', queue='tag'), 0)
+
+        del pool
+        self.metrics.render()
+        self.assertEqual(self.metrics._collectors, [])
+
+    def test_unknown_metric_is_rejected(self):
+        with self.assertRaises(KeyError):
+            self.metrics.inc('bilipala_unknown_total')
+        with self.assertRaises(KeyError):
+            self.metrics.observe('bilipala_downloaded_bytes_total', 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
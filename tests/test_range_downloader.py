@@ -0,0 +1,133 @@
+import os
+import re
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.utils.downloader import SegmentedYoutubeDL
+from src.utils.http_client import HttpClient
+from src.utils.range_downloader import RangeDownloader
+
+CONTENT = bytes(range(256)) * 4096  # 1 MiB
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """支持 Range 请求的本地测试服务器，记录每次请求的范围"""
+    content = CONTENT
+    support_range = True
+    requests = []
+    lock = threading.Lock()
+
+    def do_GET(self):
+        match = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        if not self.support_range or not match:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(self.content)))
+            self.end_headers()
+            self.wfile.write(self.content)
+            return
+        start, end = int(match.group(1)), int(match.group(2))
+        with self.lock:
+            self.requests.append((start, end))
+        body = self.content[start:end + 1]
+        self.send_response(206)
+        self.send_header('Content-Range', f'bytes {start}-{end}/{len(self.content)}')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestRangeDownloader(unittest.TestCase):
+    def setUp(self):
+        RangeHandler.requests = []
+        RangeHandler.support_range = True
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/audio.m4a'
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'audio.m4a')
+        self.downloader = RangeDownloader(HttpClient(), connections=4, min_segment=64 * 1024,
+                                          chunk_size=16 * 1024, max_retries=1)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def test_parallel_segments(self):
+        states = []
+        self.downloader.download(self.url, self.path, on_state=states.append, state_interval=0.01)
+
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), CONTENT)
+        self.assertFalse(os.path.exists(f'{self.path}.part'))
+        # 探测请求之外，分段请求覆盖整个文件
+        ranges = [r for r in RangeHandler.requests if r != (0, 0)]
+        self.assertGreaterEqual(len(ranges), 4)
+        self.assertTrue(states)
+        self.assertTrue(all(pos == end for _, end, pos in states[-1]['segments']))
+
+    def test_resume_from_saved_state(self):
+        half = len(CONTENT) // 2
+        with open(f'{self.path}.part', 'wb') as f:
+            f.write(CONTENT[:half])
+            f.truncate(len(CONTENT))
+        state = {'size': len(CONTENT), 'segments': [[0, half, half], [half, len(CONTENT), half]]}
+
+        self.downloader.download(self.url, self.path, state=state)
+
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), CONTENT)
+        # 已完成的前半部分没有再次请求
+        starts = [start for start, end in RangeHandler.requests if (start, end) != (0, 0)]
+        self.assertTrue(starts)
+        self.assertTrue(all(start >= half for start in starts))
+
+    def test_state_only_covers_synced_data(self):
+        lock = threading.Lock()
+        segment = {'start': 0, 'end': 1024, 'pos': 0, 'saved': 0}
+        with open(f'{self.path}.part', 'wb') as f:
+            f.write(b'x' * 512)
+            segment['pos'] = 512
+            # 写入缓冲区但尚未刷盘的数据不计入续传状态
+            self.assertEqual(RangeDownloader._snapshot(1024, [segment], lock)['segments'], [[0, 1024, 0]])
+            RangeDownloader._sync(f, segment, lock)
+            self.assertEqual(os.path.getsize(f'{self.path}.part'), 512)
+        self.assertEqual(RangeDownloader._snapshot(1024, [segment], lock)['segments'], [[0, 1024, 512]])
+
+    def test_youtubedl_uses_segmented_download(self):
+        states, progress = [], []
+        info = {'url': self.url, 'protocol': 'http', 'format_id': '30280', 'ext': 'm4a', 'http_headers': {}}
+        with SegmentedYoutubeDL({'quiet': True, 'progress_hooks': [progress.append]}, self.downloader,
+                                on_state=states.append) as ydl:
+            self.assertEqual(ydl.dl(self.path, info), (True, True))
+
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), CONTENT)
+        self.assertEqual(states[-1]['format_id'], '30280')
+        self.assertEqual(progress[-1]['status'], 'finished')
+
+    def test_probe_without_range_support(self):
+        RangeHandler.support_range = False
+        self.assertIsNone(self.downloader.probe(self.url))
+
+    def test_idle_connection_splits_largest_segment(self):
+        lock = threading.Lock()
+        segments = [{'start': 0, 'end': 1024 * 1024, 'pos': 100 * 1024, 'active': True},
+                    {'start': 0, 'end': 200 * 1024, 'pos': 150 * 1024, 'active': True}]
+
+        segment = self.downloader._next_segment(segments, lock)
+
+        self.assertEqual(segment['end'], 1024 * 1024)
+        self.assertEqual(segments[0]['end'], segment['start'])
+        self.assertEqual(segment['start'], 100 * 1024 + 462 * 1024)
+        # 剩余太少的分段不再拆分
+        self.assertIsNone(self.downloader._next_segment([segments[1]], lock))
+
+
+if __name__ == '__main__':
+    unittest.main()
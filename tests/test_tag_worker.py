@@ -0,0 +1,78 @@
+import os
+import struct
+import tempfile
+import unittest
+
+from mutagen.mp3 import MP3
+from mutagen.mp4 import MP4
+
+from src.utils.tag_worker import TagWorkerPool, write_tags
+
+# 128kbps / 44.1kHz 的空白 MPEG-1 Layer III 帧
+MP3_FRAME = b'\xff\xfb\x90\x64' + b'\x00' * 413
+
+
+def _atom(name, data=b'', full=False):
+    if full:
+        data = b'\x00' * 4 + data
+    return struct.pack('>I', 8 + len(data)) + name + data
+
+
+# 只包含一条空音轨的最小 m4a 文件
+M4A_FILE = _atom(b'ftyp', b'M4A \x00\x00\x00\x00M4A mp42isom') + _atom(b'moov', (
+    _atom(b'mvhd', struct.pack('>IIII', 0, 0, 1000, 0) + b'\x00' * 80, full=True)
+    + _atom(b'trak', _atom(b'mdia', (
+        _atom(b'mdhd', struct.pack('>IIIIHH', 0, 0, 44100, 44100, 0, 0), full=True)
+        + _atom(b'hdlr', b'\x00' * 4 + b'soun' + b'\x00' * 13, full=True)
+        + _atom(b'minf', _atom(b'stbl', _atom(b'stsd', b'\x00' * 4, full=True)))
+    )))
+))
+
+
+class TestTagWorkerPool(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.pool = TagWorkerPool(workers=2, max_pending=2)
+
+    def tearDown(self):
+        self.pool.shutdown()
+        self.tmp.cleanup()
+
+    def _mp3(self, name):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'wb') as f:
+            f.write(MP3_FRAME * 20)
+        return path
+
+    def test_tags_written_in_background(self):
+        paths = [self._mp3(f'{i}.mp3') for i in range(6)]
+        futures = [self.pool.submit(path, {'title': f'第{i}集'}, b'cover') for i, path in enumerate(paths)]
+
+        for i, future in enumerate(futures):
+            self.assertEqual(future.result(timeout=5), paths[i])
+            tags = MP3(paths[i]).tags
+            self.assertEqual(str(tags['TIT2']), f'第{i}集')
+            self.assertEqual(tags['APIC:Cover'].data, b'cover')
+
+    def test_errors_reported_through_callback(self):
+        errors = []
+        future = self.pool.submit(os.path.join(self.tmp.name, 'missing.mp3'),
+                                  callback=lambda f: errors.append(f.exception()))
+        self.assertIsInstance(future.exception(timeout=5), FileNotFoundError)
+        self.assertEqual(len(errors), 1)
+
+    def test_m4a_tags(self):
+        path = os.path.join(self.tmp.name, 'book.m4a')
+        with open(path, 'wb') as f:
+            f.write(M4A_FILE)
+
+        write_tags(path, {'title': '第一集', 'album': '有声书'}, b'cover')
+
+        tags = MP4(path).tags
+        self.assertEqual(tags['\xa9nam'], ['第一集'])
+        self.assertEqual(tags['\xa9alb'], ['有声书'])
+        self.assertEqual(bytes(tags['covr'][0]), b'cover')
+
+
+if __name__ == '__main__':
+    unittest.main()
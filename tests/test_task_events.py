@@ -0,0 +1,45 @@
+import threading
+import time
+import unittest
+
+from src.utils.task_events import TaskEventHub, TaskEventStream
+
+
+class TestTaskEvents(unittest.TestCase):
+    def test_updates_are_coalesced(self):
+        stream = TaskEventStream(min_interval=0)
+        for progress in range(10):
+            stream.publish('task', {'progress': progress, 'status': 'progress'})
+        stream.publish('other', {'status': 'running'})
+
+        batch = stream.next_batch(timeout=1)
+        self.assertEqual(batch, {
+            'task': {'progress': 9, 'status': 'progress'},
+            'other': {'status': 'running'}
+        })
+        self.assertEqual(stream.next_batch(timeout=0.05), {})
+
+    def test_min_interval(self):
+        stream = TaskEventStream(min_interval=0.2)
+        stream.publish('task', {'progress': 1})
+        stream.next_batch(timeout=1)
+
+        threading.Timer(0.05, stream.publish, ('task', {'progress': 2})).start()
+        threading.Timer(0.1, stream.publish, ('task', {'progress': 3})).start()
+        start = time.monotonic()
+        batch = stream.next_batch(timeout=1)
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+        self.assertEqual(batch, {'task': {'progress': 3}})
+
+    def test_hub_filters_by_task(self):
+        hub = TaskEventHub()
+        stream = hub.subscribe(['a'])
+        hub.publish('a', {'progress': 1})
+        hub.publish('b', {'progress': 2})
+        self.assertEqual(stream.next_batch(timeout=1), {'a': {'progress': 1}})
+        hub.unsubscribe(stream)
+        self.assertTrue(stream.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
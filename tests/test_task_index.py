@@ -0,0 +1,57 @@
+import unittest
+
+from src.utils.task_index import TaskIndex
+
+
+def summary(task_id, status, day):
+    return {'task_id': task_id, 'status': status, 'created_at': f'2024-01-{day:02d}T00:00:00', 'title': task_id}
+
+
+class TestTaskIndex(unittest.TestCase):
+    def setUp(self):
+        statuses = ['completed', 'running', 'failed', 'queued']
+        self.index = TaskIndex(summary(f't{day}', statuses[day % 4], day) for day in range(1, 21))
+
+    def _ids(self, summaries):
+        return [s['task_id'] for s in summaries]
+
+    def test_latest_and_counts(self):
+        self.assertEqual(self.index.latest()['task_id'], 't20')
+        self.assertEqual(self.index.count(), 20)
+        self.assertEqual(self.index.counts()['running'], 5)
+
+        self.index.update(summary('t21', 'queued', 21))
+        self.assertEqual(self.index.latest()['task_id'], 't21')
+        self.index.remove('t21')
+        self.assertEqual(self.index.latest()['task_id'], 't20')
+
+    def test_cursor_pagination_covers_every_task_once(self):
+        seen, cursor = [], None
+        while True:
+            page, cursor = self.index.page(cursor=cursor, limit=6)
+            seen.extend(self._ids(page))
+            if cursor is None:
+                break
+        self.assertEqual(seen, [f't{day}' for day in range(20, 0, -1)])
+
+    def test_status_filter_merges_in_creation_order(self):
+        page, cursor = self.index.page(statuses=['running', 'queued'], limit=4)
+        self.assertEqual(self._ids(page), ['t19', 't17', 't15', 't13'])
+        page, cursor = self.index.page(statuses=['running', 'queued'], cursor=cursor, limit=10)
+        self.assertEqual(self._ids(page), ['t11', 't9', 't7', 't5', 't3', 't1'])
+        self.assertIsNone(cursor)
+        self.assertEqual(self.index.count(['running', 'queued']), 10)
+
+    def test_status_change_moves_task(self):
+        self.index.update(summary('t19', 'completed', 19))
+        self.assertNotIn('t19', self._ids(self.index.page(statuses=['queued'])[0]))
+        self.assertEqual(self._ids(self.index.page(statuses=['completed'], limit=2)[0]), ['t20', 't19'])
+        self.assertEqual(self.index.count(), 20)
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            self.index.page(cursor='not-a-cursor')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import tempfile
+import unittest
+
+from src.utils.database import Database
+from src.utils.task_manager import TaskManager
+
+
+class TestTaskManager(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.tmp.name, 'test.db'))
+        self.db.save_tasks([
+            ('old', {'task_id': 'old', 'status': 'completed', 'created_at': '2024-01-01T00:00:00',
+                     'completed_at': '2024-01-01T01:00:00', 'title': '旧任务', 'is_series': False}),
+            ('new', {'task_id': 'new', 'status': 'running', 'created_at': '2024-03-01T00:00:00',
+                     'title': '新任务', 'is_series': False, 'progress': 10}),
+            ('waiting', {'task_id': 'waiting', 'status': 'queued', 'created_at': '2024-02-01T00:00:00',
+                         'is_series': False, 'queue_position': 1}),
+        ])
+        self.manager = TaskManager(db=self.db)
+
+    def tearDown(self):
+        self.manager.jobs.shutdown()
+        self.manager.store.close()
+        self.tmp.cleanup()
+
+    def test_startup_does_not_load_task_bodies(self):
+        # 启动时只读取上次仍在排队的任务，标记失败后不留在内存中
+        self.assertEqual(self.manager.active_tasks, {})
+        self.assertIsNone(self.manager._index)
+        self.assertEqual(self.manager.get_task('waiting')['status'], 'failed')
+
+        task = self.manager.get_task('new')
+        self.assertEqual(task['progress'], 10)
+        self.assertIs(self.manager.get_task('new'), task)
+        self.assertIsNone(self.manager.get_task('missing'))
+
+    def test_index_tracks_updates(self):
+        self.assertEqual(self.manager.get_latest_task()['task_id'], 'new')
+        self.assertEqual(set(self.manager.active_tasks), {'new'})
+
+        self.manager.update_task('old', {'status': 'failed', 'title': '改名'})
+        self.assertEqual(self.manager._task_index().get('old')['title'], '改名')
+
+        task_id = self.manager.create_task(bvid='BV1xx411c7mD', output_dir=self.tmp.name)
+        self.assertEqual(self.manager.get_latest_task()['task_id'], task_id)
+        tasks, cursor = self.manager.get_active_tasks(limit=2)
+        self.assertEqual([task['task_id'] for task in tasks], [task_id, 'new'])
+        tasks, cursor = self.manager.get_active_tasks(['failed'], cursor)
+        self.assertEqual([task['task_id'] for task in tasks], ['waiting', 'old'])
+        self.assertIsNone(cursor)
+        self.assertEqual(self.manager.count_tasks(), 4)
+
+    def test_download_events_keep_task_running(self):
+        task_id = self.manager.create_task(bvid='BV1xx411c7mD', output_dir=self.tmp.name, status='queued')
+        self.manager._start_job(task_id)
+        for event in ({'status': 'progress', 'progress': 20, 'part': 1},
+                      {'status': 'success', 'progress': 50, 'part': 1},
+                      {'status': 'error', 'message': '下载失败', 'part': 2}):
+            self.manager.update_task(task_id, event)
+
+        task = self.manager.get_task(task_id)
+        self.assertEqual(task['status'], 'running')
+        self.assertEqual(task['part_status'], 'error')
+        self.assertEqual(task['parts_done'], 1)
+        tasks, _ = self.manager.get_active_tasks(['running'])
+        self.assertEqual([task['task_id'] for task in tasks], [task_id, 'new'])
+
+        self.manager.update_task(task_id, {'status': 'completed', 'progress': 100})
+        self.assertEqual(self.manager.count_tasks(['running']), 1)
+        self.assertEqual(self.manager.get_task(task_id)['status'], 'completed')
+
+    def test_finished_tasks_are_not_cached(self):
+        task_id = self.manager.create_task(bvid='BV1xx411c7mD', output_dir=self.tmp.name)
+        self.assertIn(task_id, self.manager.active_tasks)
+        self.manager.update_task(task_id, {'status': 'completed', 'progress': 100})
+        self.assertNotIn(task_id, self.manager.active_tasks)
+
+        # 按需读取的已结束任务也不缓存，更新后仍能读到最新内容
+        self.manager.get_active_tasks()
+        self.assertEqual(set(self.manager.active_tasks), {'new'})
+        self.manager.update_task('old', {'title': '改名'})
+        self.assertEqual(self.manager.get_task('old')['title'], '改名')
+        self.assertEqual(self.manager.get_task(task_id)['progress'], 100)
+        self.assertEqual(set(self.manager.active_tasks), {'new'})
+
+    def test_cleanup_removes_old_finished_tasks(self):
+        self.manager.cleanup_completed_tasks(max_age_hours=24)
+        self.assertIsNone(self.manager.get_task('old'))
+        self.assertEqual(set(self.db.load_task_index()), {'new', 'waiting'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from src.utils.database import Database
+from src.utils.task_store import TaskStore
+
+
+class TestTaskStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.tmp.name, 'test.db'))
+        self.store = TaskStore(self.db, flush_interval=3600)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def _read(self, task_id):
+        return self.db.load_tasks()[task_id]
+
+    def test_progress_updates_are_coalesced(self):
+        task = {'status': 'running', 'progress': 0}
+        self.store.save('t1', task, immediate=True)
+        for progress in range(1, 50):
+            task['progress'] = progress
+            self.store.save('t1', task)
+
+        # 进度更新只在刷新时写入
+        self.assertEqual(self._read('t1')['progress'], 0)
+        self.store.flush()
+        self.assertEqual(self._read('t1')['progress'], 49)
+
+    def test_reload(self):
+        self.store.save('t1', {'status': 'completed', 'title': '有声书'}, immediate=True)
+        db = Database(os.path.join(self.tmp.name, 'test.db'))
+        self.assertEqual(TaskStore(db).load_all(), {'t1': {'status': 'completed', 'title': '有声书'}})
+
+    def test_stale_flush_does_not_overwrite_final_status(self):
+        save_tasks = self.db.save_tasks
+        started, release = threading.Event(), threading.Event()
+
+        def slow_save(items):
+            items = list(items)
+            if items[0][1]['status'] == 'running':
+                started.set()
+                release.wait(5)
+            save_tasks(items)
+
+        self.store.save('t1', {'status': 'running'})
+        with mock.patch.object(self.db, 'save_tasks', side_effect=slow_save):
+            background = threading.Thread(target=self.store.flush)
+            background.start()
+            self.assertTrue(started.wait(5))
+            # 后台刷新写入旧状态期间，任务结束并要求立即写入
+            final = threading.Thread(target=self.store.save, args=('t1', {'status': 'completed'}, True))
+            final.start()
+            final.join(0.2)
+            release.set()
+            background.join(5)
+            final.join(5)
+        self.assertEqual(self._read('t1')['status'], 'completed')
+
+    def test_delete(self):
+        self.store.save('t1', {'status': 'failed'}, immediate=True)
+        self.store.delete('t1')
+        self.store.flush()
+        self.assertEqual(self.store.load_all(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
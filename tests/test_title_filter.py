@@ -0,0 +1,44 @@
+import json
+import os
+import tempfile
+import unittest
+
+from src.utils.title_filter import TitleFilter
+
+
+class TestTitleFilter(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.config_file = os.path.join(self.tmp.name, 'config', 'keywords_filter.json')
+        os.makedirs(os.path.dirname(self.config_file))
+        with open(self.config_file, 'w', encoding='utf-8') as f:
+            json.dump({
+                'remove_chars': ['《', '》', '【', '】', '(完)'],
+                'remove_words': ['有声', '有声小说', '完整版'],
+                'replace_rules': [{'from': '第一季', 'to': 'S01'}, {'from': '第一季', 'to': 'X'}]
+            }, f, ensure_ascii=False)
+        self.title_filter = TitleFilter(self.config_file)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_filter_title(self):
+        self.assertEqual(self.title_filter.filter_title('【有声小说】《三体》 第一季  完整版(完)'), '三体 S01')
+        self.assertEqual(self.title_filter.filter_title(''), '')
+
+    def test_filter_titles(self):
+        titles = ['《三体》第一季', '', '有声 球状闪电']
+        self.assertEqual(self.title_filter.filter_titles(titles), ['三体S01', '', '球状闪电'])
+
+    def test_rules_rebuilt_on_save_and_load(self):
+        self.assertEqual(self.title_filter.filter_title('三体 精品'), '三体 精品')
+        self.title_filter.remove_words = ['精品']
+        self.title_filter.save_config()
+        self.assertEqual(self.title_filter.filter_title('三体 精品'), '三体')
+
+        other = TitleFilter(self.config_file)
+        self.assertEqual(other.filter_title('三体 精品 有声'), '三体 有声')
+
+
+if __name__ == '__main__':
+    unittest.main()
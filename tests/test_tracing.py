@@ -0,0 +1,72 @@
+import threading
+import unittest
+
+from src.utils.metrics import MetricsRegistry
+from src.utils.tracing import Tracer
+
+
+class TestTracer(unittest.TestCase):
+    def _spans(self, trace):
+        return {event['name']: event for event in trace['traceEvents'] if event['ph'] == 'X'}
+
+    def test_disabled_records_nothing(self):
+        tracer = Tracer(max_tasks=0)
+        with tracer.task('t1'), tracer.span('download'):
+            self.assertIsNone(tracer.current())
+        self.assertIsNone(tracer.export('t1'))
+
+    def test_spans_follow_task_across_threads(self):
+        tracer = Tracer(max_tasks=2)
+        metrics = MetricsRegistry()
+        with tracer.task('t1'):
+            with tracer.span('job', cat='task', bvid='BV1xx411c7mD'):
+                with metrics.stage('extract_info', part=1):
+                    pass
+                trace = tracer.current()
+
+                def work():
+                    with tracer.bind(trace), tracer.span('tag'):
+                        pass
+                worker = threading.Thread(target=work, name='tag-worker-test')
+                worker.start()
+                worker.join()
+        # 不在任务中时不记录
+        with tracer.span('outside'):
+            pass
+
+        exported = tracer.export('t1')
+        spans = self._spans(exported)
+        self.assertEqual(set(spans), {'job', 'extract_info', 'tag'})
+        self.assertEqual(spans['job']['args'], {'bvid': 'BV1xx411c7mD'})
+        self.assertEqual(spans['extract_info']['args'], {'part': 1})
+        self.assertLessEqual(spans['job']['ts'], spans['extract_info']['ts'])
+        self.assertNotEqual(spans['tag']['tid'], spans['job']['tid'])
+        thread_names = {event['args']['name'] for event in exported['traceEvents'] if event['name'] == 'thread_name'}
+        self.assertIn('tag-worker-test', thread_names)
+        self.assertEqual(metrics.value('bilipala_stage_duration_seconds', stage='extract_info')[0], 1)
+
+    def test_errors_and_limits(self):
+        tracer = Tracer(max_tasks=2, max_events=2)
+        with tracer.task('t1'):
+            with self.assertRaises(ValueError):
+                with tracer.span('download'):
+                    raise ValueError('断开')
+            tracer.record('queue_wait', tracer.epoch)
+            with tracer.span('dropped'):
+                pass
+        exported = tracer.export('t1')
+        spans = self._spans(exported)
+        self.assertEqual(spans['download']['args']['error'], 'ValueError: 断开')
+        self.assertIn('queue_wait', spans)
+        self.assertEqual(exported['otherData']['dropped_events'], 1)
+
+        # 只保留最近的任务
+        for task_id in ('t2', 't3'):
+            with tracer.task(task_id):
+                pass
+        self.assertIsNone(tracer.export('t1'))
+        self.assertIsNotNone(tracer.export('t3'))
+
+
+if __name__ == '__main__':
+    unittest.main()
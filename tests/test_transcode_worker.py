@@ -0,0 +1,74 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from src.utils.transcode_worker import TranscodePool
+
+
+class FakeProcessor:
+    """代替 FFmpeg 的转码器：把输入文件内容写入输出文件"""
+
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+        self.release = threading.Event()
+
+    def extract_audio(self, input_path, output_path, quality='192k', audio_format=None):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        self.release.wait(5)
+        with open(input_path, 'rb') as src, open(output_path, 'wb') as dst:
+            dst.write(src.read())
+        with self.lock:
+            self.running -= 1
+        return not input_path.endswith('bad.m4a')
+
+
+class TestTranscodePool(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.processor = FakeProcessor()
+        self.pool = TranscodePool(workers=2, max_pending=4, processor=self.processor)
+
+    def tearDown(self):
+        self.processor.release.set()
+        self.pool.shutdown()
+        self.tmp.cleanup()
+
+    def _source(self, name):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'wb') as f:
+            f.write(name.encode('utf-8'))
+        return path
+
+    def test_transcode_in_parallel_and_remove_source(self):
+        sources = [self._source(f'{i}.m4a') for i in range(4)]
+        futures = [self.pool.submit(src, src[:-4] + '.mp3') for src in sources]
+        # 两个工作线程同时转码后再放行
+        deadline = time.monotonic() + 5
+        while self.processor.running < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.processor.release.set()
+
+        for src, future in zip(sources, futures):
+            self.assertEqual(future.result(timeout=5), src[:-4] + '.mp3')
+            self.assertFalse(os.path.exists(src))
+        self.assertEqual(self.processor.max_running, 2)
+
+    def test_failure_reported_through_callback(self):
+        errors = []
+        self.processor.release.set()
+        src = self._source('bad.m4a')
+        future = self.pool.submit(src, src[:-4] + '.mp3', callback=lambda f: errors.append(f.exception()))
+        self.assertIsInstance(future.exception(timeout=5), RuntimeError)
+        self.assertEqual(len(errors), 1)
+        # 转码失败时保留原始文件
+        self.assertTrue(os.path.exists(src))
+
+
+if __name__ == '__main__':
+    unittest.main()